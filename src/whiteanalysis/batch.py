@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Callable, ClassVar, Dict, List, Optional, Tuple
+
+import structlog
+from instructor import openai_schema
+from openai.types import CompletionUsage
+from pydantic import BaseModel, ValidationError
+
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.options import AnalysisOptions
+from whiteanalysis.prompts import (
+    Insights,
+    create_batched_prompts,
+    create_full_paper_prompts,
+)
+from whiteanalysis.utils import return_client
+
+logger = structlog.get_logger()
+
+# Batch states after which no more results will arrive
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# Tool schema instructor sends for `Insights`, built once for all requests
+INSIGHTS_TOOL = openai_schema(Insights).openai_schema
+
+
+class BatchRequest(BaseModel):
+    """The (document, case, batch) unit behind a request of a batch job."""
+
+    filename: str
+    case_name: str
+    batch: int
+    prompt_key: str
+
+
+class BatchJob(BaseModel):
+    """A submitted batch, stored as `batch.json` in the run folder."""
+
+    filename: ClassVar[str] = "batch.json"
+
+    backend: str
+    backend_folder: Optional[str] = None
+    batch_id: str = ""
+    model: str
+    cases: Dict[str, str] = {}
+    requests: Dict[str, BatchRequest] = {}
+
+    def save(self, run_dir: str) -> None:
+        with open(os.path.join(run_dir, self.filename), "w", encoding="utf-8") as f:
+            f.write(self.model_dump_json(indent=2))
+
+    @classmethod
+    def load(cls, run_dir: str) -> "BatchJob":
+        with open(os.path.join(run_dir, cls.filename), "r", encoding="utf-8") as f:
+            return cls.model_validate_json(f.read())
+
+
+def case_prompts(
+    pages: List[PDFDocument], case_text: str, encodings, options: AnalysisOptions
+) -> List[List[Dict]]:
+    """The prompts `process_case` sends for a document and a case."""
+    total_length = sum(x.token_count(encodings) for x in pages)
+    if total_length < options.prompt_batch_size:
+        return [
+            create_full_paper_prompts(
+                pages, case_text, encodings, options.prompt_layout
+            )
+        ]
+    return create_batched_prompts(
+        pages,
+        case_text,
+        options.prompt_batch_size,
+        encodings,
+        options.split_pages,
+        options.prompt_layout,
+    )
+
+
+def request_body(prompt: List[Dict], model: str) -> Dict:
+    """Chat completion request forcing the `Insights` tool, as instructor sends it."""
+    return {
+        "model": model,
+        "messages": prompt,
+        "tools": [{"type": "function", "function": INSIGHTS_TOOL}],
+        "tool_choice": {
+            "type": "function",
+            "function": {"name": INSIGHTS_TOOL["name"]},
+        },
+    }
+
+
+def parse_result(row: Dict) -> Tuple[Insights, Optional[CompletionUsage]]:
+    """Validates one line of a batch output file into `Insights`.
+
+    Raises:
+        ValueError: If the request failed or the response does not validate
+    """
+    response = row.get("response") or {}
+    if row.get("error") or response.get("status_code") != 200:
+        raise ValueError(str(row.get("error") or response.get("body")))
+    body = response["body"]
+    usage = CompletionUsage.model_validate(body["usage"]) if body.get("usage") else None
+    try:
+        tool_call = body["choices"][0]["message"]["tool_calls"][0]
+        return Insights.model_validate_json(tool_call["function"]["arguments"]), usage
+    except (KeyError, IndexError, TypeError, ValidationError) as e:
+        raise ValueError(f"Invalid batch response: {e}") from e
+
+
+class OpenAIBatchBackend:
+    """Runs batch files through the OpenAI Batch API."""
+
+    name = "openai"
+
+    def __init__(self):
+        _, self.client = return_client()
+
+    def submit(self, path: str) -> str:
+        with open(path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id: str, path: str) -> None:
+        """Writes the output and error lines of a finished batch to `path`."""
+        batch = self.client.batches.retrieve(batch_id)
+        with open(path, "w", encoding="utf-8") as f:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    f.write(self.client.files.content(file_id).text)
+
+
+def empty_response(body: Dict) -> Dict:
+    """Local stand-in answer: a tool call with empty insights."""
+    name = body["tool_choice"]["function"]["name"]
+    insights = Insights(general_context="", general_relation="", quotes=[])
+    return {
+        "object": "chat.completion",
+        "model": body["model"],
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [
+                        {
+                            "id": f"call_{uuid.uuid4().hex}",
+                            "type": "function",
+                            "function": {
+                                "name": name,
+                                "arguments": insights.model_dump_json(),
+                            },
+                        }
+                    ],
+                },
+            }
+        ],
+    }
+
+
+class LocalBatchBackend:
+    """File-based stand-in for the Batch API.
+
+    Submitted batch files are copied to `folder/<batch_id>/input.jsonl`. The
+    first status poll completes the batch by answering every request with
+    `respond` and writing the results in the Batch API output format, so the
+    whole submit/collect flow runs without network access.
+    """
+
+    name = "local"
+
+    def __init__(
+        self,
+        folder: str,
+        respond: Callable[[Dict], Dict] = empty_response,
+    ):
+        self.folder = folder
+        self.respond = respond
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.folder, batch_id, name)
+
+    def submit(self, path: str) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.folder, batch_id))
+        shutil.copyfile(path, self._path(batch_id, "input.jsonl"))
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        if not os.path.exists(self._path(batch_id, "input.jsonl")):
+            return "failed"
+        if not os.path.exists(self._path(batch_id, "output.jsonl")):
+            self._complete(batch_id)
+        return "completed"
+
+    def _complete(self, batch_id: str) -> None:
+        tmp_path = self._path(batch_id, "output.jsonl.tmp")
+        with open(self._path(batch_id, "input.jsonl"), "r", encoding="utf-8") as f:
+            with open(tmp_path, "w", encoding="utf-8") as out:
+                for line in f:
+                    request = json.loads(line)
+                    row = {
+                        "id": f"batch_req_{uuid.uuid4().hex}",
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": self.respond(request["body"]),
+                        },
+                        "error": None,
+                    }
+                    out.write(json.dumps(row) + "\n")
+        os.replace(tmp_path, self._path(batch_id, "output.jsonl"))
+
+    def download(self, batch_id: str, path: str) -> None:
+        shutil.copyfile(self._path(batch_id, "output.jsonl"), path)
+
+
+def get_backend(name: str, folder: Optional[str] = None):
+    """Returns the batch backend called `name` ("openai" or "local")."""
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        return LocalBatchBackend(folder or ".whiteanalysis_batches")
+    raise ValueError(f"Unknown batch backend: {name}")
+
+
+def wait_for_batch(backend, batch_id: str, poll_interval: float) -> str:
+    """Polls a batch until it reaches a final status and returns the status."""
+    while True:
+        status = backend.status(batch_id)
+        if status in FINAL_STATUSES:
+            return status
+        logger.info("Waiting for batch", batch_id=batch_id, status=status)
+        time.sleep(poll_interval)
@@ -0,0 +1,304 @@
+import json
+import os
+import random
+import resource
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import structlog
+from pydantic import BaseModel
+
+from whiteanalysis.timing import StageStats
+from whiteanalysis.usage import UsageStats
+
+logger = structlog.get_logger()
+
+
+class MockSettings(BaseModel):
+    """Behaviour of the mock API server."""
+
+    latency: float = 0.5
+    jitter: float = 0.1
+    error_rate: float = 0.0
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    quotes: int = 3
+
+
+class MockStats(BaseModel):
+    """Requests seen by the mock API server."""
+
+    requests: int = 0
+    completed: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (4 characters per token), cheap enough for the mock."""
+    return len(text) // 4 + 1
+
+
+def sample_schema(schema: Dict, defs: Dict, quotes: int, text: str):
+    """Builds an instance of a JSON schema, filling strings with `text`."""
+    if "$ref" in schema:
+        return sample_schema(defs[schema["$ref"].split("/")[-1]], defs, quotes, text)
+    if "allOf" in schema:
+        return sample_schema(schema["allOf"][0], defs, quotes, text)
+    kind = schema.get("type")
+    if kind == "object":
+        return {
+            name: sample_schema(value, defs, quotes, text)
+            for name, value in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [
+            sample_schema(schema["items"], defs, quotes, text) for _ in range(quotes)
+        ]
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    return text
+
+
+class MockServer:
+    """OpenAI-compatible chat completions endpoint for benchmarks.
+
+    Every request is answered with a tool call that fills the requested tool's
+    schema, after `latency` seconds (plus up to `jitter`). A share of
+    `error_rate` requests fail with a 500 error, and requests beyond the
+    per-minute limits get a 429 with the usual rate-limit headers.
+    """
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.stats = MockStats()
+        self._lock = threading.Lock()
+        self._window: deque = deque()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode()
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _admit(self, tokens: int) -> Dict[str, str]:
+        """Charges a request to the limits; returns the rate-limit headers.
+
+        Raises:
+            OverflowError: If the request exceeds a limit
+        """
+        rpm = self.settings.requests_per_minute
+        tpm = self.settings.tokens_per_minute
+        now = time.monotonic()
+        with self._lock:
+            self.stats.requests += 1
+            while self._window and now - self._window[0][0] > 60:
+                self._window.popleft()
+            used_requests = len(self._window)
+            used_tokens = sum(x[1] for x in self._window)
+            headers = {}
+            if rpm:
+                headers["x-ratelimit-limit-requests"] = str(rpm)
+                headers["x-ratelimit-remaining-requests"] = str(
+                    max(rpm - used_requests - 1, 0)
+                )
+            if tpm:
+                headers["x-ratelimit-limit-tokens"] = str(tpm)
+                headers["x-ratelimit-remaining-tokens"] = str(
+                    max(tpm - used_tokens - tokens, 0)
+                )
+            if (rpm and used_requests >= rpm) or (tpm and used_tokens + tokens > tpm):
+                self.stats.rate_limited += 1
+                reset = 60 - (now - self._window[0][0]) if self._window else 1
+                headers["retry-after"] = f"{max(reset, 0.1):.2f}"
+                raise OverflowError(headers)
+            self._window.append((now, tokens))
+            self.stats.prompt_tokens += tokens
+        return headers
+
+    def respond(self, body: Dict) -> Dict:
+        """Chat completion answering the forced tool call of `body`."""
+        function = body["tool_choice"]["function"]["name"]
+        schema = next(
+            x["function"]["parameters"]
+            for x in body["tools"]
+            if x["function"]["name"] == function
+        )
+        source = next(
+            (m["content"] for m in body["messages"] if m["role"] == "user"), ""
+        )
+        words = source.split()
+        start = random.randrange(max(len(words) - 30, 1))
+        arguments = json.dumps(
+            sample_schema(
+                schema,
+                schema.get("$defs", {}),
+                self.settings.quotes,
+                " ".join(words[start : start + 30]) or "text",
+            )
+        )
+        prompt_tokens = sum(
+            estimate_tokens(str(m.get("content", ""))) for m in body["messages"]
+        )
+        completion_tokens = estimate_tokens(arguments)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {
+                        "role": "assistant",
+                        "content": None,
+                        "tool_calls": [
+                            {
+                                "id": f"call_{uuid.uuid4().hex}",
+                                "type": "function",
+                                "function": {"name": function, "arguments": arguments},
+                            }
+                        ],
+                    },
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def _send(self, status: int, payload: Dict, headers: Dict[str, str]):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("content-length", 0))
+                body = json.loads(self.rfile.read(length))
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "Not found"}}, {})
+                    return
+                tokens = sum(
+                    estimate_tokens(str(m.get("content", "")))
+                    for m in body.get("messages", [])
+                )
+                try:
+                    headers = server._admit(tokens)
+                except OverflowError as e:
+                    error = {"message": "Rate limit reached", "type": "requests"}
+                    self._send(429, {"error": error}, e.args[0])
+                    return
+                settings = server.settings
+                time.sleep(settings.latency + random.uniform(0, settings.jitter))
+                if random.random() < settings.error_rate:
+                    with server._lock:
+                        server.stats.errors += 1
+                    self._send(500, {"error": {"message": "Mock error"}}, headers)
+                    return
+                response = server.respond(body)
+                with server._lock:
+                    server.stats.completed += 1
+                    server.stats.completion_tokens += response["usage"][
+                        "completion_tokens"
+                    ]
+                self._send(200, response, headers)
+
+        return Handler
+
+
+def use_mock_server(server: MockServer) -> None:
+    """Points the API clients at the mock server."""
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["OPENAI_API_KEY"] = "mock"
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process and its finished children."""
+    kilobytes = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return kilobytes / 1024
+
+
+class BenchmarkReport(BaseModel):
+    """Throughput and resource use of a benchmark run.
+
+    `documents` counts the documents whose cases all finished; throughput is
+    computed from them only.
+    """
+
+    documents: int
+    failed: int
+    seconds: float
+    documents_per_minute: float
+    calls_per_minute: float
+    tokens_per_second: float
+    peak_rss_mb: float
+    server: MockStats
+    usage: Dict[str, UsageStats]
+    stages: Dict[str, StageStats]
+
+
+def benchmark_report(
+    documents: int,
+    failed: int,
+    seconds: float,
+    server: MockStats,
+    usage: Dict[str, UsageStats],
+    stages: Dict[str, StageStats],
+) -> BenchmarkReport:
+    minutes = max(seconds, 1e-9) / 60
+    tokens = server.prompt_tokens + server.completion_tokens
+    return BenchmarkReport(
+        documents=documents,
+        failed=failed,
+        seconds=round(seconds, 3),
+        documents_per_minute=round(documents / minutes, 2),
+        calls_per_minute=round(server.requests / minutes, 2),
+        tokens_per_second=round(tokens / (minutes * 60), 1),
+        peak_rss_mb=round(peak_rss_mb(), 1),
+        server=server,
+        usage=usage,
+        stages=stages,
+    )
@@ -0,0 +1,289 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Type, TypeVar
+
+import structlog
+from pydantic import BaseModel, ValidationError
+
+from whiteanalysis.file_handling import EXTRACTOR_VERSION, PDFDocument
+
+logger = structlog.get_logger()
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# Share of `max_size` the response cache is shrunk to when it overflows, so
+# that eviction runs once per many puts rather than after each one
+EVICT_TARGET = 0.9
+
+
+def response_cache_key(
+    model: str, response_model: Type[BaseModel], messages: List[Dict]
+) -> str:
+    """Content hash of everything that determines an API response."""
+    payload = json.dumps(
+        {
+            "model": model,
+            "schema": response_model.model_json_schema(),
+            "messages": messages,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite store of validated responses, keyed by `response_cache_key`.
+
+    Entries older than `max_age_days` are ignored and removed. When the stored
+    responses exceed `max_size_mb`, the least recently used ones are evicted
+    down to `EVICT_TARGET` of it. Puts only add to a running size counter; the
+    store is scanned when the counter crosses the limit. Hits only record their
+    access time in memory; the times are written with the next put, eviction or
+    close, so reads never write to the database.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_age_days: Optional[float] = None,
+        max_size_mb: Optional[float] = None,
+    ):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.max_size = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self._lock = threading.Lock()
+        # Upper bound of the stored response size, exact after each eviction
+        self._size = 0
+        # Access times of hits not yet written to the store
+        self._touched: Dict[str, float] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str, response_model: Type[ModelT]) -> Optional[ModelT]:
+        """Returns the cached response, or None if missing, expired or invalid."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.max_age and now - row[1] > self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._touched[key] = now
+        try:
+            return response_model.model_validate_json(row[0])
+        except ValidationError:
+            logger.debug("Discarding invalid cached response", key=key)
+            return None
+
+    def put(self, key: str, model: str, response: BaseModel) -> None:
+        """Stores a validated response.
+
+        Fields are stored under their aliases, which `get` validates against;
+        the fields of `multi_case_model` responses are aliased to case names.
+        """
+        data = response.model_dump_json(by_alias=True)
+        now = time.time()
+        with self._lock:
+            self._flush_touched()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, data, len(data), now, now),
+            )
+            self._conn.commit()
+            self._size += len(data)
+        if self.max_size and self._size > self.max_size:
+            self.evict()
+
+    def evict(self) -> None:
+        """Removes expired entries and shrinks the store below `max_size`."""
+        with self._lock:
+            self._flush_touched()
+            if self.max_age:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE created < ?",
+                    (time.time() - self.max_age,),
+                )
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if self.max_size and total > self.max_size:
+                target = self.max_size * EVICT_TARGET
+                stale = []
+                for key, size in self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ):
+                    if total <= target:
+                        break
+                    stale.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                logger.debug("Evicted cached responses", count=len(stale))
+            self._size = total
+            self._conn.commit()
+
+    def _flush_touched(self) -> None:
+        """Writes the access times recorded by `get`; the caller holds the lock."""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def open_response_cache(
+    cache_folder: str,
+    max_age_days: Optional[float] = None,
+    max_size_mb: Optional[float] = None,
+) -> ResponseCache:
+    """Opens the process-wide response cache in `cache_folder`."""
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = ResponseCache(
+        os.path.join(cache_folder, "responses.sqlite"), max_age_days, max_size_mb
+    )
+    return _response_cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Returns the process-wide response cache, or None if caching is off."""
+    return _response_cache
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    """Extracted pages stored as gzipped JSON lines, keyed by file content.
+
+    The key combines the file hash, `EXTRACTOR_VERSION` and the tokenizer
+    (DOCX pages are split by token count), so a changed file or extractor
+    never reuses stale pages. Each line holds one page with the token counts
+    already computed for it, so cached documents can be streamed page by page.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    @staticmethod
+    def key(digest: str, encoding_name: str) -> str:
+        return f"{digest}-v{EXTRACTOR_VERSION}-{encoding_name}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], f"{key}.jsonl.gz")
+
+    def iter(self, key: str, filename: str) -> Optional[Iterator[PDFDocument]]:
+        """Returns an iterator over the cached pages of `filename`, or None."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        return self._read(path, filename)
+
+    @staticmethod
+    def _read(path: str, filename: str) -> Iterator[PDFDocument]:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                page, text, counts = json.loads(line)
+                doc = PDFDocument(filename=filename, page=page, text=text)
+                doc._token_counts.update(counts)
+                yield doc
+
+    def get(self, key: str, filename: str) -> Optional[List[PDFDocument]]:
+        """Returns the cached pages of `filename`, or None.
+
+        A truncated or corrupt entry is removed so the document is extracted
+        and cached again.
+        """
+        pages = self.iter(key, filename)
+        if pages is None:
+            return None
+        try:
+            return list(pages)
+        except (OSError, EOFError, gzip.BadGzipFile, ValueError):
+            logger.warning("Discarding corrupt cached document", filename=filename)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            return None
+
+    def write_through(
+        self, key: str, pages: Iterable[PDFDocument]
+    ) -> Iterator[PDFDocument]:
+        """Yields `pages` while writing them to the cache.
+
+        The entry only becomes visible once all pages have been consumed.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                for page in pages:
+                    row = [page.page, page.text, page._token_counts]
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    yield page
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put(self, key: str, pages: List[PDFDocument]) -> None:
+        for _ in self.write_through(key, pages):
+            pass
+
+
+_document_cache: Optional[DocumentCache] = None
+
+
+def open_document_cache(cache_folder: str) -> DocumentCache:
+    """Opens the process-wide cache of extracted documents in `cache_folder`."""
+    global _document_cache
+    _document_cache = DocumentCache(os.path.join(cache_folder, "documents"))
+    return _document_cache
+
+
+def get_document_cache() -> Optional[DocumentCache]:
+    """Returns the process-wide document cache, or None if caching is off."""
+    return _document_cache
@@ -0,0 +1,214 @@
+import os
+import zlib
+from typing import ClassVar, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import structlog
+from pydantic import BaseModel
+
+from whiteanalysis.metrics import increment
+from whiteanalysis.prompts import Insights, Quote
+from whiteanalysis.timing import stage
+from whiteanalysis.verify import words
+
+logger = structlog.get_logger()
+
+# Words per shingle of a quote
+SHINGLE = 3
+# LSH bands and rows per band; the signature has BANDS * ROWS hash functions.
+# Quotes sharing about half their shingles become candidates.
+BANDS = 16
+ROWS = 4
+# Share of signature entries two quotes must agree on to be near-duplicates
+MIN_SIMILARITY = 0.6
+
+_rng = np.random.default_rng(1)
+# Multiply-shift hash functions (a * x + b) mod 2**64 with odd a; the minimum
+# is decided by the well-mixed high bits
+_A = _rng.integers(0, 1 << 64, size=BANDS * ROWS, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 1 << 64, size=BANDS * ROWS, dtype=np.uint64)
+
+
+def signature(text: str) -> np.ndarray:
+    """MinHash signature of the word shingles of a quote."""
+    tokens = words(text)
+    shingles = {
+        " ".join(tokens[i : i + SHINGLE])
+        for i in range(max(len(tokens) - SHINGLE + 1, 1))
+    }
+    hashes = np.array(
+        [zlib.crc32(x.encode("utf-8")) for x in shingles], dtype=np.uint64
+    )
+    return (np.outer(hashes, _A) + _B).min(axis=0)
+
+
+class QuoteRef(BaseModel):
+    """A place a quote was reported: an insight set of a document's case report."""
+
+    document: str
+    case_name: str
+    insight_set: int
+
+    def label(self) -> str:
+        return (
+            f"{self.case_name}, {os.path.basename(self.document)} "
+            f"(Insight Set {self.insight_set})"
+        )
+
+
+class QuoteCluster(BaseModel):
+    """Near-identical quotes of a run, under the text of the first one reported."""
+
+    text: str
+    refs: List[QuoteRef] = []
+
+
+class QuoteClusterData(BaseModel):
+    """All clusters of a run, stored as `quote_clusters.json` in the run folder."""
+
+    filename: ClassVar[str] = "quote_clusters.json"
+
+    clusters: List[QuoteCluster] = []
+
+
+class QuoteClusters:
+    """Clusters of near-duplicate quotes across the batches, cases and documents of a run.
+
+    Each quote gets a MinHash signature whose bands are hashed into buckets
+    (locality-sensitive hashing); a new quote is only compared with the
+    clusters sharing a bucket with it, so clustering takes linear time in the
+    number of quotes. The first quote of a cluster is its canonical text.
+    """
+
+    def __init__(self, data: Optional[QuoteClusterData] = None):
+        self.data = data or QuoteClusterData()
+        self._signatures: List[np.ndarray] = []
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        # Clusters referenced by each (document, case) report
+        self._reports: Dict[Tuple[str, str], Set[int]] = {}
+        for cluster_id, cluster in enumerate(self.data.clusters):
+            self._index(signature(cluster.text))
+            for ref in cluster.refs:
+                self._reports.setdefault((ref.document, ref.case_name), set()).add(
+                    cluster_id
+                )
+
+    def _index(self, sig: np.ndarray) -> int:
+        cluster_id = len(self._signatures)
+        self._signatures.append(sig)
+        for band in range(BANDS):
+            key = (band, sig[band * ROWS : (band + 1) * ROWS].tobytes())
+            self._buckets.setdefault(key, []).append(cluster_id)
+        return cluster_id
+
+    def assign(self, text: str) -> int:
+        """Index of the cluster of a quote text, starting a new cluster if none is close."""
+        sig = signature(text)
+        candidates = {
+            x
+            for band in range(BANDS)
+            for x in self._buckets.get(
+                (band, sig[band * ROWS : (band + 1) * ROWS].tobytes()), []
+            )
+        }
+        best, best_similarity = None, MIN_SIMILARITY
+        for cluster_id in sorted(candidates):
+            similarity = float(np.mean(self._signatures[cluster_id] == sig))
+            if similarity >= best_similarity:
+                best, best_similarity = cluster_id, similarity
+        if best is not None:
+            return best
+        self.data.clusters.append(QuoteCluster(text=text))
+        return self._index(sig)
+
+    def add_report(
+        self, document: str, case_name: str, responses: List[Insights]
+    ) -> List[Insights]:
+        """Clusters the quotes of a case report and merges its near-duplicates.
+
+        Within the report, only the first of several near-identical quotes is
+        kept; it lists the insight sets of the dropped copies and the other
+        reports of the run that already hold the quote. Writing a report again
+        (e.g. in a resumed run) replaces its earlier references.
+
+        Args:
+            document: Path to the document file
+            case_name: Name of the case
+            responses: Insights of the case, in batch order
+
+        Returns:
+            The insights without duplicate quotes
+        """
+        with stage("dedupe"):
+            report = (document, case_name)
+            for cluster_id in self._reports.pop(report, set()):
+                cluster = self.data.clusters[cluster_id]
+                cluster.refs = [
+                    x for x in cluster.refs if (x.document, x.case_name) != report
+                ]
+            clusters = self._reports[report] = set()
+            kept: Dict[int, Quote] = {}
+            results = []
+            for i, insight in enumerate(responses, 1):
+                quotes = []
+                for quote in insight.quotes:
+                    cluster_id = self.assign(quote.text)
+                    cluster = self.data.clusters[cluster_id]
+                    clusters.add(cluster_id)
+                    if cluster_id in kept:
+                        increment("duplicate_quotes")
+                        also_quoted = kept[cluster_id].also_quoted
+                        if cluster.refs[-1].insight_set != i:
+                            also_quoted.append(f"Insight Set {i}")
+                    else:
+                        others = dict.fromkeys(x.label() for x in cluster.refs)
+                        if others:
+                            increment("repeated_quotes")
+                        kept[cluster_id] = quote.model_copy(
+                            update={"also_quoted": list(others)}
+                        )
+                        quotes.append(kept[cluster_id])
+                    cluster.refs.append(
+                        QuoteRef(document=document, case_name=case_name, insight_set=i)
+                    )
+                results.append(insight.model_copy(update={"quotes": quotes}))
+        return results
+
+    def save(self, folder: str) -> str:
+        """Writes the clusters to `folder/quote_clusters.json` and returns the path."""
+        path = os.path.join(folder, self.data.filename)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.data.model_dump_json(indent=2))
+        os.replace(tmp_path, path)
+        repeated = sum(len(x.refs) > 1 for x in self.data.clusters)
+        logger.info("Wrote quote clusters", path=path, repeated=repeated)
+        return path
+
+
+_quote_clusters: Optional[QuoteClusters] = None
+
+
+def open_quote_clusters(run_dir: str) -> QuoteClusters:
+    """Opens the process-wide quote clusters of a run, continuing stored ones."""
+    global _quote_clusters
+    path = os.path.join(run_dir, QuoteClusterData.filename)
+    data = None
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = QuoteClusterData.model_validate_json(f.read())
+    _quote_clusters = QuoteClusters(data)
+    return _quote_clusters
+
+
+def get_quote_clusters() -> Optional[QuoteClusters]:
+    """Returns the process-wide quote clusters, or None if deduplication is off."""
+    return _quote_clusters
+
+
+def close_quote_clusters(run_dir: str) -> None:
+    """Saves the process-wide quote clusters to the run folder and closes them."""
+    global _quote_clusters
+    if _quote_clusters is not None:
+        _quote_clusters.save(run_dir)
+        _quote_clusters = None
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+import structlog
+import tenacity
+import tiktoken
+from openai.types import CompletionUsage
+
+from whiteanalysis.metrics import increment
+from whiteanalysis.rate_limit import get_rate_limiter
+from whiteanalysis.timing import stage
+from whiteanalysis.usage import record_usage
+from whiteanalysis.utils import return_async_client
+
+logger = structlog.get_logger()
+
+# Longest input accepted by the OpenAI embedding models, in tokens
+MAX_EMBEDDING_TOKENS = 8191
+# Embedding matrices kept in memory when the on-disk cache is off
+MAX_MEMORY_ENTRIES = 64
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """Scales each row to unit length, so dot products are cosine similarities."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+class HashingEmbedder:
+    """Local bag-of-words embedding that needs no model or network access.
+
+    Words are hashed into `dim` buckets with a random sign and weighted by
+    their log frequency. Similarity then reflects shared vocabulary, which is
+    a reasonable stand-in for semantic embeddings when matching drafts against
+    the texts they discuss.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = Counter(x for x in re.findall(r"\w+", text.lower()) if len(x) > 2)
+        for word, count in words.items():
+            digest = zlib.crc32(word.encode("utf-8"))
+            sign = 1.0 if digest & 1 else -1.0
+            vector[(digest >> 1) % self.dim] += sign * (1 + math.log(count))
+        return vector
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        def run() -> np.ndarray:
+            return normalize(np.stack([self._vector(x) for x in texts]))
+
+        return await asyncio.to_thread(run)
+
+
+class OpenAIEmbedder:
+    """Embeddings from the OpenAI API, sent in chunks of `batch_size` texts."""
+
+    def __init__(
+        self,
+        model: str,
+        encodings: Optional[tiktoken.Encoding] = None,
+        batch_size: int = 256,
+    ):
+        self.name = model
+        self.encodings = encodings
+        self.batch_size = batch_size
+
+    def _truncate(self, text: str) -> tuple[str, int]:
+        """Cuts a text to the model's input limit; returns it with its token count."""
+        text = text or " "
+        if self.encodings is None:
+            return text[: MAX_EMBEDDING_TOKENS * 3], len(text) // 4 + 1
+        tokens = self.encodings.encode(text)[:MAX_EMBEDDING_TOKENS]
+        return self.encodings.decode(tokens), len(tokens)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        _, client = return_async_client()
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs, counts = zip(
+                *(self._truncate(x) for x in texts[start : start + self.batch_size])
+            )
+            vectors.extend(await self._embed_chunk(client, list(inputs), sum(counts)))
+        return normalize(np.array(vectors, dtype=np.float32))
+
+    @tenacity.retry(
+        wait=tenacity.wait_exponential(min=1, max=60),
+        stop=tenacity.stop_after_attempt(5),
+        retry=tenacity.retry_if_exception_type((Exception)),
+        before_sleep=lambda _: increment("api_retries"),
+    )
+    async def _embed_chunk(
+        self, client, inputs: List[str], token_count: int
+    ) -> List[List[float]]:
+        await get_rate_limiter(self.name).acquire(token_count)
+        response = await client.embeddings.create(model=self.name, input=inputs)
+        record_usage(
+            self.name,
+            CompletionUsage(
+                prompt_tokens=response.usage.prompt_tokens,
+                completion_tokens=0,
+                total_tokens=response.usage.total_tokens,
+            ),
+        )
+        return [x.embedding for x in response.data]
+
+
+_embedders: Dict[str, object] = {}
+
+
+def get_embedder(name: str, encodings: Optional[tiktoken.Encoding] = None):
+    """Returns the embedder called `name`: "local", or an OpenAI embedding model."""
+    embedder = _embedders.get(name)
+    if embedder is None:
+        embedder = (
+            HashingEmbedder() if name == "local" else OpenAIEmbedder(name, encodings)
+        )
+        _embedders[name] = embedder
+    return embedder
+
+
+class EmbeddingCache:
+    """Embedding matrices stored as `.npy` files, keyed by embedder and texts.
+
+    Matrices are memory-mapped on load, so large documents are not read into
+    memory until their rows are used.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    @staticmethod
+    def key(embedder_name: str, texts: List[str]) -> str:
+        digest = hashlib.sha256(embedder_name.encode("utf-8"))
+        for text in texts:
+            digest.update(b"\0")
+            digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], f"{key}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, mmap_mode="r")
+        except ValueError:
+            logger.debug("Discarding invalid cached embeddings", key=key)
+            return None
+
+    def put(self, key: str, matrix: np.ndarray) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, path)
+
+
+_embedding_cache: Optional[EmbeddingCache] = None
+# Latest matrices embedded in this process, for runs without the on-disk cache
+_memory: Dict[str, np.ndarray] = {}
+
+
+def open_embedding_cache(cache_folder: str) -> EmbeddingCache:
+    """Opens the process-wide embedding cache in `cache_folder`."""
+    global _embedding_cache
+    _embedding_cache = EmbeddingCache(os.path.join(cache_folder, "embeddings"))
+    return _embedding_cache
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Returns the process-wide embedding cache, or None if caching is off."""
+    return _embedding_cache
+
+
+async def embed_texts(
+    texts: List[str],
+    embedder_name: str,
+    encodings: Optional[tiktoken.Encoding] = None,
+) -> np.ndarray:
+    """Unit-length embeddings of `texts`, one row per text.
+
+    Args:
+        texts: Texts to embed, e.g. the pages of a document
+        embedder_name: "local" or an OpenAI embedding model
+        encodings: Tokenizer used to cut texts to the model's input limit
+
+    Returns:
+        float32 matrix of shape (len(texts), dimensions)
+    """
+    embedder = get_embedder(embedder_name, encodings)
+    key = EmbeddingCache.key(embedder.name, texts)
+    cache = get_embedding_cache()
+    matrix = _memory.get(key)
+    if matrix is None and cache is not None:
+        matrix = cache.get(key)
+    if matrix is not None:
+        increment("embedding_cache_hits")
+        return matrix
+
+    increment("embedding_cache_misses")
+    with stage("embed"):
+        matrix = await embedder.embed(texts)
+    if cache is not None:
+        cache.put(key, matrix)
+    else:
+        _memory[key] = matrix
+        if len(_memory) > MAX_MEMORY_ENTRIES:
+            del _memory[next(iter(_memory))]
+    logger.debug("Embedded texts", embedder=embedder.name, count=len(texts))
+    return matrix
@@ -0,0 +1,1207 @@
+import asyncio
+import os
+import time
+from collections import deque
+from functools import partial
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Type,
+    TypeVar,
+    Union,
+)
+
+import structlog
+import tenacity
+import tiktoken
+from pydantic import BaseModel
+from tqdm.asyncio import tqdm_asyncio
+
+from whiteanalysis.cache import get_response_cache, response_cache_key
+from whiteanalysis.dedup import get_quote_clusters
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.html_creation import STYLESHEET_NAME, generate_insights_report
+from whiteanalysis.ingest import DocumentLoader, iter_document
+from whiteanalysis.manifest import CaseCheckpoint, RunManifest
+from whiteanalysis.metrics import increment
+from whiteanalysis.options import AnalysisOptions
+from whiteanalysis.prompts import (
+    CompactInsights,
+    Insights,
+    PageIndex,
+    Relevance,
+    batch_pages,
+    count_prompt_tokens,
+    create_batch_prompt,
+    create_full_paper_prompts,
+    create_multi_case_prompt,
+    create_prompts,
+    create_relevance_prompt,
+    draft_message,
+    drafts_tokens,
+    empty_insights,
+    group_cases,
+    has_insights,
+    iter_batches,
+    multi_case_model,
+    return_system_tokens,
+    split_multi_case,
+)
+from whiteanalysis.rate_limit import EXPECTED_COMPLETION_TOKENS, get_rate_limiter
+from whiteanalysis.retrieval import batch_similarity, pages_for, relevant_pages
+from whiteanalysis.spans import resolve_insights
+from whiteanalysis.store import get_insight_store
+from whiteanalysis.timing import stage
+from whiteanalysis.usage import record_usage, usage_label
+from whiteanalysis.utils import close_async_client, return_async_client
+from whiteanalysis.verify import QuoteIndex, verify_insights
+from whiteanalysis.word_creation import generate_word_report
+
+logger = structlog.get_logger()
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+# Number of page batches of a streamed document that may be in flight at once
+STREAM_WINDOW = 2
+# Share of `prompt_batch_size` the drafts of a multi-case group may take up;
+# the pages sent with the group get the rest
+MULTI_CASE_DRAFT_SHARE = 0.5
+
+
+def report_folder(output_folder: str, filename: str, add_subfolder: bool) -> str:
+    """Creates and returns the folder for the reports of a document."""
+    file_base = os.path.splitext(os.path.basename(filename))[0].replace(" ", "")
+    folder = os.path.join(output_folder, file_base) if add_subfolder else output_folder
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+async def run_full_page(
+    pages: List[PDFDocument],
+    case_text: str,
+    encodings: tiktoken.Encoding,
+    model: str,
+    semaphore: asyncio.Semaphore,
+    checkpoint: Optional[CaseCheckpoint] = None,
+    options: Optional[AnalysisOptions] = None,
+) -> List[Insights]:
+    """Run analysis on full document pages.
+
+    Args:
+        pages: List of PDFDocument objects containing page content
+        case_text: The case text to analyze against
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        semaphore: Semaphore bounding the number of concurrent API calls
+        checkpoint: Optional manifest checkpoint to reuse and record the response
+        options: Prompt layout setting
+
+    Returns:
+        List of Insights objects containing analysis results
+
+    Raises:
+        Exception: If API call fails after retries
+    """
+    options = options or AnalysisOptions()
+    full_page_prompts = create_full_paper_prompts(
+        pages, case_text, encodings=encodings, layout=options.prompt_layout
+    )
+    token_count = count_prompt_tokens(pages, case_text, encodings)
+    response = await run_checkpointed_batch(
+        full_page_prompts,
+        0,
+        encodings,
+        model,
+        semaphore,
+        checkpoint,
+        token_count,
+        batch_screen(pages, [case_text], encodings, semaphore, options),
+        span_pages(pages, options),
+    )
+    return [response]
+
+
+@tenacity.retry(
+    wait=tenacity.wait_exponential(min=1, max=60),
+    stop=tenacity.stop_after_attempt(5),
+    retry=tenacity.retry_if_exception_type((Exception)),
+    before_sleep=lambda _: increment("api_retries"),
+)
+async def run_single_batch(
+    prompt: List[Dict],
+    encodings: tiktoken.Encoding,
+    model: str,
+    semaphore: asyncio.Semaphore,
+    response_model: Type[ModelT],
+    token_count: Optional[int] = None,
+    tier: Optional[str] = None,
+) -> ModelT:
+    """Run analysis on a single batch of prompts.
+
+    Args:
+        prompt: List of prompt dictionaries
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        semaphore: Semaphore bounding the number of concurrent API calls
+        response_model: Model the response is parsed into, e.g. `Insights`
+        token_count: Tokens in the prompt, if already known; otherwise the
+            prompt is encoded
+        tier: Label of the call's tier in the usage totals, e.g. "screen"
+
+    Returns:
+        `response_model` instance containing analysis results
+
+    Raises:
+        Exception: If API call fails after retries
+    """
+    cache = get_response_cache()
+    key = response_cache_key(model, response_model, prompt)
+    if cache is not None:
+        cached = cache.get(key, response_model)
+        if cached is not None:
+            logger.debug("Using cached response", key=key)
+            increment("response_cache_hits")
+            return cached
+        increment("response_cache_misses")
+
+    iclient, _ = return_async_client()
+    try:
+        if token_count is None:
+            token_count = sum(len(encodings.encode(x["content"])) for x in prompt)
+        logger.debug(f"Tokens in prompts: {token_count}")
+
+        limiter = get_rate_limiter(model)
+        async with semaphore:
+            with stage("rate_limit"):
+                reserved = await limiter.acquire(
+                    token_count, EXPECTED_COMPLETION_TOKENS
+                )
+            start = time.perf_counter()
+            with stage("llm"):
+                response, completion = await iclient.create_with_completion(
+                    messages=prompt, response_model=response_model, model=model
+                )
+        if completion.usage is not None:
+            limiter.settle(reserved, completion.usage.total_tokens)
+        record_usage(
+            usage_label(model, tier), completion.usage, time.perf_counter() - start
+        )
+        if cache is not None:
+            cache.put(key, model, response)
+        return response
+
+    except Exception as e:
+        increment("api_errors")
+        logger.exception("Error running batch analysis", error=str(e))
+        raise
+
+
+async def screen_batch(
+    pages: List[PDFDocument],
+    issues: List[str],
+    encodings: tiktoken.Encoding,
+    semaphore: asyncio.Semaphore,
+    options: AnalysisOptions,
+) -> bool:
+    """Ask the screening tier whether a batch is worth sending to the main model.
+
+    The screening model scores the batch's relevance to the drafts; with
+    `options.screen_model == "embedding"` the score is the highest cosine
+    similarity between a page and a draft instead. If screening fails, the
+    batch is treated as relevant, as is every batch when screening is off.
+
+    Args:
+        pages: Pages of the batch
+        issues: Drafts the batch is analyzed against
+        encodings: Tokenizer encoding
+        semaphore: Semaphore bounding the number of concurrent API calls
+        options: Screening model and threshold
+
+    Returns:
+        Whether the score reaches `options.screen_threshold`
+    """
+    screen_model = options.screen_model
+    if not screen_model:
+        return True
+    try:
+        with stage("screen"):
+            if screen_model == "embedding":
+                score = await batch_similarity(
+                    pages, issues, options.embedding_model, encodings
+                )
+            else:
+                relevance = await run_single_batch(
+                    create_relevance_prompt(pages, issues, options.prompt_layout),
+                    encodings,
+                    screen_model,
+                    semaphore,
+                    Relevance,
+                    tier="screen",
+                )
+                score = relevance.score
+    except Exception as e:
+        logger.warning("Screening failed, keeping batch", error=str(e))
+        return True
+    increment("screened_batches")
+    relevant = score >= options.screen_threshold
+    if not relevant:
+        increment("skipped_batches")
+    logger.debug("Screened batch", score=round(score, 3), relevant=relevant)
+    return relevant
+
+
+def batch_screen(
+    pages: List[PDFDocument],
+    issues: List[str],
+    encodings: tiktoken.Encoding,
+    semaphore: asyncio.Semaphore,
+    options: Optional[AnalysisOptions],
+) -> Optional[Callable[[], Awaitable[bool]]]:
+    """Screening step of a batch for `run_checkpointed_batch`, if screening is on."""
+    if options is None or not options.screen_model:
+        return None
+    return partial(screen_batch, pages, issues, encodings, semaphore, options)
+
+
+def span_pages(
+    pages: List[PDFDocument], options: Optional[AnalysisOptions]
+) -> Optional[List[PDFDocument]]:
+    """Pages to resolve quote spans against, if the run uses the compact schema."""
+    if options is None or options.quote_schema != "compact":
+        return None
+    return pages
+
+
+async def run_checkpointed_batch(
+    prompt: List[Dict],
+    batch: int,
+    encodings: tiktoken.Encoding,
+    model: str,
+    semaphore: asyncio.Semaphore,
+    checkpoint: Optional[CaseCheckpoint] = None,
+    token_count: Optional[int] = None,
+    screen: Optional[Callable[[], Awaitable[bool]]] = None,
+    span_pages: Optional[List[PDFDocument]] = None,
+) -> Insights:
+    """Run a single batch unless the checkpoint already holds its response.
+
+    Args:
+        prompt: List of prompt dictionaries
+        batch: Index of the batch within its case
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        semaphore: Semaphore bounding the number of concurrent API calls
+        checkpoint: Optional manifest checkpoint of the (document, case) pair
+        token_count: Tokens in the prompt, if already known
+        screen: Optional relevance check (see `batch_screen`); batches that
+            fail it get empty insights without calling `model`
+        span_pages: Pages of the batch, to ask for the compact quote schema
+            and resolve its quote spans against; None asks for full quotes
+
+    Returns:
+        Insights object containing analysis results
+    """
+    response_model: Type[Union[Insights, CompactInsights]] = (
+        Insights if span_pages is None else CompactInsights
+    )
+    key = response_cache_key(model, response_model, prompt)
+    if checkpoint is not None:
+        stored = checkpoint.load(batch, key)
+        if stored is not None:
+            logger.debug("Using checkpointed response", batch=batch)
+            increment("checkpoint_hits")
+            return stored
+
+    response: Union[Insights, CompactInsights]
+    if screen is not None and not await screen():
+        increment("screen_skipped_tokens", token_count or 0)
+        response = empty_insights()
+    else:
+        try:
+            response = await run_single_batch(
+                prompt, encodings, model, semaphore, response_model, token_count
+            )
+        except Exception as e:
+            if checkpoint is not None:
+                checkpoint.fail(batch, key, e)
+            raise
+    if isinstance(response, CompactInsights):
+        # Compact responses are only asked for along with their span_pages
+        response = resolve_insights(response, span_pages or [])
+    if checkpoint is not None:
+        checkpoint.save(batch, key, response)
+    return response
+
+
+async def run_multi_case_batch(
+    pages: List[PDFDocument],
+    batch: int,
+    group: Dict[str, str],
+    encodings: tiktoken.Encoding,
+    model: str,
+    semaphore: asyncio.Semaphore,
+    checkpoints: Dict[str, CaseCheckpoint],
+    options: AnalysisOptions,
+    full_paper: bool = False,
+) -> Dict[str, Insights]:
+    """Run a batch of pages against several cases in a single call.
+
+    The response is split by case and stored in each case's checkpoint, so
+    reports and resumed runs work as if the cases had been run one by one.
+    Pages are labelled with <PAGE> tags for the compact schema and, as in
+    `create_full_paper_prompts`, when the batch holds the whole document.
+
+    Args:
+        pages: Pages of the batch
+        batch: Index of the batch within the document
+        group: Cases analyzed together
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        semaphore: Semaphore bounding the number of concurrent API calls
+        checkpoints: Manifest checkpoints of the cases in the group
+        options: Prompt settings of the run
+        full_paper: Whether the batch holds all pages of the document
+
+    Returns:
+        Insights of each case in the group
+    """
+    case_names = list(group)
+    compact = options.quote_schema == "compact"
+    response_model = multi_case_model(tuple(case_names), options.quote_schema)
+    prompt = create_multi_case_prompt(
+        pages, group, options.prompt_layout, compact or full_paper
+    )
+    key = response_cache_key(model, response_model, prompt)
+    hits = {
+        name: stored
+        for name in case_names
+        if (stored := checkpoints[name].load(batch, key)) is not None
+    }
+    if len(hits) == len(case_names):
+        logger.debug("Using checkpointed response", batch=batch)
+        increment("checkpoint_hits")
+        return hits
+    if options.screen_model and not await screen_batch(
+        pages, list(group.values()), encodings, semaphore, options
+    ):
+        increment(
+            "screen_skipped_tokens",
+            count_prompt_tokens(pages, "\n".join(group.values()), encodings),
+        )
+        for name in case_names:
+            checkpoints[name].save(batch, key, empty_insights())
+        return {name: empty_insights() for name in case_names}
+    try:
+        response = await run_single_batch(
+            prompt,
+            encodings,
+            model,
+            semaphore,
+            response_model,
+            count_prompt_tokens(pages, "\n".join(group.values()), encodings),
+        )
+    except Exception as e:
+        for name in case_names:
+            checkpoints[name].fail(batch, key, e)
+        raise
+    results: Dict[str, Insights] = {}
+    for name, insights in split_multi_case(response, case_names).items():
+        if isinstance(insights, CompactInsights):
+            insights = resolve_insights(insights, pages)
+        checkpoints[name].save(batch, key, insights)
+        results[name] = insights
+    return results
+
+
+def case_groups(
+    cases: Dict[str, str], encodings: tiktoken.Encoding, options: AnalysisOptions
+) -> List[Dict[str, str]]:
+    """Groups of cases sharing a call; one group per case unless `multi_case` is set.
+
+    The drafts of a group take up at most `MULTI_CASE_DRAFT_SHARE` of
+    `options.prompt_batch_size` (see `page_budget`).
+    """
+    if options.multi_case > 1:
+        return group_cases(
+            cases,
+            options.multi_case,
+            int(options.prompt_batch_size * MULTI_CASE_DRAFT_SHARE),
+            encodings,
+        )
+    return [{case_name: case_text} for case_name, case_text in cases.items()]
+
+
+def page_budget(
+    groups: List[Dict[str, str]],
+    encodings: tiktoken.Encoding,
+    options: AnalysisOptions,
+) -> int:
+    """Tokens of pages per batch, so that a batch and the drafts of any of
+    `groups` stay within `options.prompt_batch_size` together.
+
+    Without `multi_case`, batches get the whole budget. Pages always get at
+    least the share the drafts leave over, even next to an oversized draft.
+    """
+    if options.multi_case <= 1 or not groups:
+        return options.prompt_batch_size
+    drafts = max(drafts_tokens(group.values(), encodings) for group in groups)
+    return max(
+        options.prompt_batch_size - drafts,
+        int(options.prompt_batch_size * (1 - MULTI_CASE_DRAFT_SHARE)),
+    )
+
+
+async def run_batched_prompts(
+    pages: List[PDFDocument],
+    case_text: str,
+    encodings: tiktoken.Encoding,
+    model: str,
+    semaphore: asyncio.Semaphore,
+    checkpoint: Optional[CaseCheckpoint] = None,
+    options: Optional[AnalysisOptions] = None,
+) -> List[Insights]:
+    """Run analysis on batched prompts for large documents.
+
+    All batches are sent concurrently (bounded by the semaphore) and the
+    responses are returned in batch order. Failed batches are logged,
+    recorded in the checkpoint and left out of the result.
+
+    Args:
+        pages: List of PDFDocument objects
+        case_text: The case text to analyze against
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        semaphore: Semaphore bounding the number of concurrent API calls
+        checkpoint: Optional manifest checkpoint to reuse and record responses
+        options: Batch size, page splitting and prompt layout settings
+
+    Returns:
+        List of Insights objects containing analysis results
+    """
+    options = options or AnalysisOptions()
+
+    page_batches = batch_pages(
+        pages, options.prompt_batch_size, encodings, options.split_pages
+    )
+    results = await asyncio.gather(
+        *(
+            run_checkpointed_batch(
+                create_batch_prompt(
+                    batch,
+                    case_text,
+                    options.prompt_layout,
+                    options.quote_schema == "compact",
+                ),
+                i,
+                encodings,
+                model,
+                semaphore,
+                checkpoint,
+                count_prompt_tokens(batch, case_text, encodings),
+                batch_screen(batch, [case_text], encodings, semaphore, options),
+                span_pages(batch, options),
+            )
+            for i, batch in enumerate(page_batches)
+        ),
+        return_exceptions=True,
+    )
+
+    responses = []
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.error("Error running batched prompts", batch=i, error=str(result))
+            continue
+        responses.append(result)
+    return responses
+
+
+async def run_page_windows(
+    pages: List[PDFDocument],
+    case_text: str,
+    encodings: tiktoken.Encoding,
+    model: str,
+    semaphore: asyncio.Semaphore,
+    checkpoint: Optional[CaseCheckpoint] = None,
+    options: Optional[AnalysisOptions] = None,
+) -> List[Insights]:
+    """Run analysis with every page as the focal page of its own call.
+
+    Each call gets one page to extract insights from and up to
+    `options.page_window` pages before and after it as context. Windows are
+    sliced from a page index built once for the document, and all calls are
+    sent concurrently (bounded by the semaphore). Failed pages are logged,
+    recorded in the checkpoint and left out of the result.
+
+    Args:
+        pages: List of PDFDocument objects
+        case_text: The case text to analyze against
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        semaphore: Semaphore bounding the number of concurrent API calls
+        checkpoint: Optional manifest checkpoint to reuse and record responses
+        options: Page window and prompt layout settings
+
+    Returns:
+        List of Insights objects, one per page that succeeded, in page order
+    """
+    options = options or AnalysisOptions()
+    window = options.page_window or 0
+    index = PageIndex(pages, encodings)
+    draft = draft_message(case_text)
+    system_tokens = return_system_tokens(case_text, encodings)
+
+    def run_page(i: int, page: PDFDocument) -> Awaitable[Insights]:
+        focal, before, after = index.window(i, window)
+        return run_checkpointed_batch(
+            create_prompts(
+                pages,
+                page.page,
+                window,
+                case_text,
+                options.prompt_layout,
+                index,
+                draft,
+                options.quote_schema == "compact",
+            ),
+            i,
+            encodings,
+            model,
+            semaphore,
+            checkpoint,
+            system_tokens + index.window_tokens(i, window),
+            batch_screen([focal], [case_text], encodings, semaphore, options),
+            span_pages([*before, focal, *after], options),
+        )
+
+    results = await asyncio.gather(
+        *(run_page(i, page) for i, page in enumerate(pages)),
+        return_exceptions=True,
+    )
+
+    responses = []
+    for page, result in zip(pages, results):
+        if isinstance(result, BaseException):
+            logger.error("Error running page window", page=page.page, error=str(result))
+            continue
+        responses.append(result)
+    return responses
+
+
+async def process_case(
+    pages: List[PDFDocument],
+    filename: str,
+    case_name: str,
+    case_text: str,
+    encodings: tiktoken.Encoding,
+    model: str,
+    folder: str,
+    semaphore: asyncio.Semaphore,
+    manifest: RunManifest,
+    options: AnalysisOptions,
+    quote_index: Optional[QuoteIndex] = None,
+) -> None:
+    """Analyze a document against a single case and write the reports.
+
+    Cases whose reports are already complete in the manifest are skipped.
+    If some batches fail, the partial reports are still written but the
+    case stays marked as failed so that a resumed run retries those batches.
+
+    Args:
+        pages: Pages of the document
+        filename: Path to the document file
+        case_name: Name of the case
+        case_text: The case text to analyze against
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        folder: Output folder for the reports
+        semaphore: Semaphore bounding the number of concurrent API calls
+        manifest: Manifest of the run
+        options: Prompt settings of the run
+        quote_index: Index of the document's pages to verify quotes against
+    """
+    if manifest.case_done(filename, case_name, case_text):
+        logger.debug(f"Skipping finished case: {case_name}")
+        return
+    logger.debug(f"Processing case: {case_name}")
+    total_length = sum(x.token_count(encodings) for x in pages)
+
+    checkpoint = manifest.checkpoint(filename, case_name)
+    if options.page_window is not None:
+        run = run_page_windows
+    elif total_length < options.prompt_batch_size:
+        run = run_full_page
+    else:
+        run = run_batched_prompts
+    try:
+        responses = await run(
+            pages, case_text, encodings, model, semaphore, checkpoint, options
+        )
+    except Exception:
+        manifest.record_case(filename, case_name, case_text, [], complete=False)
+        raise
+
+    write_case_reports(
+        responses,
+        filename,
+        case_name,
+        case_text,
+        model,
+        folder,
+        manifest,
+        complete=not checkpoint.failed,
+        quote_index=quote_index,
+    )
+
+
+async def process_case_group(
+    pages: List[PDFDocument],
+    filename: str,
+    group: Dict[str, str],
+    encodings: tiktoken.Encoding,
+    model: str,
+    folder: str,
+    semaphore: asyncio.Semaphore,
+    manifest: RunManifest,
+    options: AnalysisOptions,
+    quote_index: Optional[QuoteIndex] = None,
+) -> None:
+    """Analyze a document against several cases at once and write their reports.
+
+    Every batch of pages is sent once for the whole group and the response is
+    split back into the reports of each case. Batches are packed within what
+    the group's drafts leave of the prompt budget (see `page_budget`).
+
+    Args:
+        pages: Pages of the document
+        filename: Path to the document file
+        group: Unfinished cases analyzed together
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        folder: Output folder for the reports
+        semaphore: Semaphore bounding the number of concurrent API calls
+        manifest: Manifest of the run
+        options: Prompt settings of the run
+        quote_index: Index of the document's pages to verify quotes against
+    """
+    logger.debug(f"Processing cases: {', '.join(group)}")
+    checkpoints = {x: manifest.checkpoint(filename, x) for x in group}
+    page_batches = batch_pages(
+        pages,
+        page_budget([group], encodings, options),
+        encodings,
+        options.split_pages,
+    )
+    full_paper = len(page_batches) == 1
+    results = await asyncio.gather(
+        *(
+            run_multi_case_batch(
+                batch,
+                i,
+                group,
+                encodings,
+                model,
+                semaphore,
+                checkpoints,
+                options,
+                full_paper,
+            )
+            for i, batch in enumerate(page_batches)
+        ),
+        return_exceptions=True,
+    )
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.error("Error running multi-case batch", batch=i, error=str(result))
+
+    for case_name, case_text in group.items():
+        write_case_reports(
+            [x[case_name] for x in results if not isinstance(x, BaseException)],
+            filename,
+            case_name,
+            case_text,
+            model,
+            folder,
+            manifest,
+            complete=not checkpoints[case_name].failed,
+            quote_index=quote_index,
+        )
+
+
+def write_case_reports(
+    responses: List[Insights],
+    filename: str,
+    case_name: str,
+    case_text: str,
+    model: str,
+    folder: str,
+    manifest: RunManifest,
+    complete: bool,
+    quote_index: Optional[QuoteIndex] = None,
+) -> None:
+    """Write the HTML and DOCX reports of a case and record them in the manifest.
+
+    Batches without insights, such as those the screening tier skipped, are
+    left out. With a `quote_index`, every quote is then checked against the
+    document: quotes that are not found are flagged in the reports, and found
+    quotes get the page they are actually on; the results are also saved to
+    the insight store, if one is open. If the run's quote clusters are open (see
+    `open_quote_clusters`), near-identical quotes are then merged and quotes
+    already reported for other cases or documents are marked as such.
+
+    Args:
+        responses: Insights of the case, in batch order
+        filename: Path to the document file
+        case_name: Name of the case
+        case_text: The case text
+        model: Model identifier used
+        folder: Output folder for the reports
+        manifest: Manifest of the run
+        complete: Whether all batches of the case succeeded
+        quote_index: Index of the document's pages to verify quotes against
+    """
+    responses = [x for x in responses if has_insights(x)]
+    if quote_index is not None:
+        responses = verify_insights(responses, quote_index)
+        store = get_insight_store()
+        if store is not None:
+            store.put_verification(manifest.run_dir, filename, case_name, responses)
+    clusters = get_quote_clusters()
+    if clusters is not None:
+        responses = clusters.add_report(filename, case_name, responses)
+    file_base = os.path.splitext(os.path.basename(filename))[0].replace(" ", "")
+    output_base = f"{case_name}_{file_base}"
+    output_html = os.path.join(folder, f"{output_base}.html")
+    output_docx = os.path.join(folder, f"{output_base}.docx")
+
+    with stage("render", profile=True):
+        generate_insights_report(
+            responses=responses,
+            filename=filename,
+            case=case_text,
+            model=model,
+            output_path=output_html,
+            stylesheet=os.path.join(manifest.run_dir, STYLESHEET_NAME),
+        )
+        generate_word_report(
+            responses=responses,
+            filename=filename,
+            case=case_text,
+            model=model,
+            output_path=output_docx,
+        )
+    manifest.record_case(
+        filename,
+        case_name,
+        case_text,
+        [output_html, output_docx],
+        complete=complete,
+    )
+
+
+async def next_batch(
+    batches: Iterator[List[PDFDocument]],
+) -> Optional[List[PDFDocument]]:
+    """Extracts pages in a thread until the next batch is full."""
+    with stage("ingest"):
+        return await asyncio.to_thread(next, batches, None)
+
+
+async def verify_batch(
+    response: Awaitable[Union[Insights, Dict[str, Insights]]],
+    pages: List[PDFDocument],
+) -> Union[Insights, Dict[str, Insights]]:
+    """Awaits a batch response and checks its quotes against the batch's pages.
+
+    The pages are indexed only once the response has arrived and are released
+    with it, so verifying a streamed document keeps memory bounded.
+    """
+    result = await response
+    index = QuoteIndex(pages)
+    if isinstance(result, dict):
+        return {k: verify_insights([v], index)[0] for k, v in result.items()}
+    return verify_insights([result], index)[0]
+
+
+async def stream_cases(
+    filename: str,
+    cases: Dict[str, str],
+    encodings: tiktoken.Encoding,
+    model: str,
+    folder: str,
+    semaphore: asyncio.Semaphore,
+    manifest: RunManifest,
+    options: AnalysisOptions,
+) -> None:
+    """Analyze a document against all cases while its pages are being extracted.
+
+    Pages are extracted lazily and packed into batches as they arrive; each
+    batch is sent for every unfinished case (or group of cases, see
+    `case_groups`). Extraction pauses while
+    `STREAM_WINDOW` batches are in flight, so peak memory is bounded by the
+    batch size rather than the document size. A document that fits into a
+    single batch gets the same full-paper prompt as in the default mode.
+    Quotes are verified against the pages of their batch as each response
+    arrives (see `verify_batch`), so no index of the whole document is kept.
+    Documents without any extracted text are skipped, as in `process_document`.
+
+    Args:
+        filename: Path to the document file
+        cases: Dictionary of cases to analyze
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        folder: Output folder for the reports
+        semaphore: Semaphore bounding the number of concurrent API calls
+        manifest: Manifest of the run
+        options: Prompt settings of the run
+    """
+    pending = {
+        case_name: case_text
+        for case_name, case_text in cases.items()
+        if not manifest.case_done(filename, case_name, case_text)
+    }
+    if not pending:
+        return
+    checkpoints = {x: manifest.checkpoint(filename, x) for x in pending}
+    groups = case_groups(pending, encodings, options)
+    tasks: Dict[str, List[asyncio.Task]] = {x: [] for x in pending}
+    window: deque = deque()
+
+    batches = iter_batches(
+        iter_document(filename, encodings),
+        page_budget(groups, encodings, options),
+        encodings,
+        options.split_pages,
+    )
+    try:
+        batch = await next_batch(batches)
+        if batch is None:
+            logger.warning("No text extracted, skipping document", filename=filename)
+            return
+        following = await next_batch(batches)
+        index = 0
+        while batch is not None:
+            batch_tasks = []
+            for group in groups:
+                coro: Coroutine[Any, Any, Union[Insights, Dict[str, Insights]]]
+                if options.multi_case > 1:
+                    coro = run_multi_case_batch(
+                        batch,
+                        index,
+                        group,
+                        encodings,
+                        model,
+                        semaphore,
+                        checkpoints,
+                        options,
+                        index == 0 and following is None,
+                    )
+                else:
+                    ((case_name, case_text),) = group.items()
+                    prompt = (
+                        create_full_paper_prompts(
+                            batch, case_text, encodings, options.prompt_layout
+                        )
+                        if index == 0 and following is None
+                        else create_batch_prompt(
+                            batch,
+                            case_text,
+                            options.prompt_layout,
+                            options.quote_schema == "compact",
+                        )
+                    )
+                    coro = run_checkpointed_batch(
+                        prompt,
+                        index,
+                        encodings,
+                        model,
+                        semaphore,
+                        checkpoints[case_name],
+                        count_prompt_tokens(batch, case_text, encodings),
+                        batch_screen(batch, [case_text], encodings, semaphore, options),
+                        span_pages(batch, options),
+                    )
+                if options.verify_quotes:
+                    coro = verify_batch(coro, batch)
+                task = asyncio.create_task(coro)
+                for case_name in group:
+                    tasks[case_name].append(task)
+                batch_tasks.append(task)
+            if batch_tasks:
+                window.append(batch_tasks)
+            if len(window) >= STREAM_WINDOW:
+                await asyncio.wait(window.popleft())
+
+            batch = following
+            if batch is not None:
+                following = await next_batch(batches)
+            index += 1
+    except BaseException:
+        for task in (x for case_tasks in tasks.values() for x in case_tasks):
+            task.cancel()
+        raise
+    finally:
+        batches.close()
+
+    for case_name, case_text in pending.items():
+        results = await asyncio.gather(*tasks[case_name], return_exceptions=True)
+        responses = [
+            x[case_name] if isinstance(x, dict) else x
+            for x in results
+            if not isinstance(x, BaseException)
+        ]
+        responses = [x for x in responses if has_insights(x)]
+        store = get_insight_store()
+        if options.verify_quotes and store is not None:
+            store.put_verification(manifest.run_dir, filename, case_name, responses)
+        write_case_reports(
+            responses,
+            filename,
+            case_name,
+            case_text,
+            model,
+            folder,
+            manifest,
+            complete=not checkpoints[case_name].failed,
+        )
+
+
+async def process_document(
+    filename: str,
+    cases: Dict[str, str],
+    encodings: tiktoken.Encoding,
+    model: str,
+    output_folder: str,
+    semaphore: asyncio.Semaphore,
+    manifest: RunManifest,
+    options: AnalysisOptions,
+    loader: DocumentLoader,
+    add_subfolder: bool = False,
+) -> None:
+    """Process a single document file.
+
+    Extraction runs in the loader's worker pool so that other documents keep
+    making progress; all cases of the document are then analyzed concurrently.
+    With `options.retrieval_top_k`, each case only gets the pages most similar
+    to it (see `relevant_pages`). With `options.stream_pages`, the document is
+    instead extracted and analyzed page by page (see `stream_cases`).
+    Documents whose cases are all finished in the manifest are skipped without
+    extracting them.
+
+    Args:
+        filename: Path to the document file
+        cases: Dictionary of cases to analyze
+        encodings: Optional tokenizer encoding
+        model: Model identifier to use
+        output_folder: Base output folder path
+        semaphore: Semaphore bounding the number of concurrent API calls
+        manifest: Manifest of the run
+        options: Prompt settings of the run
+        loader: Document loader extracting the pages
+        add_subfolder: Flag to add a subfolder for each document
+    """
+    if manifest.document_done(filename, cases):
+        logger.debug(f"Skipping finished file: {filename}")
+        return
+    logger.debug(f"Processing file: {filename}")
+
+    try:
+        folder = report_folder(output_folder, filename, add_subfolder)
+
+        if options.stream_pages:
+            await stream_cases(
+                filename,
+                cases,
+                encodings,
+                model,
+                folder,
+                semaphore,
+                manifest,
+                options,
+            )
+            manifest.record_document(filename)
+            return
+
+        pages = await loader.load(filename)
+        if not pages:
+            logger.warning("No text extracted, skipping document", filename=filename)
+            manifest.record_document(filename)
+            return
+        quote_index = QuoteIndex(pages) if options.verify_quotes else None
+        selected = (
+            await relevant_pages(
+                pages,
+                cases,
+                options.retrieval_top_k,
+                options.retrieval_neighbors,
+                options.embedding_model,
+                encodings,
+            )
+            if options.retrieval_top_k
+            else None
+        )
+
+        if options.multi_case > 1 and options.page_window is None:
+            pending = {
+                case_name: case_text
+                for case_name, case_text in cases.items()
+                if not manifest.case_done(filename, case_name, case_text)
+            }
+            groups = case_groups(pending, encodings, options)
+            results = await asyncio.gather(
+                *(
+                    process_case_group(
+                        pages_for(pages, selected, list(group)),
+                        filename,
+                        group,
+                        encodings,
+                        model,
+                        folder,
+                        semaphore,
+                        manifest,
+                        options,
+                        quote_index,
+                    )
+                    for group in groups
+                ),
+                return_exceptions=True,
+            )
+            for group, result in zip(groups, results):
+                if isinstance(result, BaseException):
+                    logger.error(
+                        f"Error processing cases {', '.join(group)} for {filename}",
+                        error=str(result),
+                    )
+            manifest.record_document(filename)
+            return
+
+        results = await asyncio.gather(
+            *(
+                process_case(
+                    pages_for(pages, selected, [case_name]),
+                    filename,
+                    case_name,
+                    case_text,
+                    encodings,
+                    model,
+                    folder,
+                    semaphore,
+                    manifest,
+                    options,
+                    quote_index,
+                )
+                for case_name, case_text in cases.items()
+            ),
+            return_exceptions=True,
+        )
+        for case_name, result in zip(cases, results):
+            if isinstance(result, BaseException):
+                logger.error(
+                    f"Error processing case {case_name} for {filename}",
+                    error=str(result),
+                )
+        manifest.record_document(filename)
+
+    except Exception as e:
+        logger.exception(f"Error processing document {filename}", error=str(e))
+        manifest.record_document_failure(filename, e)
+
+
+async def run_documents(
+    filenames: List[str],
+    cases: Dict[str, str],
+    encodings: tiktoken.Encoding,
+    model: str,
+    output_folder: str,
+    concurrency: int,
+    manifest: RunManifest,
+    options: AnalysisOptions,
+    add_subfolder: bool = False,
+    ingest_workers: int = 0,
+    cache_folder: Optional[str] = None,
+    profile: bool = False,
+) -> None:
+    """Fan out all documents and cases with at most `concurrency` API calls in flight.
+
+    Documents are extracted in parallel worker processes and each document's
+    cases start as soon as its pages are ready.
+
+    Args:
+        filenames: Paths of the document files
+        cases: Dictionary of cases to analyze
+        encodings: Tokenizer encoding
+        model: Model identifier to use
+        output_folder: Base output folder path
+        concurrency: Maximum number of concurrent API calls
+        manifest: Manifest of the run
+        options: Prompt settings of the run
+        add_subfolder: Flag to add a subfolder for each document
+        ingest_workers: Number of extraction processes (0: extract in a thread)
+        cache_folder: Folder of the document cache used by the workers
+        profile: Sample profiles of the extraction workers, too
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    loader = DocumentLoader(encodings, ingest_workers, cache_folder, profile)
+    try:
+        await process_documents(
+            filenames,
+            cases,
+            encodings,
+            model,
+            output_folder,
+            semaphore,
+            manifest,
+            options,
+            loader,
+            add_subfolder,
+        )
+    finally:
+        loader.close()
+        await close_async_client()
+
+
+async def process_documents(
+    filenames: List[str],
+    cases: Dict[str, str],
+    encodings: tiktoken.Encoding,
+    model: str,
+    output_folder: str,
+    semaphore: asyncio.Semaphore,
+    manifest: RunManifest,
+    options: AnalysisOptions,
+    loader: DocumentLoader,
+    add_subfolder: bool = False,
+) -> None:
+    """Process documents concurrently with a shared semaphore and loader.
+
+    Batch updates still pending in the manifest are written at the end, also
+    when the run fails or is interrupted.
+    """
+    try:
+        await tqdm_asyncio.gather(
+            *(
+                process_document(
+                    filename,
+                    cases,
+                    encodings,
+                    model,
+                    output_folder,
+                    semaphore,
+                    manifest,
+                    options,
+                    loader,
+                    add_subfolder,
+                )
+                for filename in filenames
+            ),
+            desc="Processing files",
+            unit="file",
+            leave=True,
+        )
+    finally:
+        manifest.flush()
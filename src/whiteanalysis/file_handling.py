@@ -1,21 +1,64 @@
 from io import BytesIO
+from typing import BinaryIO, Iterator, Optional
 
+import numpy as np
 import tiktoken
 from docx import Document
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from pypdf import PdfReader
 from unstructured.partition.pdf import partition_pdf
 
+from whiteanalysis.timing import stage
+
+# Bump whenever extraction output changes, so cached documents are re-extracted.
+EXTRACTOR_VERSION = 1
+
 
 class PDFDocument(BaseModel):
     filename: str
     page: int
     text: str
+    _token_counts: dict[str, int] = PrivateAttr(default_factory=dict)
+    _vectors: dict[str, np.ndarray] = PrivateAttr(default_factory=dict)
+
+    def token_count(self, encodings: tiktoken.Encoding) -> int:
+        """Number of tokens in the page text, computed once per encoding."""
+        count = self._token_counts.get(encodings.name)
+        if count is None:
+            with stage("tokenize", profile=True):
+                count = len(encodings.encode(self.text))
+            self._token_counts[encodings.name] = count
+        return count
+
+    def vector(self, embedder: str) -> Optional[np.ndarray]:
+        """Embedding of the page text by `embedder`, if it was computed before."""
+        return self._vectors.get(embedder)
+
+    def set_vector(self, embedder: str, vector: np.ndarray) -> None:
+        self._vectors[embedder] = vector
 
     def __str__(self) -> str:
         return f"<PAGE>{self.filename} - Page {self.page + 1} \n {self.text}\n</PAGE>"
 
 
+def iter_content_from_pdf(file: BinaryIO, filename: str) -> Iterator[PDFDocument]:
+    """Yields the pages of a PDF file one at a time.
+
+    Pages are parsed lazily, so only the page being extracted needs to be
+    held in memory besides the reader itself.
+
+    Args:
+        file: File object (file, BytesIO or mmap).
+        filename: Name of the file.
+
+    Yields:
+        Document objects.
+    """
+    pdf_reader = PdfReader(file)
+    for i, page in enumerate(pdf_reader.pages):
+        yield PDFDocument(filename=filename, page=i, text=page.extract_text())
+
+
 def get_content_from_pdf(file: BytesIO, filename: str) -> list[PDFDocument]:
     """Loads a PDF file into a list of Document objects.
 
@@ -26,14 +69,7 @@ def get_content_from_pdf(file: BytesIO, filename: str) -> list[PDFDocument]:
     Returns:
         List of Document objects.
     """
-    pdf_reader = PdfReader(file)
-    text = ""
-    pages: list[PDFDocument] = []
-    for i, page in enumerate(pdf_reader.pages):
-        text = page.extract_text()
-        doc = PDFDocument(filename=filename, page=i, text=text)
-        pages.append(doc)
-    return pages
+    return list(iter_content_from_pdf(file, filename))
 
 
 def get_content_from_unstructured(filename: str) -> list[PDFDocument]:
@@ -63,38 +99,28 @@ def get_content_from_unstructured(filename: str) -> list[PDFDocument]:
     return documents
 
 
-def get_content_from_docx(
-    file: BytesIO,
+def iter_content_from_docx(
+    file: BinaryIO,
     filename: str,
     encodings: tiktoken.Encoding,
     tokens_per_page: int = 1000,
-) -> list[PDFDocument]:
-    """Extracts text from a DOCX file and splits it into pages based on token count.
+) -> Iterator[PDFDocument]:
+    """Yields the text of a DOCX file split into pages based on token count.
 
     Args:
-        file: DOCX file as bytes
+        file: DOCX file object (file, BytesIO or mmap)
         filename: Name of the file
         encodings: Tokenizer object with encode method
         tokens_per_page: Maximum tokens per page
 
-    Returns:
-        List of PDFDocument objects, each containing text within token limit
+    Yields:
+        PDFDocument objects, each containing text within token limit
     """
     doc = Document(file)
-    pages: list[PDFDocument] = []
     current_text: list[str] = []
     current_tokens = 0
     page_num = 0
 
-    def create_page() -> None:
-        nonlocal current_text, page_num, current_tokens
-        if current_text:
-            text = "\n".join(current_text)
-            pages.append(PDFDocument(filename=filename, page=page_num, text=text))
-            page_num += 1
-            current_text = []
-            current_tokens = 0
-
     for paragraph in doc.paragraphs:
         text = paragraph.text.strip()
         if not text:
@@ -102,18 +128,49 @@ def get_content_from_docx(
 
         # Check for section break
         if hasattr(paragraph._element, "sectPr"):
-            create_page()
+            if current_text:
+                yield _docx_page(filename, page_num, current_text)
+                page_num += 1
+                current_text = []
+                current_tokens = 0
             continue
 
         # Check token count
         tokens = len(encodings.encode(text))
-        if current_tokens + tokens > tokens_per_page:
-            create_page()
+        if current_text and current_tokens + tokens > tokens_per_page:
+            yield _docx_page(filename, page_num, current_text)
+            page_num += 1
+            current_text = []
+            current_tokens = 0
 
         current_text.append(text)
         current_tokens += tokens
 
     # Add remaining text
-    create_page()
+    if current_text:
+        yield _docx_page(filename, page_num, current_text)
+
+
+def _docx_page(filename: str, page_num: int, paragraphs: list[str]) -> PDFDocument:
+    return PDFDocument(filename=filename, page=page_num, text="\n".join(paragraphs))
 
+
+def get_content_from_docx(
+    file: BytesIO,
+    filename: str,
+    encodings: tiktoken.Encoding,
+    tokens_per_page: int = 1000,
+) -> list[PDFDocument]:
+    """Extracts text from a DOCX file and splits it into pages based on token count.
+
+    Args:
+        file: DOCX file as bytes
+        filename: Name of the file
+        encodings: Tokenizer object with encode method
+        tokens_per_page: Maximum tokens per page
+
+    Returns:
+        List of PDFDocument objects, each containing text within token limit
+    """
+    pages = list(iter_content_from_docx(file, filename, encodings, tokens_per_page))
     return pages or [PDFDocument(filename=filename, page=0, text="")]
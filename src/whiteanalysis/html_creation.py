@@ -1,8 +1,202 @@
 import html
-from typing import List
+import os
+from typing import List, Optional, TextIO
 
 from whiteanalysis.prompts import Insights
 
+STYLESHEET_NAME = "report.css"
+
+STYLESHEET = """body {
+    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+    line-height: 1.6;
+    max-width: 1200px;
+    margin: 0 auto;
+    padding: 20px;
+    background-color: #f5f5f5;
+}
+.header {
+    background-color: #fff;
+    padding: 20px;
+    border-radius: 8px;
+    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    margin-bottom: 20px;
+}
+.header h1 {
+    color: #2c3e50;
+    margin: 0;
+    padding-bottom: 10px;
+}
+.meta-info {
+    color: #666;
+    font-size: 0.9em;
+}
+.insight-container {
+    background-color: #fff;
+    padding: 20px;
+    border-radius: 8px;
+    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    margin-bottom: 20px;
+}
+.context-box {
+    background-color: #f8f9fa;
+    padding: 15px;
+    border-left: 4px solid #4a90e2;
+    margin-bottom: 20px;
+}
+.quote-box {
+    background-color: #fff;
+    padding: 15px;
+    border: 1px solid #e0e0e0;
+    border-radius: 4px;
+    margin-bottom: 15px;
+}
+.quote-text {
+    font-style: italic;
+    color: #2c3e50;
+    border-left: 3px solid #4a90e2;
+    padding-left: 10px;
+    margin: 10px 0;
+}
+.quote-position {
+    color: #666;
+    font-size: 0.9em;
+    margin-top: 5px;
+}
+.quote-box.unverified {
+    border-color: #e0a800;
+    background-color: #fffbea;
+}
+.quote-flag {
+    color: #8a6100;
+    font-weight: bold;
+    margin-bottom: 5px;
+}
+.quote-relation {
+    background-color: #f0f7ff;
+    padding: 10px;
+    border-radius: 4px;
+    margin-top: 10px;
+}
+h2, h3 {
+    color: #2c3e50;
+}
+"""
+
+# Report fragments, filled with str.format and written one after another
+_HEADER = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Case Study Quotes</title>
+    <link rel="stylesheet" href="{stylesheet}">
+</head>
+<body>
+    <div class="header">
+        <h1>Cases and Quotes</h1>
+        <div class="meta-info">
+            <p><strong>Source File:</strong> {filename}</p>
+            <p><strong>Model:</strong> {model}</p>
+        </div>
+    </div>
+"""
+
+_INSIGHT = """    <div class="insight-container">
+        <h2>Insight Set {index}</h2>
+        <div class="context-box">
+            <h3>General Context</h3>
+            <p>{general_context}</p>
+            <h3>Relevance</h3>
+            <p>{general_relation}</p>
+        </div>
+        <h3>Extracted Quotes</h3>
+"""
+
+_QUOTE = """        <div class="{box_class}">
+{flag}            <p><strong>{text}</strong> </p>
+            <div class="quote-context">{context}</div>
+            <div class="quote-position"><strong>Position:</strong> {position}</div>
+{also_quoted}            <div class="quote-issue_in_draft"><strong>Issue in Draft:</strong> {issue_in_draft}</div>
+            <div class="quote-relation">
+                <strong>Relevance:</strong> {relation}
+            </div>
+        </div>
+"""
+
+_UNVERIFIED = """            <div class="quote-flag">Not found in the source document; \
+check before citing.</div>
+"""
+
+_ALSO_QUOTED = """            <div class="quote-position"><strong>Also quoted in:</strong> \
+{references}</div>
+"""
+
+_INSIGHT_END = "    </div>\n"
+
+_FOOTER = """</body>
+</html>
+"""
+
+
+def write_stylesheet(folder: str) -> str:
+    """
+    Write the shared report stylesheet into a folder, unless it is up to date.
+
+    Args:
+        folder: Folder of the stylesheet
+
+    Returns:
+        Path of the stylesheet
+    """
+    path = os.path.join(folder, STYLESHEET_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == STYLESHEET:
+                return path
+    except OSError:
+        pass
+    os.makedirs(folder, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(STYLESHEET)
+    return path
+
+
+def write_insights(f: TextIO, responses: List[Insights]) -> None:
+    """
+    Write the insight sets and their quotes to an open report file.
+
+    Args:
+        f: Report file, positioned after the header
+        responses: List of Insights objects
+    """
+    for i, insight in enumerate(responses, 1):
+        f.write(
+            _INSIGHT.format(
+                index=i,
+                general_context=html.escape(insight.general_context),
+                general_relation=html.escape(insight.general_relation),
+            )
+        )
+        for quote in insight.quotes:
+            unverified = quote.verified is False
+            f.write(
+                _QUOTE.format(
+                    box_class="quote-box unverified" if unverified else "quote-box",
+                    flag=_UNVERIFIED if unverified else "",
+                    text=html.escape(quote.text),
+                    context=html.escape(quote.context),
+                    position=html.escape(quote.position),
+                    also_quoted=_ALSO_QUOTED.format(
+                        references=html.escape("; ".join(quote.also_quoted))
+                    )
+                    if quote.also_quoted
+                    else "",
+                    issue_in_draft=html.escape(quote.issue_in_draft),
+                    relation=html.escape(quote.relation),
+                )
+            )
+        f.write(_INSIGHT_END)
+
 
 def generate_insights_report(
     responses: List[Insights],
@@ -10,139 +204,37 @@ def generate_insights_report(
     case: str,
     model: str,
     output_path: str = "insights_report.html",
+    stylesheet: Optional[str] = None,
 ):
     """
     Generate an HTML report from a list of Insights objects.
 
+    The report is written to the file piece by piece and links the shared
+    stylesheet instead of embedding it.
+
     Args:
         responses: List of Insights objects
         filename: Source filename
         case: Case description
         model: Model name
         output_path: Path where the HTML file will be saved
+        stylesheet: Path of the shared stylesheet (see `write_stylesheet`);
+            written next to the report if not given
     """
-
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Case Study Quotes</title>
-        <style>
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                line-height: 1.6;
-                max-width: 1200px;
-                margin: 0 auto;
-                padding: 20px;
-                background-color: #f5f5f5;
-            }}
-            .header {{
-                background-color: #fff;
-                padding: 20px;
-                border-radius: 8px;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                margin-bottom: 20px;
-            }}
-            .header h1 {{
-                color: #2c3e50;
-                margin: 0;
-                padding-bottom: 10px;
-            }}
-            .meta-info {{
-                color: #666;
-                font-size: 0.9em;
-            }}
-            .insight-container {{
-                background-color: #fff;
-                padding: 20px;
-                border-radius: 8px;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                margin-bottom: 20px;
-            }}
-            .context-box {{
-                background-color: #f8f9fa;
-                padding: 15px;
-                border-left: 4px solid #4a90e2;
-                margin-bottom: 20px;
-            }}
-            .quote-box {{
-                background-color: #fff;
-                padding: 15px;
-                border: 1px solid #e0e0e0;
-                border-radius: 4px;
-                margin-bottom: 15px;
-            }}
-            .quote-text {{
-                font-style: italic;
-                color: #2c3e50;
-                border-left: 3px solid #4a90e2;
-                padding-left: 10px;
-                margin: 10px 0;
-            }}
-            .quote-position {{
-                color: #666;
-                font-size: 0.9em;
-                margin-top: 5px;
-            }}
-            .quote-relation {{
-                background-color: #f0f7ff;
-                padding: 10px;
-                border-radius: 4px;
-                margin-top: 10px;
-            }}
-            h2, h3 {{
-                color: #2c3e50;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>Cases and Quotes</h1>
-            <div class="meta-info">
-                <p><strong>Source File:</strong> {html.escape(filename)}</p>
-                <p><strong>Model:</strong> {html.escape(model)}</p>
-            </div>
-        </div>
-    """
-
-    for i, insight in enumerate(responses, 1):
-        html_content += f"""
-        <div class="insight-container">
-            <h2>Insight Set {i}</h2>
-            
-            <div class="context-box">
-                <h3>General Context</h3>
-                <p>{html.escape(insight.general_context)}</p>
-                <h3>Relevance</h3>
-                <p>{html.escape(insight.general_relation)}</p>
-            </div>
-            
-            <h3>Extracted Quotes</h3>
-        """
-
-        for quote in insight.quotes:
-            html_content += f"""
-            <div class="quote-box">
-                <p><strong>{html.escape(quote.text)}</strong> </p>
-                <div class="quote-context">{html.escape(quote.context)}</div>
-                <div class="quote-position"><strong>Position:</strong> {html.escape(quote.position)}</div>
-                <div class="quote-issue_in_draft"><strong>Issue in Draft:</strong> {html.escape(quote.issue_in_draft if hasattr(quote, 'issue_in_draft') else "")}</div>
-                <div class="quote-relation">
-                    <strong>Relevance:</strong> {html.escape(quote.relation)}
-                </div>
-            </div>
-            """
-
-        html_content += "</div>"
-
-    html_content += """
-    </body>
-    </html>
-    """
+    folder = os.path.dirname(output_path) or "."
+    if stylesheet is None:
+        stylesheet = write_stylesheet(folder)
+    href = os.path.relpath(stylesheet, folder).replace(os.sep, "/")
 
     with open(output_path, "w", encoding="utf-8") as f:
-        f.write(html_content)
+        f.write(
+            _HEADER.format(
+                stylesheet=html.escape(href),
+                filename=html.escape(filename),
+                model=html.escape(model),
+            )
+        )
+        write_insights(f, responses)
+        f.write(_FOOTER)
 
     return output_path
@@ -0,0 +1,283 @@
+import asyncio
+import bisect
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import structlog
+import tiktoken
+from pydantic import BaseModel
+
+from whiteanalysis.cache import file_digest
+from whiteanalysis.embeddings import embed_texts
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.ingest import DocumentLoader
+from whiteanalysis.watch import FileStat, file_stat
+
+logger = structlog.get_logger()
+
+
+class IndexedDocument(BaseModel):
+    """Rows of one document in the corpus index."""
+
+    digest: str
+    # Modification time (ns) and size the digest was computed for
+    stat: Optional[FileStat] = None
+    start: int
+    pages: List[int]
+
+
+class IndexData(BaseModel):
+    """Metadata of the corpus index, stored as `index.json` next to the vectors."""
+
+    embedder: str
+    dim: int = 0
+    rows: int = 0
+    documents: Dict[str, IndexedDocument] = {}
+
+
+class SearchHit(BaseModel):
+    """A page of the corpus ranked by similarity to a query."""
+
+    filename: str
+    page: int
+    row: int
+    score: float
+
+
+class CorpusIndex:
+    """Page embeddings of all documents of a corpus.
+
+    The vectors are stored as one float32 matrix in `vectors.f32`, which is
+    memory-mapped for searching, and `index.json` maps row ranges to
+    documents and pages. New documents are appended; changed or removed
+    documents are dropped by rewriting the matrix without their rows. The
+    metadata is replaced atomically after the vectors are written, so an
+    interrupted update leaves the previous index intact.
+    """
+
+    def __init__(self, folder: str, embedder: str):
+        self.folder = folder
+        self.meta_path = os.path.join(folder, "index.json")
+        self.vectors_path = os.path.join(folder, "vectors.f32")
+        os.makedirs(folder, exist_ok=True)
+        self.data = IndexData(embedder=embedder)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                data = IndexData.model_validate_json(f.read())
+            if data.embedder == embedder:
+                self.data = data
+            else:
+                logger.warning("Rebuilding index for new embedder", embedder=embedder)
+        self._matrix: Optional[np.memmap] = None
+        self._starts: List[int] = []
+        self._names: List[str] = []
+
+    @staticmethod
+    def folder_for(cache_folder: str, embedder: str) -> str:
+        return os.path.join(cache_folder, "index", re.sub(r"[^\w.-]", "_", embedder))
+
+    async def stale(
+        self, filenames: List[str]
+    ) -> Tuple[Dict[str, Tuple[str, FileStat]], List[str]]:
+        """Compares the corpus with the index.
+
+        Files are only hashed (in threads) if their modification time or size
+        differs from the indexed one. Files whose content turns out unchanged
+        just get their new stat recorded.
+
+        Returns:
+            Digests and stats of the new or changed files, and the indexed
+            files that were changed or removed
+        """
+        stats = {
+            name: stat for name in filenames if (stat := file_stat(name)) is not None
+        }
+        suspects = [
+            name
+            for name, stat in stats.items()
+            if name not in self.data.documents or self.data.documents[name].stat != stat
+        ]
+        digests = await asyncio.gather(
+            *(asyncio.to_thread(file_digest, name) for name in suspects)
+        )
+        changed: Dict[str, Tuple[str, FileStat]] = {}
+        touched = False
+        for name, digest in zip(suspects, digests):
+            record = self.data.documents.get(name)
+            if record is not None and record.digest == digest:
+                record.stat = stats[name]
+                touched = True
+            else:
+                changed[name] = (digest, stats[name])
+        if touched:
+            self.save()
+        dropped = [
+            name for name in self.data.documents if name not in stats or name in changed
+        ]
+        return changed, dropped
+
+    def remove(self, filenames: List[str]) -> None:
+        """Drops the rows of `filenames` by rewriting the matrix without them."""
+        if not filenames:
+            return
+        matrix = self.matrix()
+        documents = {k: v for k, v in self.data.documents.items() if k not in filenames}
+        tmp_path = f"{self.vectors_path}.tmp"
+        start = 0
+        with open(tmp_path, "wb") as f:
+            for document in sorted(documents.values(), key=lambda x: x.start):
+                count = len(document.pages)
+                f.write(
+                    np.ascontiguousarray(
+                        matrix[document.start : document.start + count]
+                    ).tobytes()
+                )
+                document.start = start
+                start += count
+        # Release the map before replacing the file it points to
+        del matrix
+        self._matrix = None
+        os.replace(tmp_path, self.vectors_path)
+        self.data.documents = documents
+        self.data.rows = start
+        self.save()
+
+    def add(
+        self,
+        filename: str,
+        digest: str,
+        pages: List[int],
+        vectors: np.ndarray,
+        stat: Optional[FileStat] = None,
+    ) -> None:
+        """Appends the page vectors of a document."""
+        if self.data.dim and vectors.shape[1] != self.data.dim:
+            raise ValueError(f"Expected {self.data.dim} dimensions: {filename}")
+        self.data.dim = int(vectors.shape[1])
+        with open(self.vectors_path, "ab") as f:
+            # Drop rows of an interrupted update that never made it into the metadata
+            f.truncate(self.data.rows * self.data.dim * 4)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self.data.documents[filename] = IndexedDocument(
+            digest=digest, stat=stat, start=self.data.rows, pages=pages
+        )
+        self.data.rows += len(pages)
+        self._matrix = None
+        self.save()
+
+    def save(self) -> None:
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.data.model_dump_json())
+        os.replace(tmp_path, self.meta_path)
+
+    def matrix(self) -> np.ndarray:
+        """The memory-mapped vectors, one row per indexed page."""
+        if not self.data.rows:
+            return np.zeros((0, self.data.dim), dtype=np.float32)
+        if self._matrix is None:
+            self._matrix = np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(self.data.rows, self.data.dim),
+            )
+            ranges = sorted(
+                (x.start, name) for name, x in self.data.documents.items() if x.pages
+            )
+            self._starts = [x[0] for x in ranges]
+            self._names = [x[1] for x in ranges]
+        return self._matrix
+
+    def locate(self, row: int) -> Tuple[str, int]:
+        """The document and page of a row."""
+        self.matrix()
+        filename = self._names[bisect.bisect_right(self._starts, row) - 1]
+        document = self.data.documents[filename]
+        return filename, document.pages[row - document.start]
+
+    def search(self, vector: np.ndarray, top_k: int) -> List[SearchHit]:
+        """Ranks all indexed pages by cosine similarity to a unit `vector`."""
+        matrix = self.matrix()
+        if not len(matrix) or top_k <= 0:
+            return []
+        started = time.perf_counter()
+        scores = matrix @ vector.astype(np.float32)
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        hits = []
+        for row in top:
+            filename, page = self.locate(int(row))
+            hits.append(
+                SearchHit(
+                    filename=filename, page=page, row=int(row), score=float(scores[row])
+                )
+            )
+        logger.debug(
+            "Searched index",
+            rows=len(matrix),
+            ms=round((time.perf_counter() - started) * 1000, 2),
+        )
+        return hits
+
+
+async def index_document(
+    index: CorpusIndex,
+    filename: str,
+    digest: str,
+    pages: List[PDFDocument],
+    encodings: Optional[tiktoken.Encoding] = None,
+    stat: Optional[FileStat] = None,
+) -> None:
+    """Embeds the pages of a document and appends them to the index."""
+    if not pages:
+        vectors = np.zeros((0, index.data.dim), dtype=np.float32)
+    else:
+        vectors = await embed_texts(
+            [x.text for x in pages], index.data.embedder, encodings
+        )
+    index.add(filename, digest, [x.page for x in pages], vectors, stat)
+    logger.debug("Indexed document", filename=filename, pages=len(pages))
+
+
+async def update_index(
+    index: CorpusIndex,
+    filenames: List[str],
+    loader: DocumentLoader,
+    encodings: Optional[tiktoken.Encoding] = None,
+) -> None:
+    """Brings the index up to date with `filenames`.
+
+    Only new and changed files are extracted and embedded; files that were
+    changed or removed since the last update are dropped first. Files that
+    cannot be extracted or embedded are logged and left out, so they are
+    tried again by the next update.
+    """
+    changed, dropped = await index.stale(filenames)
+    index.remove(dropped)
+
+    async def add(filename: str) -> bool:
+        try:
+            pages = await loader.load(filename)
+            digest, stat = changed[filename]
+            await index_document(index, filename, digest, pages, encodings, stat)
+        except Exception as e:
+            logger.exception(
+                "Could not index document", filename=filename, error=str(e)
+            )
+            return False
+        return True
+
+    added = await asyncio.gather(*(add(x) for x in changed))
+    logger.info(
+        "Updated corpus index",
+        added=sum(added),
+        failed=len(added) - sum(added),
+        dropped=len(dropped),
+        documents=len(index.data.documents),
+        pages=index.data.rows,
+    )
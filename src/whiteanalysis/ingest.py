@@ -0,0 +1,240 @@
+import asyncio
+import mmap
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache
+from typing import BinaryIO, Generator, Iterator, List, Optional, Tuple, cast
+
+import structlog
+import tiktoken
+
+from whiteanalysis.cache import (
+    DocumentCache,
+    file_digest,
+    get_document_cache,
+    open_document_cache,
+)
+from whiteanalysis.file_handling import (
+    PDFDocument,
+    get_content_from_unstructured,
+    iter_content_from_docx,
+    iter_content_from_pdf,
+)
+from whiteanalysis.metrics import (
+    MetricsSnapshot,
+    drain,
+    increment,
+    merge,
+    record_extraction,
+)
+from whiteanalysis.profiling import pop_stage, push_stage, start_sampling
+from whiteanalysis.timing import record_stage, stage
+
+logger = structlog.get_logger()
+
+
+def load_document(filename: str, encodings: tiktoken.Encoding) -> List[PDFDocument]:
+    """Extract the pages of a PDF or DOCX file.
+
+    Falls back to unstructured extraction if the regular extraction yields
+    (almost) no text. Results are stored in the document cache, if enabled,
+    so unchanged files are not parsed again.
+
+    Args:
+        filename: Path to the document file
+        encodings: Tokenizer encoding
+
+    Returns:
+        List of PDFDocument objects
+    """
+    return list(iter_document(filename, encodings))
+
+
+def iter_document(filename: str, encodings: tiktoken.Encoding) -> Iterator[PDFDocument]:
+    """Yield the pages of a PDF or DOCX file one at a time.
+
+    Cached documents are streamed from the document cache; otherwise pages
+    are extracted lazily and written through to the cache.
+
+    Args:
+        filename: Path to the document file
+        encodings: Tokenizer encoding
+
+    Yields:
+        PDFDocument objects
+    """
+    cache = get_document_cache()
+    if cache is None:
+        yield from timed_pages(filename, iter_extracted_document(filename, encodings))
+        return
+
+    key = DocumentCache.key(file_digest(filename), encodings.name)
+    cached = cache.iter(key, filename)
+    if cached is not None:
+        logger.debug(f"Using cached extraction for {filename}")
+        increment("document_cache_hits")
+        yield from timed_pages(filename, cached, "cache")
+        return
+    increment("document_cache_misses")
+    yield from cache.write_through(
+        key, timed_pages(filename, iter_extracted_document(filename, encodings))
+    )
+
+
+def timed_pages(
+    filename: str, pages: Iterator[PDFDocument], extractor: str = "cache"
+) -> Iterator[PDFDocument]:
+    """Yields `pages`, recording the time spent producing them.
+
+    Only the time spent inside `pages` counts, not the time the caller takes
+    between pages. The extractor is the return value of `pages`, if any.
+    """
+    seconds = 0.0
+    count = 0
+    while True:
+        start = time.perf_counter()
+        push_stage("extract")
+        try:
+            page = next(pages)
+        except StopIteration as e:
+            extractor = e.value or extractor
+            break
+        finally:
+            pop_stage()
+            seconds += time.perf_counter() - start
+        count += 1
+        yield page
+    record_stage("extract", seconds)
+    record_extraction(filename, extractor, seconds, count)
+
+
+def iter_extracted_document(
+    filename: str, encodings: tiktoken.Encoding
+) -> Generator[PDFDocument, None, str]:
+    """Yield the pages of a PDF or DOCX file without using the cache.
+
+    PDFs are memory-mapped and DOCX files read lazily from the open file
+    instead of reading the whole file into memory. Pages are
+    only held back until the document is known to contain more than 100
+    tokens; near-empty documents are re-extracted with unstructured.
+
+    Args:
+        filename: Path to the document file
+        encodings: Tokenizer encoding
+
+    Yields:
+        PDFDocument objects
+
+    Returns:
+        Name of the extractor that produced the pages
+    """
+    total_length = 0
+    with ExitStack() as stack:
+        file = stack.enter_context(open(filename, "rb"))
+        if filename.lower().endswith(".docx"):
+            logger.debug(f"Extracting content from DOCX: {filename}")
+            extractor = "docx"
+            pages = iter_content_from_docx(file, filename, encodings)
+        else:
+            logger.debug(f"Extracting content from PDF: {filename}")
+            extractor = "pdf"
+            data = stack.enter_context(
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+            # pypdf reads the mapping like a file, though mmap is not typed as one
+            pages = iter_content_from_pdf(cast(BinaryIO, data), filename)
+
+        head: Optional[List[PDFDocument]] = []
+        for page in pages:
+            total_length += page.token_count(encodings)
+            if head is None:
+                yield page
+                continue
+            head.append(page)
+            if total_length > 100:
+                yield from head
+                head = None
+    logger.debug(f"Total tokens in document: {total_length}")
+
+    if total_length <= 100:
+        logger.debug(f"Using unstructured extraction for {filename}")
+        increment("unstructured_fallbacks")
+        unst_pages = get_content_from_unstructured(filename)
+        for i, unst_page in enumerate(unst_pages):
+            yield PDFDocument(
+                page=i + 1,
+                text=unst_page.text,
+                filename=filename,
+            )
+        return "unstructured"
+    return extractor
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(name: str) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+
+def _init_worker(cache_folder: Optional[str], profile: bool) -> None:
+    if cache_folder:
+        open_document_cache(cache_folder)
+    if profile:
+        start_sampling()
+
+
+def _load_in_worker(
+    filename: str, encoding_name: str
+) -> Tuple[List[PDFDocument], MetricsSnapshot]:
+    """Runs load_document in a worker process, where encodings are loaded by name.
+
+    The metrics collected while loading are returned along with the pages, so
+    the parent process can merge them.
+    """
+    pages = load_document(filename, _get_encoding(encoding_name))
+    return pages, drain()
+
+
+class DocumentLoader:
+    """Extracts documents in a pool of worker processes.
+
+    Parsing with pypdf and unstructured is CPU-bound, so documents are parsed
+    in parallel and each one is handed to its caller as soon as it is ready,
+    while other documents are still being parsed or analyzed. With zero
+    workers, documents are parsed in a thread of the current process.
+    """
+
+    def __init__(
+        self,
+        encodings: tiktoken.Encoding,
+        workers: int = 0,
+        cache_folder: Optional[str] = None,
+        profile: bool = False,
+    ):
+        self.encodings = encodings
+        self.pool: Optional[ProcessPoolExecutor] = None
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(cache_folder, profile),
+            )
+
+    async def load(self, filename: str) -> List[PDFDocument]:
+        """Returns the pages of a document once it has been extracted."""
+        with stage("ingest"):
+            if self.pool is None:
+                return await asyncio.to_thread(load_document, filename, self.encodings)
+            loop = asyncio.get_running_loop()
+            pages, metrics = await loop.run_in_executor(
+                self.pool, _load_in_worker, filename, self.encodings.name
+            )
+            merge(metrics)
+            return pages
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
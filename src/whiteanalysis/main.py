@@ -1,35 +1,116 @@
+import asyncio
+import functools
+import inspect
 import json
 import os
 import re
+import sqlite3
+import tempfile
 import time
-from io import BytesIO
-from typing import Dict, List
+from typing import (
+    Annotated,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Type,
+    TypeVar,
+    cast,
+    get_args,
+    get_origin,
+)
 
+import click
 import structlog
-import tenacity
 import tiktoken
 import typer
-from tqdm.auto import tqdm
+from pydantic import BaseModel
+from tqdm import tqdm
 
-from whiteanalysis.file_handling import (
-    PDFDocument,
-    get_content_from_docx,
-    get_content_from_pdf,
-    get_content_from_unstructured,
+from whiteanalysis.batch import (
+    FINAL_STATUSES,
+    BatchJob,
+    BatchRequest,
+    case_prompts,
+    get_backend,
+    parse_result,
+    request_body,
+    wait_for_batch,
+)
+from whiteanalysis.benchmark import (
+    MockServer,
+    MockSettings,
+    benchmark_report,
+    use_mock_server,
+)
+from whiteanalysis.cache import (
+    file_digest,
+    get_response_cache,
+    open_document_cache,
+    open_response_cache,
+    response_cache_key,
+)
+from whiteanalysis.dedup import (
+    close_quote_clusters,
+    get_quote_clusters,
+    open_quote_clusters,
 )
-from whiteanalysis.html_creation import generate_insights_report
+from whiteanalysis.embeddings import embed_texts, open_embedding_cache
+from whiteanalysis.engine import (
+    process_documents,
+    report_folder,
+    run_documents,
+    run_full_page,
+    write_case_reports,
+)
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.html_creation import write_stylesheet
+from whiteanalysis.index import CorpusIndex, SearchHit, update_index
+from whiteanalysis.ingest import DocumentLoader, load_document
+from whiteanalysis.manifest import RunManifest, document_counts, summarize
+from whiteanalysis.metrics import (
+    reset_metrics,
+    run_summary,
+    write_prometheus,
+    write_run_summary,
+)
+from whiteanalysis.options import DEFAULT_INGEST_WORKERS, AnalysisOptions, RunSettings
 from whiteanalysis.paper import py_cases
-from whiteanalysis.prompts import (
-    Insights,
-    create_batched_prompts,
-    create_full_paper_prompts,
+from whiteanalysis.profiling import profile_run
+from whiteanalysis.prompts import Insights, PromptLayout, QuoteSchema
+from whiteanalysis.rate_limit import get_rate_limiter
+from whiteanalysis.store import open_insight_store
+from whiteanalysis.timing import get_stages
+from whiteanalysis.usage import (
+    BATCH_TIER,
+    get_usage,
+    log_usage,
+    record_usage,
+    reset_usage,
+    usage_label,
 )
-from whiteanalysis.utils import return_client
-from whiteanalysis.word_creation import generate_word_report
+from whiteanalysis.utils import close_async_client, configure_clients
+from whiteanalysis.verify import QuoteIndex
+from whiteanalysis.watch import FolderWatcher
 
 app = typer.Typer()
 logger = structlog.get_logger()
 
+# Command line options taking one of the values of their Literal type
+PromptLayoutOption = Annotated[
+    PromptLayout, typer.Option(click_type=click.Choice(get_args(PromptLayout)))
+]
+QuoteSchemaOption = Annotated[
+    QuoteSchema, typer.Option(click_type=click.Choice(get_args(QuoteSchema)))
+]
+
+CommandT = TypeVar("CommandT", bound=Callable[..., Any])
+
+# Number of documents analyzed at once by `search --analyze`
+SEARCH_CONCURRENCY = 8
+
 
 def clean_json_string(text):
     """
@@ -57,268 +138,1036 @@ def clean_json_string(text):
     return text
 
 
-@tenacity.retry(
-    wait=tenacity.wait_exponential(min=1, max=60),
-    stop=tenacity.stop_after_attempt(5),
-    retry=tenacity.retry_if_exception_type((Exception)),
-)
-def run_full_page(
-    pages: List[PDFDocument], case_text: str, encodings: tiktoken.Encoding, model: str
-) -> List[Insights]:
-    """Run analysis on full document pages.
+def find_documents(document_folder: str) -> List[str]:
+    """Paths of the PDF and DOCX files in a folder."""
+    return [
+        os.path.join(document_folder, x)
+        for x in os.listdir(document_folder)
+        if x.lower().endswith(".pdf") or x.lower().endswith(".docx")
+    ]
 
-    Args:
-        pages: List of PDFDocument objects containing page content
-        case_text: The case text to analyze against
-        encodings: Tokenizer encoding
-        model: Model identifier to use
 
-    Returns:
-        List of Insights objects containing analysis results
+def read_cases(inputs: str, fallback: bool = True) -> Dict[str, str]:
+    """Reads the cases from a JSON file, falling back to the built-in cases.
 
-    Raises:
-        Exception: If API call fails after retries
+    With `fallback=False`, invalid files raise instead.
     """
-    iclient, _ = return_client()
-    responses = []
+    with open(inputs, "r", encoding="utf-8") as f:
+        try:
+            cleaned = clean_json_string(f.read())
+            return json.loads(cleaned)
+        except Exception:
+            if not fallback:
+                raise
+            return py_cases
 
-    try:
-        full_page_prompts = create_full_paper_prompts(
-            pages, case_text, encodings=encodings
-        )
-        token_count = sum(
-            len(encodings.encode(x["content"])) for x in full_page_prompts
-        )
-        logger.debug(f"Tokens in prompts: {token_count}")
 
-        response = iclient.create(
-            messages=full_page_prompts, response_model=Insights, model=model
-        )
-        responses.append(response)
-        time.sleep(60)
-        return responses
+def load_encodings(model: str) -> tiktoken.Encoding:
+    """Tokenizer of a model.
+
+    Prompts are packed by token count, so a run cannot go on without it.
 
+    Raises:
+        Exception: If tiktoken does not know the model or cannot load its
+            encoding
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
     except Exception as e:
-        logger.exception("Error running full page analysis", error=str(e))
+        logger.error("Error loading tokenizer", model=model, error=str(e))
         raise
 
 
-@tenacity.retry(
-    wait=tenacity.wait_exponential(min=1, max=60),
-    stop=tenacity.stop_after_attempt(5),
-    retry=tenacity.retry_if_exception_type((Exception)),
-)
-def run_single_batch(
-    prompt: List[Dict], encodings: tiktoken.Encoding, model: str
-) -> Insights:
-    """Run analysis on a single batch of prompts.
+def option_groups(**groups: Type[BaseModel]) -> Callable[[CommandT], CommandT]:
+    """Exposes the fields of pydantic models as options of a command.
 
-    Args:
-        prompt: List of prompt dictionaries
-        encodings: Tokenizer encoding
-        model: Model identifier to use
+    The command takes one keyword argument per group, e.g.
+    `options: AnalysisOptions`. On the command line it gets one option per
+    field of the model instead, with the field description as help text and
+    the values of Literal fields as choices; the options are validated into
+    the model before the command runs. Python callers pass the model.
+    """
 
-    Returns:
-        Insights object containing analysis results
+    def decorate(command: CommandT) -> CommandT:
+        signature = inspect.signature(command)
+        fields = [
+            inspect.Parameter(
+                name,
+                inspect.Parameter.KEYWORD_ONLY,
+                default=field.default,
+                annotation=Annotated[
+                    field.annotation,
+                    typer.Option(
+                        help=field.description,
+                        click_type=click.Choice(get_args(field.annotation))
+                        if get_origin(field.annotation) is Literal
+                        else None,
+                    ),
+                ],
+            )
+            for model in groups.values()
+            for name, field in model.model_fields.items()
+        ]
 
-    Raises:
-        Exception: If API call fails after retries
-    """
-    iclient, _ = return_client()
-    try:
-        token_count = sum(len(encodings.encode(x["content"])) for x in prompt)
-        logger.debug(f"Tokens in prompts: {token_count}")
+        @functools.wraps(command)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            for group, model in groups.items():
+                if group not in kwargs:
+                    kwargs[group] = model.model_validate(
+                        {x: kwargs.pop(x) for x in model.model_fields if x in kwargs}
+                    )
+            return command(*args, **kwargs)
 
-        response = iclient.create(messages=prompt, response_model=Insights, model=model)
-        return response
+        parameters = [x for x in signature.parameters.values() if x.name not in groups]
+        setattr(
+            wrapper, "__signature__", signature.replace(parameters=parameters + fields)
+        )
+        return cast(CommandT, wrapper)
 
-    except Exception as e:
-        logger.exception("Error running batch analysis", error=str(e))
-        raise
+    return decorate
 
 
-def run_batched_prompts(
-    pages: List[PDFDocument],
-    case_text: str,
-    encodings: tiktoken.Encoding,
+def run_settings(
+    document_folder: str,
+    inputs: str,
     model: str,
-) -> List[Insights]:
-    """Run analysis on batched prompts for large documents.
+    add_subfolder: bool,
+    options: AnalysisOptions,
+) -> Dict[str, object]:
+    """Settings of a run stored in its manifest, which a resumed run reuses."""
+    return {
+        "document_folder": document_folder,
+        "inputs": inputs,
+        "model": model,
+        "add_subfolder": add_subfolder,
+        "options": options.model_dump(),
+    }
+
+
+def start_run(
+    model: str, output_folder: str, options: AnalysisOptions, settings: RunSettings
+) -> tiktoken.Encoding:
+    """Sets up the shared clients, limits, caches and stores of a run.
+
+    Returns:
+        Tokenizer of the model
+    """
+    write_stylesheet(output_folder)
+    encodings = load_encodings(model)
+    get_rate_limiter(model, settings.requests_per_minute, settings.tokens_per_minute)
+    connections = settings.max_connections or settings.concurrency
+    configure_clients(
+        max_connections=connections,
+        max_keepalive_connections=connections,
+        timeout=settings.request_timeout,
+    )
+    if settings.cache:
+        open_response_cache(
+            settings.cache_folder,
+            settings.cache_max_age_days,
+            settings.cache_max_size_mb,
+        )
+        open_document_cache(settings.cache_folder)
+        open_embedding_cache(settings.cache_folder)
+    if settings.store:
+        open_insight_store(settings.cache_folder)
+    if options.dedupe_quotes:
+        open_quote_clusters(output_folder)
+    return encodings
+
+
+@app.command()
+@option_groups(options=AnalysisOptions, settings=RunSettings)
+def run_analysis(
+    document_folder: str = "documents",
+    output_folder: str = "output",
+    inputs: str = "inputs/cases.json",
+    model: str = "gpt-4o-mini",
+    add_timestamp: bool = True,
+    add_subfolder: bool = False,
+    resume: Optional[str] = None,
+    profile: Optional[str] = None,
+    metrics_file: Optional[str] = None,
+    *,
+    options: AnalysisOptions,
+    settings: RunSettings,
+) -> RunManifest:
+    """Run analysis on a folder of documents.
 
     Args:
-        pages: List of PDFDocument objects
-        case_text: The case text to analyze against
-        encodings: Tokenizer encoding
+        document_folder: Folder containing PDF documents
+        output_folder: Folder for output files
+        inputs: JSON file containing cases
         model: Model identifier to use
+        resume: Run folder of an interrupted run; finished units are skipped and
+            its document folder, inputs, model and prompt settings are reused
+        profile: "sampling" to write a folded-stack profile per stage, or
+            "cprofile" for a profile of the main thread (the event loop
+            only), into `<run folder>/profile`
+        metrics_file: Also write the run metrics to this file in the
+            Prometheus text format
+        options: Prompt settings, one command line option per field
+        settings: Client, cache and worker settings, one command line option
+            per field
 
     Returns:
-        List of Insights objects containing analysis results
+        Manifest of the run
     """
-    responses = []
-    prompt_batch_size = 64000
-
+    start = time.perf_counter()
+    reset_metrics()
+    reset_usage()
     try:
-        prompt_batches = create_batched_prompts(
-            pages, case_text, prompt_batch_size, encodings
-        )
+        if resume:
+            manifest = RunManifest.load(resume)
+            stored = manifest.data.settings
+            document_folder = str(stored["document_folder"])
+            inputs = str(stored["inputs"])
+            model = str(stored["model"])
+            add_subfolder = bool(stored["add_subfolder"])
+            options = AnalysisOptions.model_validate(stored.get("options", {}))
+            output_folder = resume
+            logger.info("Resuming run", run_dir=resume, **summarize(manifest))
+
+        filenames = find_documents(document_folder)
+        cases = read_cases(inputs)
+
+        if not resume:
+            if add_timestamp:
+                output_folder = os.path.join(output_folder, time.strftime("%y%m%d%M"))
+            manifest = RunManifest.create(
+                output_folder,
+                run_settings(document_folder, inputs, model, add_subfolder, options),
+            )
+        encodings = start_run(model, output_folder, options, settings)
+        if options.stream_pages and options.retrieval_top_k:
+            logger.warning("Page retrieval is not available with --stream-pages")
+        if options.page_window is not None and options.stream_pages:
+            logger.warning("Page windows are not available with --stream-pages")
+        elif options.page_window is not None and options.multi_case > 1:
+            logger.warning("Page windows run one case per call; ignoring --multi-case")
 
-        with tqdm(
-            prompt_batches,
-            desc="Processing prompt batches",
-            unit="batch",
-            leave=False,
-        ) as pbar:
-            for batch in pbar:
-                response = run_single_batch(batch, encodings, model)
-                responses.append(response)
-                time.sleep(30)
+        profile_folder = os.path.join(output_folder, "profile")
+        with profile_run(profile, profile_folder) as profiles:
+            asyncio.run(
+                run_documents(
+                    filenames,
+                    cases,
+                    encodings,
+                    model,
+                    output_folder,
+                    settings.concurrency,
+                    manifest,
+                    options,
+                    add_subfolder,
+                    min(settings.ingest_workers, len(filenames)),
+                    settings.cache_folder if settings.cache else None,
+                    profile == "sampling",
+                )
+            )
 
-        return responses
+        close_quote_clusters(output_folder)
+        log_usage()
+        summary = run_summary(time.perf_counter() - start, profiles)
+        write_run_summary(summary, output_folder)
+        if metrics_file:
+            write_prometheus(summary, metrics_file)
+        logger.info("Analysis complete", run_dir=output_folder, **summarize(manifest))
+        return manifest
 
     except Exception as e:
-        logger.exception("Error running batched prompts", error=str(e))
-        return responses
+        logger.exception("Error in run_analysis", error=str(e))
+        raise typer.Exit(code=1)
 
 
-def process_document(
-    filename: str,
-    cases: Dict[str, str],
+async def watch_documents(
+    document_folder: str,
+    inputs: str,
     encodings: tiktoken.Encoding,
     model: str,
     output_folder: str,
+    concurrency: int,
+    manifest: RunManifest,
+    options: AnalysisOptions,
+    add_subfolder: bool,
+    ingest_workers: int,
+    cache_folder: Optional[str],
+    poll_interval: float,
+    metrics_file: Optional[str],
+    start: float,
+) -> None:
+    """Process new and changed documents and cases until cancelled.
+
+    One event loop, connection pool, semaphore and extraction pool serve all
+    cycles. Each poll compares the folder and the cases file with the last
+    one; documents whose content changed are analyzed again for every case,
+    changed or new cases for every document. Finished pairs are skipped via
+    the manifest, as in a resumed run.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    loader = DocumentLoader(encodings, ingest_workers, cache_folder)
+    watcher = FolderWatcher(inputs)
+    cases: Dict[str, str] = {}
+    try:
+        while True:
+            changes = watcher.poll(find_documents(document_folder))
+            if changes.cases_changed:
+                try:
+                    cases = read_cases(inputs, fallback=False)
+                    logger.info("Read cases", inputs=inputs, cases=len(cases))
+                except Exception as e:
+                    logger.error("Keeping previous cases", inputs=inputs, error=str(e))
+            for filename in changes.added + changes.changed:
+                digest = await asyncio.to_thread(file_digest, filename)
+                if manifest.update_digest(filename, digest):
+                    logger.info("Document changed", filename=filename)
+            for filename in changes.removed:
+                logger.info("Document removed; keeping its reports", filename=filename)
+
+            pending = [x for x in watcher.files if not manifest.document_done(x, cases)]
+            if changes and pending:
+                logger.info("Processing documents", documents=len(pending))
+                await process_documents(
+                    pending,
+                    cases,
+                    encodings,
+                    model,
+                    output_folder,
+                    semaphore,
+                    manifest,
+                    options,
+                    loader,
+                    add_subfolder,
+                )
+                clusters = get_quote_clusters()
+                if clusters is not None:
+                    clusters.save(output_folder)
+                summary = run_summary(time.perf_counter() - start)
+                write_run_summary(summary, output_folder)
+                if metrics_file:
+                    write_prometheus(summary, metrics_file)
+                logger.info(
+                    "Waiting for changes", run_dir=output_folder, **summarize(manifest)
+                )
+            await asyncio.sleep(poll_interval)
+    finally:
+        loader.close()
+        await close_async_client()
+
+
+@app.command()
+@option_groups(options=AnalysisOptions, settings=RunSettings)
+def watch(
+    document_folder: str = "documents",
+    output_folder: str = "output/watch",
+    inputs: str = "inputs/cases.json",
+    model: str = "gpt-4o-mini",
     add_subfolder: bool = False,
+    poll_interval: float = 5.0,
+    metrics_file: Optional[str] = None,
+    *,
+    options: AnalysisOptions,
+    settings: RunSettings,
 ) -> None:
-    """Process a single document file.
+    """Keep analyzing a folder of documents as documents and cases change.
+
+    The process stays up, so the tokenizer, the extraction workers, the API
+    connection pool and the caches are loaded once. Every `poll_interval`
+    seconds the folder and the cases file are checked, and only new or
+    changed (document, case) pairs are analyzed. All reports go to a single
+    run folder; stopping and restarting the watcher continues its manifest.
+    Changing the prompt settings does not redo finished pairs. Stop with
+    Ctrl+C.
 
     Args:
-        filename: Path to the document file
-        cases: Dictionary of cases to analyze
-        encodings: Optional tokenizer encoding
+        document_folder: Folder containing PDF and DOCX documents
+        output_folder: Run folder for the reports and the manifest
+        inputs: JSON file containing cases
         model: Model identifier to use
-        output_folder: Base output folder path
-        add_subfolder: Flag to add a subfolder for each document
+        add_subfolder: Write the reports of each document into a subfolder
+        poll_interval: Seconds between checks for changes
+        metrics_file: Also write the metrics to this file in the Prometheus
+            text format after every cycle
+        options: Prompt settings, one command line option per field
+        settings: Client, cache and worker settings, one command line option
+            per field
     """
-    logger.debug(f"Processing file: {filename}")
-
+    stored = run_settings(document_folder, inputs, model, add_subfolder, options)
+    start = time.perf_counter()
+    reset_metrics()
+    reset_usage()
     try:
-        with open(filename, "rb") as file:
-            fileio = BytesIO(file.read())
-
-        if filename.lower().endswith(".docx"):
-            logger.debug(f"Extracting content from DOCX: {filename}")
-            pages = get_content_from_docx(fileio, filename, encodings)
+        if os.path.exists(os.path.join(output_folder, RunManifest.filename)):
+            manifest = RunManifest.load(output_folder)
+            manifest.data.settings = stored
+            manifest.save()
+            logger.info(
+                "Continuing watch", run_dir=output_folder, **summarize(manifest)
+            )
         else:
-            logger.debug(f"Extracting content from PDF: {filename}")
-            pages = get_content_from_pdf(fileio, filename)
-        total_length = (
-            sum(len(encodings.encode(x.text)) for x in pages) if encodings else 0
+            manifest = RunManifest.create(output_folder, stored)
+        encodings = start_run(model, output_folder, options, settings)
+
+        logger.info(
+            "Watching for changes", document_folder=document_folder, inputs=inputs
         )
-        logger.debug(f"Total tokens in document: {total_length}")
-
-        if total_length <= 100:
-            logger.debug(f"Using unstructured extraction for {filename}")
-            unst_pages = get_content_from_unstructured(filename)
-            pages = [
-                PDFDocument(
-                    page=i + 1,
-                    text=unst_page.text,
-                    filename=filename,
+        try:
+            asyncio.run(
+                watch_documents(
+                    document_folder,
+                    inputs,
+                    encodings,
+                    model,
+                    output_folder,
+                    settings.concurrency,
+                    manifest,
+                    options,
+                    add_subfolder,
+                    settings.ingest_workers,
+                    settings.cache_folder if settings.cache else None,
+                    poll_interval,
+                    metrics_file,
+                    start,
                 )
-                for i, unst_page in enumerate(unst_pages)
-            ]
-
-        file_base = os.path.splitext(os.path.basename(filename))[0].replace(" ", "")
-        if add_subfolder:
-            folder = os.path.join(output_folder, file_base)
-        else:
-            folder = output_folder
-        os.makedirs(folder, exist_ok=True)
-
-        for case_name, case_text in tqdm(
-            cases.items(), desc="Processing cases", leave=False
-        ):
-            logger.debug(f"Processing case: {case_name}")
-            total_length = sum(len(encodings.encode(x.text)) for x in pages)  # type: ignore
-
-            responses = (
-                run_full_page(pages, case_text, encodings, model)
-                if total_length < 64000
-                else run_batched_prompts(pages, case_text, encodings, model)
             )
+        except KeyboardInterrupt:
+            logger.info("Stopped watching", run_dir=output_folder)
 
-            output_base = f"{case_name}_{file_base}"
-            output_html = os.path.join(folder, f"{output_base}.html")
-            output_docx = os.path.join(folder, f"{output_base}.docx")
-
-            generate_insights_report(
-                responses=responses,
-                filename=filename,
-                case=case_text,
-                model=model,
-                output_path=output_html,
-            )
-            generate_word_report(
-                responses=responses,
-                filename=filename,
-                case=case_text,
-                model=model,
-                output_path=output_docx,
-            )
+        close_quote_clusters(output_folder)
+        log_usage()
+        write_run_summary(run_summary(time.perf_counter() - start), output_folder)
 
     except Exception as e:
-        logger.exception(f"Error processing document {filename}", error=str(e))
+        logger.exception("Error in watch", error=str(e))
+        raise typer.Exit(code=1)
 
 
 @app.command()
-def run_analysis(
+def submit_batch(
     document_folder: str = "documents",
     output_folder: str = "output",
     inputs: str = "inputs/cases.json",
     model: str = "gpt-4o-mini",
     add_timestamp: bool = True,
     add_subfolder: bool = False,
+    cache: bool = True,
+    cache_folder: str = ".whiteanalysis_cache",
+    prompt_batch_size: int = 64000,
+    split_pages: bool = False,
+    prompt_layout: PromptLayoutOption = "draft_first",
+    backend: str = "openai",
+    batch_folder: str = ".whiteanalysis_batches",
 ) -> None:
-    """Run analysis on a folder of documents.
+    """Submit the prompts of all documents and cases as a single batch job.
+
+    The run folder is set up as for `run-analysis`; fetch the results and
+    write the reports with `collect-batch`. Batch jobs are cheaper than
+    individual calls but may take up to 24 hours.
 
     Args:
         document_folder: Folder containing PDF documents
         output_folder: Folder for output files
         inputs: JSON file containing cases
         model: Model identifier to use
+        add_timestamp: Put the run into a timestamped subfolder
+        add_subfolder: Flag to add a subfolder for each document
+        cache: Reuse extracted documents
+        cache_folder: Folder for the persistent caches
+        prompt_batch_size: Token budget for the pages of one prompt
+        split_pages: Split single pages above the budget
+        prompt_layout: "draft_first" or "source_first"
+        backend: "openai" for the Batch API, "local" for the offline stand-in
+        batch_folder: Folder of the local stand-in backend
     """
+    options = AnalysisOptions(
+        prompt_batch_size=prompt_batch_size,
+        split_pages=split_pages,
+        prompt_layout=prompt_layout,
+    )
     try:
-        filenames = [
-            os.path.join(document_folder, x)
-            for x in os.listdir(document_folder)
-            if x.lower().endswith(".pdf") or x.lower().endswith(".docx")
-        ]
+        filenames = find_documents(document_folder)
+        cases = read_cases(inputs)
+        if add_timestamp:
+            output_folder = os.path.join(output_folder, time.strftime("%y%m%d%M"))
+        manifest = RunManifest.create(
+            output_folder,
+            {
+                "document_folder": document_folder,
+                "inputs": inputs,
+                "model": model,
+                "add_subfolder": add_subfolder,
+                "options": options.model_dump(),
+            },
+        )
+        encodings = load_encodings(model)
+        if cache:
+            open_document_cache(cache_folder)
+
+        job = BatchJob(
+            backend=backend,
+            backend_folder=batch_folder if backend == "local" else None,
+            model=model,
+            cases=cases,
+        )
+        path = os.path.join(output_folder, "batch_input.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for filename in tqdm(filenames, desc="Preparing batch", unit="file"):
+                try:
+                    pages = load_document(filename, encodings)
+                except Exception as e:
+                    logger.exception(f"Error loading document {filename}", error=str(e))
+                    manifest.record_document_failure(filename, e)
+                    continue
+                for case_name, case_text in cases.items():
+                    prompts = case_prompts(pages, case_text, encodings, options)
+                    for i, prompt in enumerate(prompts):
+                        custom_id = f"request-{len(job.requests)}"
+                        job.requests[custom_id] = BatchRequest(
+                            filename=filename,
+                            case_name=case_name,
+                            batch=i,
+                            prompt_key=response_cache_key(model, Insights, prompt),
+                        )
+                        request = {
+                            "custom_id": custom_id,
+                            "method": "POST",
+                            "url": "/v1/chat/completions",
+                            "body": request_body(prompt, model),
+                        }
+                        f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+        job.batch_id = get_backend(backend, batch_folder).submit(path)
+        job.save(output_folder)
+        logger.info(
+            "Batch submitted",
+            run_dir=output_folder,
+            batch_id=job.batch_id,
+            requests=len(job.requests),
+        )
+
+    except Exception as e:
+        logger.exception("Error in submit_batch", error=str(e))
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def collect_batch(
+    run_dir: str,
+    wait: bool = True,
+    poll_interval: float = 60.0,
+    cache: bool = True,
+    cache_folder: str = ".whiteanalysis_cache",
+    store: bool = True,
+    metrics_file: Optional[str] = None,
+) -> None:
+    """Fetch the results of a submitted batch job and write the reports.
+
+    Responses are validated into `Insights` and stored in the run's manifest,
+    so failed or missing requests can be rerun with `run-analysis --resume`.
+    Unless the run was submitted with `verify_quotes` off, each document is
+    extracted again (from the document cache, if enabled) to verify the quotes.
+
+    Args:
+        run_dir: Run folder created by `submit-batch`
+        wait: Poll until the batch is finished instead of checking once
+        poll_interval: Seconds between polls
+        cache: Also store the responses in the response cache and reuse
+            extracted documents
+        cache_folder: Folder for the persistent caches
+        store: Also save the insights to the insight store in `cache_folder`
+        metrics_file: Also write the run metrics to this file in the
+            Prometheus text format
+    """
+    start = time.perf_counter()
+    reset_metrics()
+    reset_usage()
+    try:
+        manifest = RunManifest.load(run_dir)
+        job = BatchJob.load(run_dir)
+        backend = get_backend(job.backend, job.backend_folder)
+        status = (
+            wait_for_batch(backend, job.batch_id, poll_interval)
+            if wait
+            else backend.status(job.batch_id)
+        )
+        if status not in FINAL_STATUSES:
+            logger.info("Batch not finished yet", batch_id=job.batch_id, status=status)
+            return
+        if status == "failed":
+            raise RuntimeError(f"Batch {job.batch_id} failed")
+        if cache:
+            open_response_cache(cache_folder)
+            open_document_cache(cache_folder)
+        if store:
+            open_insight_store(cache_folder)
+        response_cache = get_response_cache()
+
+        path = os.path.join(run_dir, "batch_output.jsonl")
+        backend.download(job.batch_id, path)
+        with manifest.deferred_saves(), open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                request = job.requests.get(row.get("custom_id"))
+                if request is None:
+                    continue
+                checkpoint = manifest.checkpoint(request.filename, request.case_name)
+                try:
+                    response, usage = parse_result(row)
+                except ValueError as e:
+                    logger.error(
+                        "Batch request failed", **request.model_dump(), error=str(e)
+                    )
+                    checkpoint.fail(request.batch, request.prompt_key, e)
+                    continue
+                record_usage(usage_label(job.model, BATCH_TIER), usage)
+                checkpoint.save(request.batch, request.prompt_key, response)
+                if response_cache is not None:
+                    response_cache.put(request.prompt_key, job.model, response)
+
+        add_subfolder = bool(manifest.data.settings.get("add_subfolder"))
+        options = AnalysisOptions.model_validate(
+            manifest.data.settings.get("options", {})
+        )
+        if options.dedupe_quotes:
+            open_quote_clusters(run_dir)
+        write_stylesheet(run_dir)
+        encodings = load_encodings(job.model)
+        units: Dict[str, Dict[str, List[BatchRequest]]] = {}
+        for request in job.requests.values():
+            cases = units.setdefault(request.filename, {})
+            cases.setdefault(request.case_name, []).append(request)
+        with manifest.deferred_saves():
+            for filename, cases in units.items():
+                quote_index = None
+                if options.verify_quotes:
+                    try:
+                        quote_index = QuoteIndex(load_document(filename, encodings))
+                    except Exception as e:
+                        logger.warning(
+                            "Quotes not verified, document could not be loaded",
+                            filename=filename,
+                            error=str(e),
+                        )
+                for case_name, requests in cases.items():
+                    checkpoint = manifest.checkpoint(filename, case_name)
+                    responses = [
+                        checkpoint.load(x.batch, x.prompt_key)
+                        for x in sorted(requests, key=lambda x: x.batch)
+                    ]
+                    write_case_reports(
+                        [x for x in responses if x is not None],
+                        filename,
+                        case_name,
+                        job.cases[case_name],
+                        job.model,
+                        report_folder(run_dir, filename, add_subfolder),
+                        manifest,
+                        complete=all(x is not None for x in responses),
+                        quote_index=quote_index,
+                    )
+                manifest.record_document(filename)
+
+        close_quote_clusters(run_dir)
+        log_usage()
+        summary = run_summary(time.perf_counter() - start)
+        write_run_summary(summary, run_dir)
+        if metrics_file:
+            write_prometheus(summary, metrics_file)
+        logger.info(
+            "Batch collected", run_dir=run_dir, status=status, **summarize(manifest)
+        )
+
+    except Exception as e:
+        logger.exception("Error in collect_batch", error=str(e))
+        raise typer.Exit(code=1)
+
+
+async def search_corpus(
+    index: CorpusIndex,
+    filenames: List[str],
+    query: str,
+    top_k: int,
+    encodings: tiktoken.Encoding,
+    ingest_workers: int = 0,
+    cache_folder: Optional[str] = None,
+) -> tuple[List[SearchHit], DocumentLoader]:
+    """Updates the corpus index and ranks its pages against `query`.
+
+    Returns:
+        The hits, best first, and the loader for fetching their pages; the
+        caller closes the loader
+    """
+    loader = DocumentLoader(encodings, ingest_workers, cache_folder)
+    try:
+        await update_index(index, filenames, loader, encodings)
+        vector = await embed_texts([query], index.data.embedder, encodings)
+    except BaseException:
+        loader.close()
+        raise
+    return index.search(vector[0], top_k), loader
+
+
+async def hit_pages(
+    hits: List[SearchHit],
+    loader: DocumentLoader,
+    encodings: tiktoken.Encoding,
+    max_tokens: int,
+) -> Dict[str, tuple[List[PDFDocument], List[PDFDocument]]]:
+    """The pages of the best hits that fit into `max_tokens`, by document.
+
+    Returns:
+        For each document with a selected page: all of its pages, and the
+        selected pages in page order
+    """
+    documents = {
+        x: await loader.load(x) for x in dict.fromkeys(hit.filename for hit in hits)
+    }
+    by_page = {
+        filename: {page.page: page for page in pages}
+        for filename, pages in documents.items()
+    }
+    selected: Dict[str, List[PDFDocument]] = {}
+    total = 0
+    for hit in hits:
+        page = by_page[hit.filename].get(hit.page)
+        if page is None:
+            continue
+        tokens = page.token_count(encodings)
+        if selected and total + tokens > max_tokens:
+            break
+        selected.setdefault(hit.filename, []).append(page)
+        total += tokens
+    return {
+        filename: (documents[filename], sorted(pages, key=lambda x: x.page))
+        for filename, pages in selected.items()
+    }
+
+
+@app.command()
+def search(
+    query: str,
+    document_folder: str = "documents",
+    inputs: Optional[str] = None,
+    top_k: Annotated[int, typer.Option(min=1)] = 10,
+    embedding_model: str = "text-embedding-3-small",
+    cache_folder: str = ".whiteanalysis_cache",
+    ingest_workers: int = DEFAULT_INGEST_WORKERS,
+    analyze: bool = False,
+    model: str = "gpt-4o-mini",
+    output_folder: str = "output",
+    prompt_batch_size: int = 64000,
+    prompt_layout: PromptLayoutOption = "draft_first",
+) -> None:
+    """Rank the pages of all documents against a query.
+
+    The page embeddings of the corpus are kept in an index under
+    `cache_folder`, which is updated with new and changed documents on every
+    search. With `--analyze`, the best pages are analyzed against the query
+    in one call per document, and the reports are written to a new run folder.
+
+    Args:
+        query: Text to search for, or the name of a case in `inputs`
+        document_folder: Folder containing the documents
+        inputs: JSON file containing cases
+        top_k: Number of pages to return
+        embedding_model: OpenAI embedding model, or "local" for an offline
+            bag-of-words embedding
+        cache_folder: Folder for the index and the persistent caches
+        ingest_workers: Number of processes extracting new documents
+        analyze: Analyze the best pages against the query
+        model: Model identifier used for the analysis
+        output_folder: Folder for the run folder of the analysis
+        prompt_batch_size: Token budget for the pages of the analysis call
+        prompt_layout: Prompt layout of the analysis call
+    """
+    try:
+        cases = read_cases(inputs) if inputs else {}
+        case_name = query if query in cases else "search"
+        case_text = cases.get(query, query)
+        filenames = find_documents(document_folder)
+        encodings = load_encodings(model)
+        open_document_cache(cache_folder)
+        open_embedding_cache(cache_folder)
+        open_insight_store(cache_folder)
+        index = CorpusIndex(
+            CorpusIndex.folder_for(cache_folder, embedding_model), embedding_model
+        )
+        options = AnalysisOptions(
+            prompt_batch_size=prompt_batch_size, prompt_layout=prompt_layout
+        )
 
-        with open(inputs, "r", encoding="utf-8") as f:
+        async def run() -> None:
+            hits, loader = await search_corpus(
+                index,
+                filenames,
+                case_text,
+                top_k,
+                encodings,
+                min(ingest_workers, len(filenames)),
+                cache_folder,
+            )
             try:
-                cleaned = clean_json_string(f.read())
-                cases = json.loads(cleaned)
-            except Exception:
-                cases = py_cases
+                for hit in hits:
+                    typer.echo(
+                        f"{hit.score:.3f}  {os.path.basename(hit.filename)}"
+                        f"  page {hit.page + 1}"
+                    )
+                if not analyze or not hits:
+                    return
+                pages = await hit_pages(hits, loader, encodings, prompt_batch_size)
+            finally:
+                loader.close()
 
-        if add_timestamp:
-            output_folder = os.path.join(output_folder, time.strftime("%y%m%d%M"))
+            folder = os.path.join(output_folder, time.strftime("%y%m%d%M"))
+            manifest = RunManifest.create(
+                folder,
+                {
+                    "document_folder": document_folder,
+                    "query": case_text,
+                    "model": model,
+                    "add_subfolder": False,
+                    "options": options.model_dump(),
+                },
+            )
+            write_stylesheet(folder)
+            open_quote_clusters(folder)
+            semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
 
-        try:
-            encodings = tiktoken.encoding_for_model(model)
-        except Exception as e:
-            logger.exception("Error loading tokenizer", model=model, error=str(e))
-            encodings = None
-
-        with tqdm(filenames, desc="Processing files", unit="file", leave=True) as pbar:
-            for filename in pbar:
-                process_document(
-                    filename, cases, encodings, model, output_folder, add_subfolder
+            async def analyze_document(
+                filename: str,
+                document: List[PDFDocument],
+                selected: List[PDFDocument],
+            ) -> None:
+                checkpoint = manifest.checkpoint(filename, case_name)
+                responses = await run_full_page(
+                    selected,
+                    case_text,
+                    encodings,
+                    model,
+                    semaphore,
+                    checkpoint,
+                    options,
                 )
+                write_case_reports(
+                    responses,
+                    filename,
+                    case_name,
+                    case_text,
+                    model,
+                    folder,
+                    manifest,
+                    complete=not checkpoint.failed,
+                    quote_index=QuoteIndex(document),
+                )
+                manifest.record_document(filename)
+
+            try:
+                await asyncio.gather(
+                    *(
+                        analyze_document(filename, document, selected)
+                        for filename, (document, selected) in pages.items()
+                    )
+                )
+            finally:
+                await close_async_client()
+                close_quote_clusters(folder)
+                manifest.flush()
+            log_usage()
+            logger.info(
+                "Search analysis complete",
+                run_dir=folder,
+                documents=len(pages),
+                pages=sum(len(x) for _, x in pages.values()),
+            )
 
-        logger.info("Analysis complete")
+        asyncio.run(run())
 
     except Exception as e:
-        logger.exception("Error in run_analysis", error=str(e))
+        logger.exception("Error in search", error=str(e))
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def query(
+    text: Optional[str] = typer.Argument(None),
+    case: Optional[str] = None,
+    document: Optional[str] = None,
+    run_dir: Optional[str] = None,
+    limit: int = 20,
+    dedupe: bool = True,
+    cache_folder: str = ".whiteanalysis_cache",
+) -> None:
+    """Search the quotes of all runs in the insight store.
+
+    Args:
+        text: Full-text query (SQLite FTS5 syntax, e.g. "identity AND control");
+            without it, all quotes matching the filters are listed
+        case: Only quotes of this case
+        document: Only quotes of documents whose path contains this text
+        run_dir: Only quotes of this run folder
+        limit: Maximum number of quotes
+        dedupe: Show each quote once, with the number of duplicates
+        cache_folder: Folder holding the insight store
+    """
+    try:
+        store = open_insight_store(cache_folder)
+        hits = store.search(text, case, document, run_dir, limit, dedupe)
+    except sqlite3.OperationalError as e:
+        logger.error("Invalid query", query=text, error=str(e))
+        raise typer.Exit(code=1)
+    for hit in hits:
+        duplicates = f" (+{hit.duplicates} duplicates)" if hit.duplicates else ""
+        typer.echo(
+            f"[{hit.case_name}] {os.path.basename(hit.document)}, "
+            f"{hit.quote.position} (batch {hit.batch}, {hit.model}){duplicates}"
+        )
+        typer.echo(f"    {hit.quote.text}")
+        typer.echo(f"    -> {hit.quote.issue_in_draft}\n")
+    logger.info("Query complete", quotes=len(hits))
+
+
+@app.command()
+def rebuild_reports(
+    run_dir: str,
+    cache_folder: str = ".whiteanalysis_cache",
+) -> None:
+    """Write the reports of a run again from the insight store, without API calls.
+
+    Args:
+        run_dir: Run folder whose reports are rebuilt
+        cache_folder: Folder holding the insight store
+    """
+    try:
+        store = open_insight_store(cache_folder)
+        manifest = RunManifest.load(run_dir)
+        add_subfolder = bool(manifest.data.settings.get("add_subfolder"))
+        options = AnalysisOptions.model_validate(
+            manifest.data.settings.get("options", {})
+        )
+        if options.dedupe_quotes:
+            open_quote_clusters(run_dir)
+        write_stylesheet(run_dir)
+        cases = store.cases(run_dir)
+        with manifest.deferred_saves():
+            for filename, case_name, case_text, complete in cases:
+                model, responses = store.insights(run_dir, filename, case_name)
+                write_case_reports(
+                    responses,
+                    filename,
+                    case_name,
+                    case_text,
+                    model or str(manifest.data.settings.get("model", "")),
+                    report_folder(run_dir, filename, add_subfolder),
+                    manifest,
+                    complete,
+                )
+        close_quote_clusters(run_dir)
+        logger.info("Rebuilt reports", run_dir=run_dir, cases=len(cases))
+
+    except Exception as e:
+        logger.exception("Error in rebuild_reports", error=str(e))
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def benchmark(
+    document_folder: str = "Materials",
+    inputs: str = "inputs/cases.json",
+    model: str = "gpt-4o-mini",
+    output_folder: Optional[str] = None,
+    report: Optional[str] = None,
+    latency: float = 0.5,
+    jitter: float = 0.1,
+    error_rate: float = 0.0,
+    mock_requests_per_minute: Optional[int] = None,
+    mock_tokens_per_minute: Optional[int] = None,
+    concurrency: int = 8,
+    prompt_batch_size: int = 64000,
+    split_pages: bool = False,
+    stream_pages: bool = False,
+    multi_case: int = 0,
+    ingest_workers: int = DEFAULT_INGEST_WORKERS,
+    cache: bool = False,
+) -> None:
+    """Run the analysis against a local mock API and report its throughput.
+
+    The mock server answers like the OpenAI API after `latency` seconds, fails
+    a share of `error_rate` calls and enforces the given per-minute limits.
+    The report covers documents/min, calls/min, tokens/sec, peak RSS and the
+    time spent in each stage. Only documents whose cases all finished count
+    as analyzed; the others are reported as failed, and the command fails if
+    no document was analyzed.
+
+    Args:
+        document_folder: Folder containing the benchmark documents
+        inputs: JSON file containing cases
+        model: Model name sent to the mock server
+        output_folder: Folder for the reports (default: a temporary folder)
+        report: Write the benchmark report as JSON to this file
+        latency: Seconds the mock server takes per response
+        jitter: Extra random latency of up to this many seconds
+        error_rate: Share of calls failing with a server error
+        mock_requests_per_minute: Request limit of the mock server
+        mock_tokens_per_minute: Token limit of the mock server
+        concurrency: Maximum number of concurrent API calls
+        prompt_batch_size: Token budget for the pages of one prompt
+        split_pages: Split single pages above the budget
+        stream_pages: Extract and analyze documents page by page
+        multi_case: Analyze up to this many cases in a single call
+        ingest_workers: Number of processes extracting documents
+        cache: Use the response and document caches (off to measure all stages)
+    """
+    settings = MockSettings(
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        requests_per_minute=mock_requests_per_minute,
+        tokens_per_minute=mock_tokens_per_minute,
+    )
+    with tempfile.TemporaryDirectory() as tmp, MockServer(settings) as server:
+        use_mock_server(server)
+        start = time.perf_counter()
+        manifest = run_analysis(
+            document_folder=document_folder,
+            output_folder=output_folder or tmp,
+            inputs=inputs,
+            model=model,
+            add_timestamp=output_folder is not None,
+            options=AnalysisOptions(
+                prompt_batch_size=prompt_batch_size,
+                split_pages=split_pages,
+                stream_pages=stream_pages,
+                multi_case=multi_case,
+            ),
+            settings=RunSettings(
+                concurrency=concurrency,
+                requests_per_minute=mock_requests_per_minute or 1_000_000,
+                tokens_per_minute=mock_tokens_per_minute or 1_000_000_000,
+                cache=cache,
+                store=False,
+                ingest_workers=ingest_workers,
+            ),
+        )
+        counts = document_counts(manifest)
+        result = benchmark_report(
+            counts["done"],
+            counts["failed"],
+            time.perf_counter() - start,
+            server.stats,
+            get_usage(),
+            get_stages(),
+        )
+
+    logger.info(
+        "Benchmark complete",
+        **result.model_dump(exclude={"server", "usage", "stages"}),
+    )
+    for name, stats in result.stages.items():
+        logger.info("Stage time", stage=name, **stats.model_dump())
+    if report:
+        with open(report, "w", encoding="utf-8") as f:
+            f.write(result.model_dump_json(indent=2))
+    if not result.documents:
+        logger.error("No document was analyzed", failed=result.failed)
         raise typer.Exit(code=1)
 
 
@@ -0,0 +1,310 @@
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Literal, Optional
+
+import structlog
+from pydantic import BaseModel, Field, ValidationError
+
+from whiteanalysis.prompts import Insights
+from whiteanalysis.store import get_insight_store
+
+logger = structlog.get_logger()
+
+Status = Literal["done", "failed"]
+
+# Seconds between writes of the manifest for batch-level updates
+SAVE_INTERVAL = 5.0
+
+
+class BatchRecord(BaseModel):
+    status: Status
+    prompt_key: str
+    output: Optional[str] = None
+    error: Optional[str] = None
+    updated: float = Field(default_factory=time.time)
+
+
+class CaseRecord(BaseModel):
+    status: Optional[Status] = None
+    case_hash: Optional[str] = None
+    outputs: List[str] = []
+    error: Optional[str] = None
+    batches: Dict[str, BatchRecord] = {}
+    updated: float = Field(default_factory=time.time)
+
+
+class DocumentRecord(BaseModel):
+    status: Optional[Status] = None
+    digest: Optional[str] = None
+    error: Optional[str] = None
+    cases: Dict[str, CaseRecord] = {}
+
+
+class StoredResponse(BaseModel):
+    """A batch response under `responses/`, with the prompt key it answers."""
+
+    prompt_key: str
+    response: Insights
+
+
+class ManifestData(BaseModel):
+    settings: Dict[str, object] = {}
+    documents: Dict[str, DocumentRecord] = {}
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    """Record of the finished and failed units of a run, kept in `manifest.json`.
+
+    Units are documents, (document, case) pairs and (document, case, batch)
+    triples. Batch responses are stored next to the manifest so that a resumed
+    run only calls the API for batches that failed or never ran. Paths in the
+    manifest are relative to the run folder. Cases and batch responses are
+    also copied to the insight store, if one is open.
+
+    Document and case updates write the manifest right away. Batch updates,
+    of which a run has many, only mark it as changed; it is then written at
+    most every `SAVE_INTERVAL` seconds, at the next document or case update,
+    or by `flush` when the run ends or fails.
+    """
+
+    filename = "manifest.json"
+
+    def __init__(self, run_dir: str, data: Optional[ManifestData] = None):
+        self.run_dir = run_dir
+        self.path = os.path.join(run_dir, self.filename)
+        self.data = data or ManifestData()
+        self._deferred = False
+        self._dirty = False
+        self._saved = 0.0
+
+    @classmethod
+    def create(cls, run_dir: str, settings: Dict[str, object]) -> "RunManifest":
+        """Starts a new manifest in `run_dir`, replacing any existing one."""
+        manifest = cls(run_dir, ManifestData(settings=settings))
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, run_dir: str) -> "RunManifest":
+        """Loads the manifest of an earlier run."""
+        path = os.path.join(run_dir, cls.filename)
+        with open(path, "r", encoding="utf-8") as f:
+            data = ManifestData.model_validate_json(f.read())
+        return cls(run_dir, data)
+
+    def save(self) -> None:
+        if self._deferred:
+            self._dirty = True
+            return
+        os.makedirs(self.run_dir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.data.model_dump_json(indent=2))
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._saved = time.monotonic()
+
+    def touch(self) -> None:
+        """Marks the manifest as changed, writing it if the last write is old."""
+        self._dirty = True
+        if time.monotonic() - self._saved >= SAVE_INTERVAL:
+            self.save()
+
+    def flush(self) -> None:
+        """Writes pending changes, e.g. when a run ends or fails."""
+        if self._dirty:
+            self.save()
+
+    @contextmanager
+    def deferred_saves(self) -> Iterator[None]:
+        """Writes the manifest once at the end instead of after every update."""
+        self._deferred = True
+        try:
+            yield
+        finally:
+            self._deferred = False
+            self.save()
+
+    def _document(self, filename: str) -> DocumentRecord:
+        return self.data.documents.setdefault(filename, DocumentRecord())
+
+    def _case(self, filename: str, case_name: str) -> CaseRecord:
+        return self._document(filename).cases.setdefault(case_name, CaseRecord())
+
+    def _exists(self, path: str) -> bool:
+        return os.path.exists(os.path.join(self.run_dir, path))
+
+    def case_done(self, filename: str, case_name: str, case_text: str) -> bool:
+        """Whether the reports of a case are complete and up to date."""
+        record = self.data.documents.get(filename, DocumentRecord()).cases.get(
+            case_name
+        )
+        return (
+            record is not None
+            and record.status == "done"
+            and record.case_hash == hash_text(case_text)
+            and all(self._exists(x) for x in record.outputs)
+        )
+
+    def document_done(self, filename: str, cases: Dict[str, str]) -> bool:
+        return all(self.case_done(filename, k, v) for k, v in cases.items())
+
+    def update_digest(self, filename: str, digest: str) -> bool:
+        """Records the content hash of a document.
+
+        Returns:
+            Whether the document changed since its hash was last recorded, in
+            which case all its cases are marked for analysis again
+        """
+        record = self._document(filename)
+        changed = record.digest is not None and record.digest != digest
+        if changed:
+            record.status = None
+            record.cases = {}
+        record.digest = digest
+        self.save()
+        return changed
+
+    def record_document_failure(self, filename: str, error: Exception) -> None:
+        record = self._document(filename)
+        record.status = "failed"
+        record.error = str(error)
+        self.save()
+
+    def record_document(self, filename: str) -> None:
+        record = self._document(filename)
+        record.status = "done"
+        record.error = None
+        self.save()
+
+    def record_case(
+        self,
+        filename: str,
+        case_name: str,
+        case_text: str,
+        outputs: List[str],
+        complete: bool,
+    ) -> None:
+        """Records the reports of a case; incomplete cases are retried on resume."""
+        record = self._case(filename, case_name)
+        record.status = "done" if complete else "failed"
+        record.case_hash = hash_text(case_text)
+        record.outputs = [os.path.relpath(x, self.run_dir) for x in outputs]
+        record.error = None if complete else "Some batches failed"
+        record.updated = time.time()
+        self.save()
+        store = get_insight_store()
+        if store is not None:
+            store.put_case(self.run_dir, filename, case_name, case_text, complete)
+
+    def checkpoint(self, filename: str, case_name: str) -> "CaseCheckpoint":
+        return CaseCheckpoint(self, filename, case_name)
+
+
+class CaseCheckpoint:
+    """Batch-level view of the manifest for one (document, case) pair."""
+
+    def __init__(self, manifest: RunManifest, filename: str, case_name: str):
+        self.manifest = manifest
+        self.filename = filename
+        self.case_name = case_name
+        self.failed: set[int] = set()
+
+    def _response_path(self, batch: int) -> str:
+        # Documents with the same stem (e.g. a PDF and a DOCX) or base name
+        # in different folders get separate folders
+        file_base = os.path.splitext(os.path.basename(self.filename))[0]
+        folder = f"{file_base.replace(' ', '')}-{hash_text(self.filename)[:8]}"
+        return os.path.join("responses", folder, f"{self.case_name}_{batch}.json")
+
+    def load(self, batch: int, prompt_key: str) -> Optional[Insights]:
+        """Returns the stored response of a finished batch with the same prompt.
+
+        Both the manifest record and the stored file must carry `prompt_key`.
+        """
+        record = (
+            self.manifest.data.documents.get(self.filename, DocumentRecord())
+            .cases.get(self.case_name, CaseRecord())
+            .batches.get(str(batch))
+        )
+        if (
+            record is None
+            or record.status != "done"
+            or record.prompt_key != prompt_key
+            or record.output is None
+        ):
+            return None
+        try:
+            path = os.path.join(self.manifest.run_dir, record.output)
+            with open(path, "r", encoding="utf-8") as f:
+                stored = StoredResponse.model_validate_json(f.read())
+        except (OSError, ValidationError) as e:
+            logger.debug("Could not load stored batch response", error=str(e))
+            return None
+        if stored.prompt_key != prompt_key:
+            logger.debug("Stored batch response is for another prompt", path=path)
+            return None
+        stored.response.batch = batch
+        return stored.response
+
+    def save(self, batch: int, prompt_key: str, response: Insights) -> None:
+        response.batch = batch
+        output = self._response_path(batch)
+        path = os.path.join(self.manifest.run_dir, output)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(
+                StoredResponse(
+                    prompt_key=prompt_key, response=response
+                ).model_dump_json()
+            )
+        self.manifest._case(self.filename, self.case_name).batches[str(batch)] = (
+            BatchRecord(status="done", prompt_key=prompt_key, output=output)
+        )
+        self.manifest.touch()
+        store = get_insight_store()
+        if store is not None:
+            store.put_insights(
+                self.manifest.run_dir,
+                str(self.manifest.data.settings.get("model", "")),
+                self.filename,
+                self.case_name,
+                batch,
+                response,
+            )
+
+    def fail(self, batch: int, prompt_key: str, error: BaseException) -> None:
+        self.failed.add(batch)
+        self.manifest._case(self.filename, self.case_name).batches[str(batch)] = (
+            BatchRecord(status="failed", prompt_key=prompt_key, error=str(error))
+        )
+        self.manifest.touch()
+
+
+def summarize(manifest: RunManifest) -> Dict[str, int]:
+    """Counts of finished and failed (document, case) units."""
+    counts = {"done": 0, "failed": 0}
+    for document in manifest.data.documents.values():
+        if document.status == "failed":
+            counts["failed"] += 1
+        for case in document.cases.values():
+            if case.status:
+                counts[case.status] += 1
+    return counts
+
+
+def document_counts(manifest: RunManifest) -> Dict[str, int]:
+    """Counts of documents whose cases all finished, and of the other documents."""
+    counts = {"done": 0, "failed": 0}
+    for document in manifest.data.documents.values():
+        done = document.status == "done" and all(
+            x.status == "done" for x in document.cases.values()
+        )
+        counts["done" if done else "failed"] += 1
+    return counts
@@ -0,0 +1,232 @@
+import os
+import re
+import threading
+from typing import ClassVar, Dict, List, Optional
+
+import structlog
+from pydantic import BaseModel
+
+from whiteanalysis.profiling import drain_samples, merge_samples
+from whiteanalysis.timing import StageStats, get_stages, merge_stages, reset_stages
+from whiteanalysis.usage import UsageStats, get_usage
+
+logger = structlog.get_logger()
+
+
+class ExtractionStats(BaseModel):
+    """Extraction time and page count of one document."""
+
+    extractor: str
+    seconds: float
+    pages: int
+
+
+_counters: Dict[str, int] = {}
+_extractions: Dict[str, ExtractionStats] = {}
+_lock = threading.Lock()
+
+
+def increment(name: str, amount: int = 1) -> None:
+    """Adds `amount` to the counter `name`, e.g. cache hits or retries."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def record_extraction(
+    filename: str, extractor: str, seconds: float, pages: int
+) -> None:
+    """Records how long a document took to extract, and with which extractor."""
+    with _lock:
+        _extractions[filename] = ExtractionStats(
+            extractor=extractor, seconds=seconds, pages=pages
+        )
+
+
+def get_counters() -> Dict[str, int]:
+    with _lock:
+        return dict(_counters)
+
+
+def get_extractions() -> Dict[str, ExtractionStats]:
+    with _lock:
+        return {k: v.model_copy() for k, v in _extractions.items()}
+
+
+def reset_metrics() -> None:
+    """Clears counters, extractions and stage times, e.g. before a run."""
+    with _lock:
+        _counters.clear()
+        _extractions.clear()
+    reset_stages()
+    drain_samples()
+
+
+class MetricsSnapshot(BaseModel):
+    """Metrics collected in a worker process, to be merged into the parent."""
+
+    stages: Dict[str, StageStats] = {}
+    counters: Dict[str, int] = {}
+    extractions: Dict[str, ExtractionStats] = {}
+    samples: Dict[str, Dict[str, int]] = {}
+
+
+def drain() -> MetricsSnapshot:
+    """Returns and clears the metrics of this (worker) process."""
+    with _lock:
+        snapshot = MetricsSnapshot(
+            stages=get_stages(),
+            counters=dict(_counters),
+            extractions=dict(_extractions),
+            samples=drain_samples(),
+        )
+        _counters.clear()
+        _extractions.clear()
+    reset_stages()
+    return snapshot
+
+
+def merge(snapshot: MetricsSnapshot) -> None:
+    """Adds the metrics drained in a worker process."""
+    merge_stages(snapshot.stages)
+    merge_samples(snapshot.samples)
+    with _lock:
+        for name, amount in snapshot.counters.items():
+            _counters[name] = _counters.get(name, 0) + amount
+        _extractions.update(snapshot.extractions)
+
+
+class ModelUsage(UsageStats):
+    """Usage of a model with its cache hit rate and estimated cost."""
+
+    prompt_cache_hit_rate: float = 0.0
+    cost_usd: Optional[float] = None
+
+
+class RunSummary(BaseModel):
+    """Everything measured during a run, written as `run_summary.json`."""
+
+    filename: ClassVar[str] = "run_summary.json"
+
+    seconds: float
+    stages: Dict[str, StageStats]
+    counters: Dict[str, int]
+    extractions: Dict[str, ExtractionStats]
+    usage: Dict[str, ModelUsage]
+    cost_usd: float
+    profiles: List[str] = []
+
+
+def run_summary(seconds: float, profiles: Optional[List[str]] = None) -> RunSummary:
+    usage = {
+        model: ModelUsage(
+            **stats.model_dump(),
+            prompt_cache_hit_rate=round(stats.cache_hit_rate, 4),
+            cost_usd=stats.cost(model),
+        )
+        for model, stats in get_usage().items()
+    }
+    return RunSummary(
+        seconds=round(seconds, 3),
+        stages=get_stages(),
+        counters=get_counters(),
+        extractions=get_extractions(),
+        usage=usage,
+        cost_usd=sum(x.cost_usd or 0.0 for x in usage.values()),
+        profiles=profiles or [],
+    )
+
+
+def write_run_summary(summary: RunSummary, folder: str) -> str:
+    """Writes the summary to `folder/run_summary.json` and returns the path."""
+    path = os.path.join(folder, summary.filename)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(summary.model_dump_json(indent=2))
+    logger.info("Wrote run summary", path=path, cost_usd=round(summary.cost_usd, 4))
+    return path
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _name(value: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", value)
+
+
+def prometheus_text(summary: RunSummary) -> str:
+    """Formats a run summary in the Prometheus text exposition format.
+
+    The result can be written where the node exporter's textfile collector
+    picks it up, or pushed to a Pushgateway.
+    """
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, description: str, samples: List) -> None:
+        lines.append(f"# HELP whiteanalysis_{name} {description}")
+        lines.append(f"# TYPE whiteanalysis_{name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            label_text = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"whiteanalysis_{name}{label_text} {value}")
+
+    metric("run_seconds", "gauge", "Wall time of the run", [({}, summary.seconds)])
+    stages = summary.stages.items()
+    metric(
+        "stage_seconds_total",
+        "counter",
+        "Summed time spent in each stage",
+        [({"stage": k}, v.seconds) for k, v in stages],
+    )
+    metric(
+        "stage_runs_total",
+        "counter",
+        "Number of times each stage ran",
+        [({"stage": k}, v.count) for k, v in stages],
+    )
+    metric(
+        "stage_max_seconds",
+        "gauge",
+        "Longest single run of each stage",
+        [({"stage": k}, v.max_seconds) for k, v in stages],
+    )
+    for name, value in sorted(summary.counters.items()):
+        metric(f"{_name(name)}_total", "counter", name.replace("_", " "), [({}, value)])
+    metric(
+        "extraction_seconds",
+        "gauge",
+        "Extraction time per document",
+        [
+            ({"file": os.path.basename(k), "extractor": v.extractor}, v.seconds)
+            for k, v in summary.extractions.items()
+        ],
+    )
+    usage = summary.usage.items()
+    for field, description in [
+        ("calls", "API calls"),
+        ("prompt_tokens", "Prompt tokens"),
+        ("cached_tokens", "Prompt tokens served from the prompt cache"),
+        ("completion_tokens", "Completion tokens"),
+        ("latency_seconds", "Summed API call latency"),
+    ]:
+        metric(
+            f"api_{field}_total",
+            "counter",
+            description,
+            [({"model": k}, getattr(v, field)) for k, v in usage],
+        )
+    metric(
+        "api_cost_dollars",
+        "gauge",
+        "Estimated API cost",
+        [({"model": k}, v.cost_usd) for k, v in usage if v.cost_usd is not None],
+    )
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(summary: RunSummary, path: str) -> None:
+    """Writes the summary as Prometheus text, replacing the file atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(summary))
+    os.replace(tmp_path, path)
+    logger.info("Wrote metrics", path=path)
@@ -0,0 +1,142 @@
+import os
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from whiteanalysis.prompts import PromptLayout, QuoteSchema
+
+# Default number of extraction processes; each one imports the extractors and
+# the tokenizer, so the default stays small even on machines with many cores
+DEFAULT_INGEST_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class AnalysisOptions(BaseModel):
+    """Settings that determine how documents are turned into prompts.
+
+    They are stored in the run manifest so that a resumed run builds the
+    same prompts. The field descriptions are the help texts of the command
+    line options.
+    """
+
+    prompt_batch_size: int = Field(
+        default=64000,
+        description="Token budget for the pages of one prompt; larger documents "
+        "are split into several prompts",
+    )
+    split_pages: bool = Field(
+        default=False,
+        description="Split single pages above the budget at paragraph or "
+        "sentence boundaries instead of letting them overflow",
+    )
+    stream_pages: bool = Field(
+        default=False,
+        description="Extract and analyze documents page by page so that memory "
+        "stays bounded by the batch size (extraction then runs in-process)",
+    )
+    prompt_layout: PromptLayout = Field(
+        default="draft_first",
+        description='"source_first" puts the draft after the document so that '
+        "all cases share the provider's cached prefix",
+    )
+    multi_case: int = Field(
+        default=0,
+        description="Analyze up to this many cases in a single call per batch "
+        "(0: one call per case)",
+    )
+    retrieval_top_k: int = Field(
+        default=0,
+        description="Only analyze this many pages most similar to each case, "
+        "plus their neighbors (0: all pages)",
+    )
+    retrieval_neighbors: int = Field(
+        default=1, description="Pages kept on either side of each retrieved page"
+    )
+    embedding_model: str = Field(
+        default="text-embedding-3-small",
+        description='OpenAI embedding model for retrieval, or "local" for an '
+        "offline bag-of-words embedding",
+    )
+    screen_model: Optional[str] = Field(
+        default=None,
+        description="Cheap model that first scores each batch for relevance; "
+        "only batches scoring at least --screen-threshold go to the model. "
+        '"embedding" scores by similarity with --embedding-model instead',
+    )
+    screen_threshold: float = Field(
+        default=0.5,
+        description="Minimum relevance score (0-1 for a screening model, cosine "
+        'similarity for "embedding")',
+    )
+    quote_schema: QuoteSchema = Field(
+        default="full",
+        description='"compact" has the model give only the page and first and '
+        "last words of each quote, which are then looked up in the page text",
+    )
+    verify_quotes: bool = Field(
+        default=True,
+        description="Check every quote against the document's text, flag quotes "
+        "that are not found and correct their pages",
+    )
+    dedupe_quotes: bool = Field(
+        default=True,
+        description="Merge near-identical quotes within each report and mark "
+        "quotes already reported for other cases or documents of the run",
+    )
+    page_window: Optional[int] = Field(
+        default=None,
+        description="Analyze every page in its own call, with this many pages "
+        "before and after it as context (default: batches of pages)",
+    )
+
+
+class RunSettings(BaseModel):
+    """Settings of the API clients, caches and extraction workers of a run.
+
+    Unlike `AnalysisOptions`, they do not change the prompts and are not
+    stored in the manifest. The field descriptions are the help texts of the
+    command line options.
+    """
+
+    concurrency: int = Field(
+        default=8, description="Maximum number of concurrent API calls"
+    )
+    requests_per_minute: Optional[int] = Field(
+        default=None,
+        description="Request budget for the model (default: per-model limit)",
+    )
+    tokens_per_minute: Optional[int] = Field(
+        default=None,
+        description="Token budget for the model (default: per-model limit)",
+    )
+    max_connections: Optional[int] = Field(
+        default=None,
+        description="Size of the shared keep-alive connection pool "
+        "(default: --concurrency)",
+    )
+    request_timeout: float = Field(
+        default=600.0, description="Seconds to wait for a single API response"
+    )
+    cache: bool = Field(
+        default=True, description="Reuse stored responses and extracted documents"
+    )
+    cache_folder: str = Field(
+        default=".whiteanalysis_cache", description="Folder for the persistent caches"
+    )
+    cache_max_age_days: Optional[float] = Field(
+        default=None,
+        description="Ignore and evict cached responses older than this",
+    )
+    cache_max_size_mb: Optional[float] = Field(
+        default=1024,
+        description="Evict least recently used responses beyond this size",
+    )
+    store: bool = Field(
+        default=True,
+        description="Also save all insights to the searchable insight store in "
+        "--cache-folder (see `whiteanalysis query`)",
+    )
+    ingest_workers: int = Field(
+        default=DEFAULT_INGEST_WORKERS,
+        description="Number of processes extracting documents in parallel "
+        "(0: extract in a thread of the main process)",
+    )
@@ -0,0 +1,170 @@
+import cProfile
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+# Stages that are currently running synchronously, per thread id
+_active: Dict[int, List[str]] = {}
+
+
+class SamplingProfiler:
+    """Samples the call stacks of all threads that are inside a profiled stage.
+
+    A background thread looks at the stacks every `interval` seconds and counts
+    each one under the innermost stage of its thread, so concurrent stages in
+    different threads are kept apart. The counts are folded stacks
+    ("module:function;module:function"), as used by flame graph tools.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Dict[str, Counter] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, stages in list(_active.items()):
+                frame = frames.get(thread_id)
+                if not stages or frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                    stack.append(f"{module}:{code.co_name}")
+                    frame = frame.f_back
+                folded = ";".join(reversed(stack))
+                self.samples.setdefault(stages[-1], Counter())[folded] += 1
+
+    def drain(self) -> Dict[str, Dict[str, int]]:
+        """Returns and clears the samples collected so far."""
+        samples = self.samples
+        self.samples = {}
+        return {k: dict(v) for k, v in samples.items()}
+
+
+_profiler: Optional[SamplingProfiler] = None
+_samples: Dict[str, Counter] = {}
+
+
+def start_sampling(interval: float = 0.005) -> None:
+    """Starts sampling the profiled stages of this process."""
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval)
+        _profiler.start()
+
+
+def stop_sampling() -> None:
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+        merge_samples(_profiler.drain())
+        _profiler = None
+
+
+def push_stage(name: str) -> None:
+    if _profiler is not None:
+        _active.setdefault(threading.get_ident(), []).append(name)
+
+
+def pop_stage() -> None:
+    if _profiler is not None:
+        stages = _active.get(threading.get_ident())
+        if stages:
+            stages.pop()
+
+
+def drain_samples() -> Dict[str, Dict[str, int]]:
+    """Returns and clears the samples of this process."""
+    if _profiler is not None:
+        merge_samples(_profiler.drain())
+    samples = {k: dict(v) for k, v in _samples.items()}
+    _samples.clear()
+    return samples
+
+
+def merge_samples(samples: Dict[str, Dict[str, int]]) -> None:
+    """Adds samples, e.g. those drained in a worker process."""
+    for name, stacks in samples.items():
+        _samples.setdefault(name, Counter()).update(stacks)
+
+
+def write_samples(folder: str, interval: float = 0.005) -> List[str]:
+    """Writes the samples of each stage as `<stage>.folded` into `folder`.
+
+    Returns:
+        Paths of the written files
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for name, stacks in drain_samples().items():
+        path = os.path.join(folder, f"{name}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(stacks.items(), key=lambda x: -x[1]):
+                f.write(f"{stack} {count}\n")
+        paths.append(path)
+        logger.debug(
+            "Wrote stage profile",
+            stage=name,
+            path=path,
+            sampled_seconds=round(sum(stacks.values()) * interval, 2),
+        )
+    return paths
+
+
+@contextmanager
+def profile_run(mode: Optional[str], folder: str) -> Iterator[List[str]]:
+    """Profiles the block and writes the results into `folder` on exit.
+
+    Args:
+        mode: "sampling" for one folded-stack profile per profiled stage,
+            "cprofile" for a deterministic profile of the calling thread,
+            i.e. the event loop (`main.prof`, readable with pstats or
+            snakeviz; it misses threads and worker processes, which only
+            the sampling mode covers), or None
+        folder: Output folder of the profiles
+
+    Yields:
+        List that holds the paths of the written profiles after the block
+    """
+    paths: List[str] = []
+    if mode is None:
+        yield paths
+        return
+    if mode not in ("sampling", "cprofile"):
+        raise ValueError(f"Unknown profile mode: {mode}")
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    if profiler is not None:
+        profiler.enable()
+    else:
+        start_sampling()
+    try:
+        yield paths
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, "main.prof")
+            profiler.dump_stats(path)
+            paths.append(path)
+        else:
+            stop_sampling()
+            paths.extend(write_samples(folder))
+        logger.info("Wrote profiles", folder=folder, files=len(paths))
@@ -1,13 +1,33 @@
+import re
 from copy import deepcopy
+from functools import lru_cache
+from typing import (
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Type,
+    Union,
+)
 
 import structlog
 import tiktoken
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
+from pydantic.json_schema import SkipJsonSchema
 
 from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.timing import stage
 
 logger = structlog.get_logger()
 
+# Order of the prompt messages: the draft before or after the source pages
+PromptLayout = Literal["draft_first", "source_first"]
+# Whether the model writes out quotes ("full") or only points to them ("compact")
+QuoteSchema = Literal["full", "compact"]
+
 
 class Quote(BaseModel):
     """Extract quotes from SOURCE using this tool, ensuring verbatim and correct referencing so
@@ -30,6 +50,12 @@ class Quote(BaseModel):
         ...,
         title="How the quote supports the argument or helps to solve the issue presented, relating it from the source document to the drafts's context",
     )
+    # Set locally by `verify_insights`, never by the model: whether the quote was
+    # found in the source (None: not checked)
+    verified: SkipJsonSchema[Optional[bool]] = None
+    # Set locally by `QuoteClusters.add_report`: where near-identical copies of the
+    # quote were reported
+    also_quoted: SkipJsonSchema[List[str]] = []
 
 
 class Quote_case(BaseModel):
@@ -73,6 +99,9 @@ class Insights(BaseModel):
         title="How the general context might help the person (or not if it doesn't)",
     )
     quotes: list[Quote] = Field(..., title="List of quotes extracted from the document")
+    # Set locally by `CaseCheckpoint`, never by the model nor stored with the
+    # response: the batch the insights were checkpointed under
+    batch: SkipJsonSchema[Optional[int]] = Field(default=None, exclude=True)
 
 
 class Insights_case(BaseModel):
@@ -105,6 +134,124 @@ class Insights_case(BaseModel):
     quotes: list[Quote] = Field(..., title="List of quotes extracted from the document")
 
 
+class QuoteSpan(BaseModel):
+    """Point to a quote in SOURCE using this tool instead of writing it out.
+
+    Give the page the quote starts on and its first and last words, copied
+    exactly from SOURCE; the full quote is then taken from the page text.
+    Make sure to relate the quote to a specific argument and line in the DRAFT."""
+
+    page: int = Field(
+        ..., title="The page attribute of the <PAGE> tag the quote starts in"
+    )
+    start: str = Field(
+        ..., title="The first five to eight words of the quote, verbatim from SOURCE"
+    )
+    end: str = Field(
+        ..., title="The last five to eight words of the quote, verbatim from SOURCE"
+    )
+    issue_in_draft: str = Field(
+        ...,
+        description="The exact argument in the DRAFT that the quote might help support. Try to focus on a precise point in the text and give some verbatim quote so we can find it.",
+    )
+    relation: str = Field(
+        ...,
+        title="How the quote supports the argument or helps to solve the issue presented, relating it from the source document to the drafts's context",
+    )
+
+
+class CompactInsights(BaseModel):
+    """Given a DRAFT and a scientific SOURCE document split into <PAGE> tags, use this
+    tool to extract insights from SOURCE in forms of quotes that support the arguments
+    presented in DRAFT.
+
+    The DRAFT is for an article giving insights and guidance based on the works of
+    HC White, the source documents' author. Find insights that support the arguments
+    made in the draft, and add further insights to offer new arguments, sharpen ones,
+    or better represent White's work.
+
+    Do not write out the quotes: point to each one with its page and its first and
+    last words. If there are too many quotes, extract the most relevant and
+    high-quality ones."""
+
+    general_context: str = Field(..., title="General context in the source document")
+    general_relation: str = Field(
+        ...,
+        title="How the general context might help the person (or not if it doesn't)",
+    )
+    quotes: list[QuoteSpan] = Field(
+        ..., title="List of quotes pointed to in the document"
+    )
+
+
+class Relevance(BaseModel):
+    """Judge whether the SOURCE holds material that could support or sharpen the
+    arguments of the DRAFT.
+
+    Reference lists, indexes, front matter and passages on unrelated topics are
+    not relevant. Be generous otherwise: a later step extracts the actual quotes."""
+
+    reason: str = Field(
+        ...,
+        title="One sentence on what in the SOURCE relates to the DRAFT, if anything",
+    )
+    score: float = Field(
+        ...,
+        ge=0,
+        le=1,
+        title="Relevance of the SOURCE to the DRAFT, from 0 (nothing) to 1 (highly relevant)",
+    )
+
+
+def empty_insights() -> Insights:
+    """Insights of a batch that holds nothing relevant."""
+    return Insights(general_context="", general_relation="", quotes=[])
+
+
+def has_insights(insights: Insights) -> bool:
+    """Whether insights hold anything to report, unlike `empty_insights`."""
+    return bool(
+        insights.general_context or insights.general_relation or insights.quotes
+    )
+
+
+def insights_model(schema: QuoteSchema) -> Type[Union[Insights, CompactInsights]]:
+    """Response model of a quote schema."""
+    return CompactInsights if schema == "compact" else Insights
+
+
+@lru_cache(maxsize=64)
+def multi_case_model(
+    case_names: tuple[str, ...], schema: QuoteSchema = "full"
+) -> Type[BaseModel]:
+    """Returns a response model holding one `Insights` object per case.
+
+    Fields are named by position and aliased to the case names, so the
+    schema asks for every case by name while the field names stay valid
+    identifiers. With the "compact" schema, each case holds `CompactInsights`.
+    """
+    fields: Dict[str, Any] = {
+        f"case_{i}": (
+            insights_model(schema),
+            Field(..., alias=name, title=f"Insights for the DRAFT of case {name}"),
+        )
+        for i, name in enumerate(case_names)
+    }
+    return create_model(
+        "MultiCaseInsights",
+        __doc__="""Given several DRAFTs and a scientific SOURCE document, use this tool to extract
+    insights from SOURCE for each DRAFT separately, under the case name of the DRAFT.""",
+        **fields,
+    )
+
+
+def split_multi_case(
+    response: BaseModel, case_names: List[str]
+) -> Dict[str, Union[Insights, CompactInsights]]:
+    """Splits a `multi_case_model` response into the insights of each case."""
+    return {name: getattr(response, f"case_{i}") for i, name in enumerate(case_names)}
+
+
 system_prompt_case = [
     {
         "content": """\
@@ -130,55 +277,132 @@ Use the provided tools to do so.\n\n""",
 ]
 
 
-def return_pages(pages: list[PDFDocument], focal_page_number: int, range: int):
-    """Returns prompt with the focal page as context and
-    range of pages before and after.
-    Range is the number of pages to show before and after the focal page."""
-    focal_page = [page for page in pages if page.page == focal_page_number][0]
-    pages_before = [page for page in pages if page.page < focal_page_number][-range:]
-    pages_after = [page for page in pages if page.page > focal_page_number][:range]
-    return focal_page, pages_before, pages_after
+relevance_prompt = [
+    {
+        "content": """\
+You are given the draft of an academic paper under <DRAFT> tags, as well as part of an
+academic paper from HC White under <SOURCE> tags. Decide quickly whether the SOURCE
+contains anything that could support the arguments in the DRAFT.
+Use the provided tool to do so.\n\n""",
+        "role": "system",
+    }
+]
+
+
+focal_prompt = {
+    "content": """\
+The SOURCE is given as a FOCAL PAGE, with the pages before and after it as context.
+Extract insights only from the FOCAL PAGE; use the context to understand it.
+If there are no insights, you can leave the fields empty.\n\n""",
+    "role": "system",
+}
+
+
+class PageIndex:
+    """Positions and cumulative token counts of the pages of a document.
+
+    Built once per document, so that the window around any page is found by
+    its page number in constant time, sliced in O(range), and its tokens are
+    counted without encoding the pages again.
+    """
+
+    def __init__(self, pages: list[PDFDocument], encodings=None):
+        self.pages = pages
+        self.positions = {page.page: i for i, page in enumerate(pages)}
+        self.tokens = [0]
+        if encodings is not None:
+            for page in pages:
+                self.tokens.append(self.tokens[-1] + page.token_count(encodings))
+
+    def window(
+        self, position: int, range: int
+    ) -> tuple[PDFDocument, list[PDFDocument], list[PDFDocument]]:
+        """The page at `position` and up to `range` pages before and after it."""
+        before = self.pages[max(position - range, 0) : position]
+        after = self.pages[position + 1 : position + 1 + range]
+        return self.pages[position], before, after
+
+    def window_tokens(self, position: int, range: int) -> int:
+        """Tokens in the pages of a window (needs the index built with encodings)."""
+        start = max(position - range, 0)
+        end = min(position + 1 + range, len(self.pages))
+        return self.tokens[end] - self.tokens[start]
+
+
+def return_pages(
+    pages: list[PDFDocument],
+    focal_page_number: int,
+    range: int,
+    index: Optional[PageIndex] = None,
+):
+    """Returns the focal page and the range of pages before and after it.
+
+    Range is the number of pages to show before and after the focal page.
+    Pass the document's `PageIndex` when looking up many focal pages."""
+    index = index or PageIndex(pages)
+    return index.window(index.positions[focal_page_number], range)
+
+
+def _context_text(
+    pages: list[PDFDocument], label_pages: bool = False, first: int = 0
+) -> str:
+    """The pages of a part of a window; with `label_pages`, in <PAGE page=k>
+    tags numbered from `first`, as in `source_text`."""
+    if label_pages:
+        return "".join(
+            f"<PAGE page={k}> \n" + x.text + "</PAGE>\n"
+            for k, x in enumerate(pages, first)
+        )
+    return "".join(f"Page: {x.page + 1}\n{x.text}\n" for x in pages)
 
 
 def create_prompts(
-    pages: list[PDFDocument], focal_page_number: int, range: int, issue: str
+    pages: list[PDFDocument],
+    focal_page_number: int,
+    range: int,
+    issue,
+    layout: PromptLayout = "draft_first",
+    index: Optional[PageIndex] = None,
+    draft: Optional[dict] = None,
+    label_pages: bool = False,
 ):
-    """Creates prompts with the focal page as context and
-    range of pages before and after.
-    Range is the number of pages to show before and after the focal page."""
+    """Creates prompts with the focal page as source and range of pages before
+    and after it as context.
+
+    With `label_pages`, the pages of the window are wrapped in <PAGE page=k>
+    tags, k counting from the first page before the focal page, so that
+    compact quote spans can point to their page.
+
+    The system and draft messages are shared between all windows rather than
+    copied; only the source message is built per window. Pass the document's
+    `PageIndex` and a draft message from `draft_message` when creating the
+    prompts of many focal pages."""
     focal_page, pages_before, pages_after = return_pages(
-        pages, focal_page_number, range
+        pages, focal_page_number, range, index
     )
+    focal = len(pages_before)
+    source = {
+        "content": "<SOURCE> \n<CONTEXT BEFORE FOCAL PAGE> \n"
+        + _context_text(pages_before, label_pages)
+        + "</CONTEXT BEFORE FOCAL PAGE>\n<FOCAL PAGE> \n"
+        + _context_text([focal_page], label_pages, focal)
+        + "</FOCAL PAGE>\n<CONTEXT AFTER FOCAL PAGE> \n"
+        + _context_text(pages_after, label_pages, focal + 1)
+        + "</CONTEXT AFTER FOCAL PAGE>\n</SOURCE>\n",
+        "role": "user",
+    }
+    draft = draft or draft_message(issue)
+    if layout == "source_first":
+        return [*system_prompt, focal_prompt, source, draft]
+    return [*system_prompt, focal_prompt, draft, source]
 
-    prompts = system_prompt
-    context_before = "\n".join([f"Page:{x['page']}\n{x['text']}" for x in pages_before])
-    context_after = "\n".join([f"Page:{x['page']}\n{x['text']}" for x in pages_after])
-    prompts.append(
-        {
-            "content": "<CONTEXT BEFORE FOCAL PAGE> \n"
-            + context_before
-            + "</CONTEXT BEFORE FOCAL PAGE>\n",
-            "role": "system",
-        }
-    )
-    prompts.append(
-        {
-            "content": "<FOCAL PAGE> \n" + focal_page.text + "</FOCAL PAGE>\n",
-            "role": "system",
-        }
-    )
-    prompts.append(
-        {
-            "content": "<CONTEXT AFTER FOCAL PAGE> \n"
-            + context_after
-            + "</CONTEXT AFTER FOCAL PAGE>\n",
-            "role": "system",
-        }
-    )
-    prompts.append({"content": "<ISSUE> \n" + issue + "\n", "role": "user"})
-    return prompts
 
+def draft_message(issue) -> dict:
+    """The message holding a draft, to share between prompts."""
+    return {"content": "<DRAFT> \n" + issue + "</DRAFT>\n", "role": "system"}
 
+
+@lru_cache(maxsize=256)
 def return_system_tokens(issue, encodings: tiktoken.Encoding):
     """Returns the number of tokens in the system prompts."""
     return len(encodings.encode(str(system_prompt[0]["content"]))) + len(
@@ -186,57 +410,250 @@ def return_system_tokens(issue, encodings: tiktoken.Encoding):
     )
 
 
-def create_batched_prompts(pages: list[PDFDocument], issue, page_batch_size, encodings):
-    """Creates prompts with a batch of pages as context."""
-    prompts_list = []
-    current_context = ""
-    logger.debug(f"System prompts tokens {return_system_tokens(issue,encodings)}")
+def count_prompt_tokens(pages: list[PDFDocument], issue, encodings) -> int:
+    """Returns the number of tokens in a prompt built from pages and an issue,
+    using the cached page token counts instead of encoding the prompt."""
+    return return_system_tokens(issue, encodings) + sum(
+        page.token_count(encodings) for page in pages
+    )
+
+
+# Boundaries used to split oversized pages, from coarsest to finest.
+_SPLIT_PATTERNS = [r"\n\s*\n", r"\n", r"(?<=[.!?])\s+"]
+
+
+def _split_text(text: str, max_tokens: int, encodings, level: int = 0) -> list[str]:
+    """Splits text into chunks of at most max_tokens tokens, preferring
+    paragraph, then line, then sentence boundaries. Separators are kept, so
+    the chunks concatenate to the original text."""
+    if len(encodings.encode(text)) <= max_tokens:
+        return [text]
+    if level == len(_SPLIT_PATTERNS):
+        tokens = encodings.encode(text)
+        return [
+            encodings.decode(tokens[i : i + max_tokens])
+            for i in range(0, len(tokens), max_tokens)
+        ]
+
+    parts = re.split(f"({_SPLIT_PATTERNS[level]})", text)
+    # Attach each separator to the piece before it
+    pieces = [parts[i] + "".join(parts[i + 1 : i + 2]) for i in range(0, len(parts), 2)]
+
+    chunks: list[str] = []
+    current = ""
+    current_tokens = 0
+    for piece in pieces:
+        tokens = len(encodings.encode(piece))
+        if tokens > max_tokens:
+            if current:
+                chunks.append(current)
+                current, current_tokens = "", 0
+            chunks.extend(_split_text(piece, max_tokens, encodings, level + 1))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = "", 0
+        current += piece
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_page(page: PDFDocument, max_tokens: int, encodings) -> list[PDFDocument]:
+    """Splits a page longer than max_tokens into parts with the same page number."""
+    if page.token_count(encodings) <= max_tokens:
+        return [page]
+    return [
+        PDFDocument(filename=page.filename, page=page.page, text=chunk)
+        for chunk in _split_text(page.text, max_tokens, encodings)
+    ]
+
+
+def batch_pages(
+    pages: list[PDFDocument], page_batch_size, encodings, split_pages: bool = False
+) -> list[list[PDFDocument]]:
+    """Splits pages into consecutive batches of at most page_batch_size tokens.
+
+    Batches are packed greedily from the cached page token counts, in linear
+    time. Single pages above the budget overflow into their own batch, unless
+    split_pages is set, in which case they are split at paragraph or sentence
+    boundaries first. The packing only depends on the page texts, so the
+    prompts stay stable between runs.
+    """
     logger.debug(f"Creating prompts for {len(pages)} pages")
+    with stage("batching", profile=True):
+        return list(iter_batches(pages, page_batch_size, encodings, split_pages))
+
+
+def iter_batches(
+    pages: Iterable[PDFDocument], page_batch_size, encodings, split_pages: bool = False
+) -> Generator[list[PDFDocument], None, None]:
+    """Yields the batches of batch_pages while consuming pages lazily, so at
+    most one batch of pages is held at a time."""
+    current_pages: list[PDFDocument] = []
+    current_tokens = 0
     for i, page in enumerate(pages):
-        current_tokens = len(encodings.encode(current_context))
-        new_tokens = len(encodings.encode(page.text))
-        if current_tokens + new_tokens > page_batch_size:
-            logger.debug(
-                f"Page {i}: Tokens for current context: {current_tokens}, tokens for new page: {new_tokens}"
-            )
-            prompts = deepcopy(system_prompt)
-            prompts.append(
-                {"content": "<DRAFT> \n" + issue + "</DRAFT>\n", "role": "system"}
-            )
-            prompts.append(
-                {
-                    "content": "<SOURCE> \n" + current_context + "</SOURCE>\n",
-                    "role": "user",
-                }
-            )
-            prompts_list.append(prompts)
-            current_context = page.text
-        else:
-            current_context += page.text
-            # Add the last batch if there is any remaining context
-    if current_context:
-        prompts = deepcopy(system_prompt)
-        prompts.append(
-            {"content": "<DRAFT> \n" + issue + "</DRAFT>\n", "role": "system"}
-        )
-        prompts.append(
-            {
-                "content": "<SOURCE> \n" + current_context + "</SOURCE>\n",
-                "role": "user",
-            }
+        parts = split_page(page, page_batch_size, encodings) if split_pages else [page]
+        for part in parts:
+            new_tokens = part.token_count(encodings)
+            if current_pages and current_tokens + new_tokens > page_batch_size:
+                logger.debug(
+                    f"Page {i}: Tokens for current context: {current_tokens}, tokens for new page: {new_tokens}"
+                )
+                yield current_pages
+                current_pages = []
+                current_tokens = 0
+            current_pages.append(part)
+            current_tokens += new_tokens
+    # Add the last batch if there is any remaining context
+    if current_pages:
+        yield current_pages
+
+
+def arrange_prompt(
+    source: list[dict], issue, layout: PromptLayout = "draft_first"
+) -> list[dict]:
+    """Combines the system prompt, the source messages and the draft.
+
+    With the "source_first" layout the draft comes last, so all cases of a
+    document share the same prompt prefix and the provider can reuse its
+    cached prefill across them.
+    """
+    return _arrange(source, [draft_message(issue)], layout)
+
+
+def _arrange(
+    source: list[dict],
+    drafts: list[dict],
+    layout: PromptLayout,
+    system: list[dict] = system_prompt,
+):
+    prompts = deepcopy(system)
+    if layout == "source_first":
+        return prompts + source + drafts
+    return prompts + drafts + source
+
+
+def source_text(pages: list[PDFDocument], label_pages: bool = False) -> str:
+    """The pages of a batch as one SOURCE message.
+
+    With `label_pages`, each page is wrapped in a <PAGE page=k> tag, where k is
+    its index in the batch, so that quotes can point to their page.
+    """
+    if label_pages:
+        text = "".join(
+            f"<PAGE page={k}> \n" + x.text + "</PAGE>\n" for k, x in enumerate(pages)
         )
-        prompts_list.append(prompts)
+    else:
+        text = "".join(x.text for x in pages)
+    return "<SOURCE> \n" + text + "</SOURCE>\n"
 
-    return prompts_list
 
+def create_batch_prompt(
+    pages: list[PDFDocument],
+    issue,
+    layout: PromptLayout = "draft_first",
+    label_pages: bool = False,
+):
+    """Creates a prompt with a batch of pages as context."""
+    source = {"content": source_text(pages, label_pages), "role": "user"}
+    return arrange_prompt([source], issue, layout)
 
-def create_full_paper_prompts(pages, issue, encodings):
+
+def create_relevance_prompt(
+    pages: list[PDFDocument], issues: list[str], layout: PromptLayout = "draft_first"
+):
+    """Creates a prompt asking whether a batch of pages is relevant to the drafts."""
+    source = {"content": source_text(pages), "role": "user"}
+    drafts = [
+        {"content": "<DRAFT> \n" + issue + "</DRAFT>\n", "role": "system"}
+        for issue in issues
+    ]
+    return _arrange([source], drafts, layout, relevance_prompt)
+
+
+def create_batched_prompts(
+    pages: list[PDFDocument],
+    issue,
+    page_batch_size,
+    encodings,
+    split_pages=False,
+    layout: PromptLayout = "draft_first",
+):
+    """Creates prompts with a batch of pages as context."""
+    logger.debug(f"System prompts tokens {return_system_tokens(issue, encodings)}")
+    return [
+        create_batch_prompt(batch, issue, layout)
+        for batch in batch_pages(pages, page_batch_size, encodings, split_pages)
+    ]
+
+
+def create_full_paper_prompts(
+    pages, issue, encodings, layout: PromptLayout = "draft_first"
+):
     """Creates prompts with the full paper as context."""
-    logger.debug(f"System prompts tokens {return_system_tokens(issue,encodings)}")
-    prompts = deepcopy(system_prompt)
-    prompts.append({"content": "<DRAFT> \n" + issue + "</DRAFT>\n", "role": "system"})
-    for k, page in enumerate(pages):
-        prompts.append(
-            {"content": f"<PAGE page={k}> \n" + page.text + "</PAGE>\n", "role": "user"}
-        )
-    return prompts
+    logger.debug(f"System prompts tokens {return_system_tokens(issue, encodings)}")
+    source = [
+        {"content": f"<PAGE page={k}> \n" + page.text + "</PAGE>\n", "role": "user"}
+        for k, page in enumerate(pages)
+    ]
+    return arrange_prompt(source, issue, layout)
+
+
+multi_case_prompt = {
+    "content": """\
+There are several drafts, each under <DRAFT case="..."> tags with its case name.
+Extract insights for each draft separately and return them under the draft's case name.\n\n""",
+    "role": "system",
+}
+
+
+def create_multi_case_prompt(
+    pages: list[PDFDocument],
+    issues: Dict[str, str],
+    layout: PromptLayout = "draft_first",
+    label_pages: bool = False,
+):
+    """Creates a prompt with a batch of pages as context and several drafts."""
+    source = {"content": source_text(pages, label_pages), "role": "user"}
+    drafts = [deepcopy(multi_case_prompt)] + [
+        {
+            "content": f'<DRAFT case="{name}"> \n' + issue + "</DRAFT>\n",
+            "role": "system",
+        }
+        for name, issue in issues.items()
+    ]
+    return _arrange([source], drafts, layout)
+
+
+def drafts_tokens(issues: Iterable[str], encodings) -> int:
+    """Returns the number of tokens in the drafts of a multi-case prompt."""
+    return sum(len(encodings.encode(issue)) for issue in issues)
+
+
+def group_cases(
+    cases: Dict[str, str], max_cases: int, max_tokens: int, encodings
+) -> List[Dict[str, str]]:
+    """Packs cases into groups that are analyzed in a single call.
+
+    Groups hold at most `max_cases` cases whose drafts together stay within
+    `max_tokens`; a draft above the budget gets a group of its own. The pages
+    sent with a group need the rest of the prompt budget.
+    """
+    groups: List[Dict[str, str]] = []
+    current: Dict[str, str] = {}
+    current_tokens = 0
+    for name, issue in cases.items():
+        tokens = len(encodings.encode(issue))
+        if current and (
+            len(current) >= max_cases or current_tokens + tokens > max_tokens
+        ):
+            groups.append(current)
+            current = {}
+            current_tokens = 0
+        current[name] = issue
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import re
+import time
+from typing import Dict, Optional
+
+import httpx
+import structlog
+
+logger = structlog.get_logger()
+
+# Default (requests per minute, tokens per minute) budgets. Models are matched
+# by longest prefix, so "gpt-4o-mini-2024-07-18" uses the "gpt-4o-mini" entry.
+# The buckets resize themselves once the API reports the account's real limits.
+MODEL_LIMITS: Dict[str, tuple[int, int]] = {
+    "gpt-4o-mini": (500, 200_000),
+    "gpt-4o": (500, 30_000),
+    "gpt-4-turbo": (500, 30_000),
+    "gpt-4": (500, 10_000),
+    "gpt-3.5-turbo": (3_500, 200_000),
+    "o1-mini": (500, 200_000),
+    "o1": (500, 30_000),
+    "text-embedding": (3_000, 1_000_000),
+}
+DEFAULT_LIMITS = (500, 30_000)
+# Completion tokens reserved for a call before its usage is known; the API
+# counts them against the same budget, and the unused part is refunded
+EXPECTED_COMPLETION_TOKENS = 2_000
+
+
+class TokenBucket:
+    """A bucket holding up to `per_minute` units that refills continuously."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60.0
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        """Return units that were consumed but not used."""
+        self.level = min(self.capacity, self.level + amount)
+
+    def resize(self, capacity: float) -> None:
+        """Change the per-minute budget, keeping the current level."""
+        if capacity > 0 and capacity != self.capacity:
+            self.capacity = float(capacity)
+            self.level = min(self.level, self.capacity)
+
+    def sync(self, remaining: float) -> None:
+        """Lower the level to what the server reports as remaining."""
+        self._refill(time.monotonic())
+        self.level = min(self.level, remaining)
+
+
+def parse_reset(value: Optional[str]) -> float:
+    """Parse durations such as "1s", "6m0s", "20ms" or "0.5" into seconds."""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+class RateLimiter:
+    """Request and token budget for a single model.
+
+    Every call is charged one request, its prompt tokens and the completion
+    tokens it is expected to use before it is sent; once the response reports
+    its usage, `settle` refunds the unused part of the reservation. Responses
+    feed back into the buckets: the `x-ratelimit-*` headers resize
+    and resync them, and a 429 pauses all calls until the reported reset time.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        # Budgets set explicitly are not resized from the reported limits
+        self.follow_request_headers = True
+        self.follow_token_headers = True
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    async def acquire(self, tokens: int, completion_tokens: int = 0) -> int:
+        """Wait until one request and its tokens fit in the budget.
+
+        Args:
+            tokens: Tokens of the prompt
+            completion_tokens: Completion tokens to reserve, e.g.
+                `EXPECTED_COMPLETION_TOKENS`
+
+        Returns:
+            Tokens reserved, to be passed to `settle`
+        """
+        tokens += completion_tokens
+        async with self._get_lock():
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self.paused_until - now,
+                    self.requests.wait_time(1, now),
+                    self.tokens.wait_time(tokens, now),
+                )
+                if wait <= 0:
+                    break
+                logger.debug("Waiting for rate limit", seconds=round(wait, 2))
+                await asyncio.sleep(wait)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+        return tokens
+
+    def settle(self, reserved: int, used: int) -> None:
+        """Correct a reservation from `acquire` with the tokens a call used."""
+        if used < reserved:
+            self.tokens.refund(reserved - used)
+        else:
+            self.tokens.consume(used - reserved)
+
+    def observe_headers(self, headers: httpx.Headers) -> None:
+        """Resize and resync the buckets from the rate-limit headers."""
+        try:
+            if self.follow_request_headers and "x-ratelimit-limit-requests" in headers:
+                self.requests.resize(float(headers["x-ratelimit-limit-requests"]))
+            if self.follow_token_headers and "x-ratelimit-limit-tokens" in headers:
+                self.tokens.resize(float(headers["x-ratelimit-limit-tokens"]))
+            if "x-ratelimit-remaining-requests" in headers:
+                self.requests.sync(float(headers["x-ratelimit-remaining-requests"]))
+            if "x-ratelimit-remaining-tokens" in headers:
+                self.tokens.sync(float(headers["x-ratelimit-remaining-tokens"]))
+        except ValueError as e:
+            logger.debug("Could not parse rate limit headers", error=str(e))
+
+    def backoff(self, headers: httpx.Headers) -> None:
+        """Pause all calls after a 429 response."""
+        delay = parse_reset(headers.get("retry-after")) or max(
+            parse_reset(headers.get("x-ratelimit-reset-requests")),
+            parse_reset(headers.get("x-ratelimit-reset-tokens")),
+            1.0,
+        )
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.tokens.sync(0)
+        logger.warning("Rate limited by API", pause=round(delay, 2))
+
+
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_rate_limiter(
+    model: str,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+) -> RateLimiter:
+    """Returns the process-wide rate limiter for a model.
+
+    Explicit budgets override the defaults from `MODEL_LIMITS` and are not
+    resized from the limits the API reports.
+    """
+    limiter = _limiters.get(model)
+    if limiter is None:
+        prefixes = [x for x in MODEL_LIMITS if model.startswith(x)]
+        rpm, tpm = MODEL_LIMITS[max(prefixes, key=len)] if prefixes else DEFAULT_LIMITS
+        limiter = RateLimiter(rpm, tpm)
+        _limiters[model] = limiter
+    if requests_per_minute:
+        limiter.requests.resize(requests_per_minute)
+        limiter.follow_request_headers = False
+    if tokens_per_minute:
+        limiter.tokens.resize(tokens_per_minute)
+        limiter.follow_token_headers = False
+    return limiter
+
+
+async def observe_response(response: httpx.Response) -> None:
+    """httpx response hook feeding rate-limit headers back into the limiters."""
+    observe_response_sync(response)
+
+
+def observe_response_sync(response: httpx.Response) -> None:
+    """Synchronous variant of `observe_response` for blocking httpx clients."""
+    try:
+        model = json.loads(response.request.content).get("model")
+    except (ValueError, AttributeError, httpx.RequestNotRead):
+        return
+    limiter = _limiters.get(model)
+    if limiter is None:
+        return
+    if response.status_code == 429:
+        limiter.backoff(response.headers)
+    else:
+        limiter.observe_headers(response.headers)
@@ -0,0 +1,127 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import structlog
+import tiktoken
+
+from whiteanalysis.embeddings import embed_texts
+from whiteanalysis.file_handling import PDFDocument
+
+logger = structlog.get_logger()
+
+
+async def page_vectors(
+    pages: List[PDFDocument],
+    embedding_model: str,
+    encodings: Optional[tiktoken.Encoding] = None,
+) -> np.ndarray:
+    """Embeddings of `pages`, one row per page.
+
+    Vectors are kept on the pages, like their token counts, so screening the
+    batches of a document reuses the vectors computed to rank its pages for
+    retrieval, and each page is embedded once for all cases.
+    """
+    vectors: Dict[int, np.ndarray] = {}
+    for i, page in enumerate(pages):
+        vector = page.vector(embedding_model)
+        if vector is not None:
+            vectors[i] = vector
+    missing = [i for i in range(len(pages)) if i not in vectors]
+    if missing:
+        matrix = await embed_texts(
+            [pages[i].text for i in missing], embedding_model, encodings
+        )
+        for i, row in zip(missing, matrix):
+            pages[i].set_vector(embedding_model, row)
+            vectors[i] = row
+    return np.stack([vectors[i] for i in range(len(pages))])
+
+
+def select_pages(scores: np.ndarray, top_k: int, neighbors: int) -> np.ndarray:
+    """Indices of the `top_k` best scoring pages and their neighbors, in page order.
+
+    Args:
+        scores: Similarity of each page to the case
+        top_k: Number of best pages to keep
+        neighbors: Pages kept on either side of each selected page, so that
+            arguments running across a page break stay intact
+
+    Returns:
+        Sorted page indices
+    """
+    if top_k >= len(scores):
+        return np.arange(len(scores))
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    selected = (top[:, None] + np.arange(-neighbors, neighbors + 1)).ravel()
+    return np.unique(selected[(selected >= 0) & (selected < len(scores))])
+
+
+async def relevant_pages(
+    pages: List[PDFDocument],
+    cases: Dict[str, str],
+    top_k: int,
+    neighbors: int,
+    embedding_model: str,
+    encodings: Optional[tiktoken.Encoding] = None,
+) -> Dict[str, np.ndarray]:
+    """Ranks the pages of a document against each case by cosine similarity.
+
+    Pages and cases are embedded once (and cached), and all cases are scored
+    against all pages with a single matrix product. The page vectors are kept
+    on the pages for `batch_similarity`.
+
+    Args:
+        pages: Pages of the document
+        cases: Cases to select pages for
+        top_k: Number of best pages kept per case
+        neighbors: Pages kept on either side of each selected page
+        embedding_model: "local" or an OpenAI embedding model
+        encodings: Tokenizer encoding
+
+    Returns:
+        Sorted indices of the selected pages of each case
+    """
+    if not pages or not cases:
+        return {name: np.arange(len(pages)) for name in cases}
+    vectors = await page_vectors(pages, embedding_model, encodings)
+    case_vectors = await embed_texts(list(cases.values()), embedding_model, encodings)
+    scores = case_vectors @ vectors.T
+    selected = {
+        name: select_pages(row, top_k, neighbors) for name, row in zip(cases, scores)
+    }
+    logger.debug(
+        "Selected pages",
+        filename=pages[0].filename,
+        pages=len(pages),
+        selected={name: len(x) for name, x in selected.items()},
+    )
+    return selected
+
+
+def pages_for(
+    pages: List[PDFDocument],
+    selected: Optional[Dict[str, np.ndarray]],
+    case_names: List[str],
+) -> List[PDFDocument]:
+    """The pages selected for any of `case_names`, or all pages without selection."""
+    if selected is None:
+        return pages
+    indices = np.unique(np.concatenate([selected[x] for x in case_names]))
+    return [pages[i] for i in indices]
+
+
+async def batch_similarity(
+    pages: List[PDFDocument],
+    issues: List[str],
+    embedding_model: str,
+    encodings: Optional[tiktoken.Encoding] = None,
+) -> float:
+    """Highest cosine similarity between any page of a batch and any of `issues`.
+
+    Pages already embedded for retrieval are not embedded again.
+    """
+    if not pages or not issues:
+        return 0.0
+    vectors = await page_vectors(pages, embedding_model, encodings)
+    issue_vectors = await embed_texts(issues, embedding_model, encodings)
+    return float((issue_vectors @ vectors.T).max())
@@ -0,0 +1,143 @@
+import bisect
+import re
+from typing import List, Optional, Tuple
+
+import structlog
+
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.metrics import increment
+from whiteanalysis.prompts import CompactInsights, Insights, Quote, QuoteSpan
+
+logger = structlog.get_logger()
+
+# Longest quote taken from the page text, in characters; a span whose end
+# anchor is further away than this is cut to its start anchor
+MAX_QUOTE_CHARS = 3000
+# Characters of page text before and after a quote given as its context
+CONTEXT_CHARS = 300
+
+_DASHES = str.maketrans("‐‑‒–—―’‘“”", "------''\"\"")
+
+
+def normalize(text: str) -> Tuple[str, List[int]]:
+    """Lowercases text, unifies dashes and quotes and collapses whitespace.
+
+    Returns:
+        The normalized text and, for each of its characters, the position of
+        the original character it came from
+    """
+    chars: List[str] = []
+    positions: List[int] = []
+    text = text.translate(_DASHES)
+    for i, char in enumerate(text):
+        if char.isspace():
+            if chars and chars[-1] != " ":
+                chars.append(" ")
+                positions.append(i)
+            continue
+        # Lowercasing may expand a character ("İ" becomes two), so every
+        # output character gets its own position
+        lower = char.lower()
+        chars.append(lower)
+        positions.extend([i] * len(lower))
+    return "".join(chars), positions
+
+
+def _anchor(text: str) -> str:
+    return normalize(text)[0].strip()
+
+
+class BatchText:
+    """The pages of a batch joined into one searchable text.
+
+    Quotes are looked up in the joined text, so a quote running over a page
+    break is still found.
+    """
+
+    def __init__(self, pages: List[PDFDocument]):
+        self.pages = pages
+        self.text = "\n".join(x.text for x in pages)
+        self.offsets: List[int] = []
+        offset = 0
+        for page in pages:
+            self.offsets.append(offset)
+            offset += len(page.text) + 1
+        self.normalized, self.positions = normalize(self.text)
+
+    def page_at(self, position: int) -> PDFDocument:
+        return self.pages[max(bisect.bisect_right(self.offsets, position) - 1, 0)]
+
+    def _normalized_offset(self, page: int) -> int:
+        """First normalized position at or after the start of a page."""
+        if not 0 <= page < len(self.offsets):
+            return 0
+        return bisect.bisect_left(self.positions, self.offsets[page])
+
+    def find(self, span: QuoteSpan) -> Optional[Tuple[int, int]]:
+        """Start and end of a span in the joined text, or None if not found.
+
+        The start anchor is searched from the stated page onwards first, then
+        in the whole batch; the end anchor after the start.
+        """
+        start = _anchor(span.start)
+        end = _anchor(span.end)
+        if not start:
+            return None
+        begin = self.normalized.find(start, self._normalized_offset(span.page))
+        if begin < 0:
+            begin = self.normalized.find(start)
+        if begin < 0:
+            return None
+        stop = begin + len(start)
+        if end:
+            found = self.normalized.find(end, begin)
+            if found >= 0 and found + len(end) - begin <= MAX_QUOTE_CHARS:
+                stop = max(stop, found + len(end))
+        return self.positions[begin], self.positions[stop - 1] + 1
+
+    def context(self, begin: int, end: int) -> str:
+        """Page text around a quote, cut at word boundaries."""
+        before = self.text[max(begin - CONTEXT_CHARS, 0) : begin]
+        after = self.text[end : end + CONTEXT_CHARS]
+        before = before.split(" ", 1)[-1] if begin > CONTEXT_CHARS else before
+        after = after.rsplit(" ", 1)[0] if len(after) == CONTEXT_CHARS else after
+        parts = [x.strip() for x in (before, after) if x.strip()]
+        return re.sub(r"\s+", " ", " [...] ".join(parts))
+
+
+def resolve_quote(span: QuoteSpan, text: BatchText) -> Quote:
+    """Fills in the verbatim text, context and page of a quote span.
+
+    Spans that cannot be found in the pages keep their anchors as text.
+    """
+    found = text.find(span)
+    if found is None:
+        increment("unresolved_quotes")
+        logger.debug("Could not resolve quote", start=span.start, end=span.end)
+        valid = 0 <= span.page < len(text.pages)
+        return Quote(
+            context="",
+            position=f"Page {text.pages[span.page].page + 1}" if valid else "",
+            text=f"{span.start} [...] {span.end}",
+            issue_in_draft=span.issue_in_draft,
+            relation=span.relation,
+        )
+    begin, end = found
+    increment("resolved_quotes")
+    return Quote(
+        context=text.context(begin, end),
+        position=f"Page {text.page_at(begin).page + 1}",
+        text=re.sub(r"\s+", " ", text.text[begin:end]).strip(),
+        issue_in_draft=span.issue_in_draft,
+        relation=span.relation,
+    )
+
+
+def resolve_insights(response: CompactInsights, pages: List[PDFDocument]) -> Insights:
+    """Turns a compact response into regular insights using the batch's pages."""
+    text = BatchText(pages)
+    return Insights(
+        general_context=response.general_context,
+        general_relation=response.general_relation,
+        quotes=[resolve_quote(x, text) for x in response.quotes],
+    )
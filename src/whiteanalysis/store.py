@@ -0,0 +1,384 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import structlog
+from pydantic import BaseModel
+
+from whiteanalysis.prompts import Insights, Quote, has_insights
+
+logger = structlog.get_logger()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    run TEXT NOT NULL,
+    document TEXT NOT NULL,
+    case_name TEXT NOT NULL,
+    case_text TEXT NOT NULL,
+    complete INTEGER NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (run, document, case_name)
+);
+CREATE TABLE IF NOT EXISTS insights (
+    id INTEGER PRIMARY KEY,
+    run TEXT NOT NULL,
+    model TEXT NOT NULL,
+    document TEXT NOT NULL,
+    case_name TEXT NOT NULL,
+    batch INTEGER NOT NULL,
+    general_context TEXT NOT NULL,
+    general_relation TEXT NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (run, document, case_name, batch)
+);
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY,
+    insight_id INTEGER NOT NULL,
+    ordinal INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    context TEXT NOT NULL,
+    position TEXT NOT NULL,
+    issue_in_draft TEXT NOT NULL,
+    relation TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    verified INTEGER
+);
+CREATE INDEX IF NOT EXISTS quotes_insight ON quotes (insight_id);
+CREATE INDEX IF NOT EXISTS quotes_text_hash ON quotes (text_hash);
+CREATE VIRTUAL TABLE IF NOT EXISTS quotes_fts USING fts5 (
+    text, context, issue_in_draft, relation,
+    content='quotes', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS quotes_insert AFTER INSERT ON quotes BEGIN
+    INSERT INTO quotes_fts (rowid, text, context, issue_in_draft, relation)
+    VALUES (new.id, new.text, new.context, new.issue_in_draft, new.relation);
+END;
+CREATE TRIGGER IF NOT EXISTS quotes_delete AFTER DELETE ON quotes BEGIN
+    INSERT INTO quotes_fts (quotes_fts, rowid, text, context, issue_in_draft, relation)
+    VALUES ('delete', old.id, old.text, old.context, old.issue_in_draft, old.relation);
+END;
+"""
+
+
+def quote_hash(text: str) -> str:
+    """Hash of a quote's words, ignoring case, punctuation and whitespace."""
+    words = " ".join(re.findall(r"\w+", text.lower()))
+    return hashlib.sha256(words.encode("utf-8")).hexdigest()
+
+
+class QuoteHit(BaseModel):
+    """A stored quote with the run, document, case and batch it came from."""
+
+    run: str
+    model: str
+    document: str
+    case_name: str
+    batch: int
+    quote: Quote
+    score: float = 0.0
+    duplicates: int = 0
+
+
+class InsightStore:
+    """SQLite store of all insights and quotes, with a full-text index on quotes.
+
+    Rows are keyed by run folder, document, case and batch, so reruns of a
+    batch replace its quotes and results of different runs can be compared.
+    The case texts are kept as well, so reports can be rebuilt from the store.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        columns = {x[1] for x in self._conn.execute("PRAGMA table_info(quotes)")}
+        if "verified" not in columns:
+            # Stores written before quotes were verified
+            self._conn.execute("ALTER TABLE quotes ADD COLUMN verified INTEGER")
+        self._conn.commit()
+
+    @staticmethod
+    def run_key(run_dir: str) -> str:
+        return os.path.abspath(run_dir)
+
+    def put_insights(
+        self,
+        run_dir: str,
+        model: str,
+        document: str,
+        case_name: str,
+        batch: int,
+        insights: Insights,
+    ) -> None:
+        """Stores the insights of a batch, replacing earlier ones of the same run.
+
+        Batches without insights (see `has_insights`), such as those skipped by
+        screening, only have their earlier insights removed.
+        """
+        run = self.run_key(run_dir)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM insights "
+                "WHERE run = ? AND document = ? AND case_name = ? AND batch = ?",
+                (run, document, case_name, batch),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM quotes WHERE insight_id = ?", row)
+                self._conn.execute("DELETE FROM insights WHERE id = ?", row)
+            if not has_insights(insights):
+                self._conn.commit()
+                return
+            insight_id = self._conn.execute(
+                "INSERT INTO insights (run, model, document, case_name, batch, "
+                "general_context, general_relation, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run,
+                    model,
+                    document,
+                    case_name,
+                    batch,
+                    insights.general_context,
+                    insights.general_relation,
+                    time.time(),
+                ),
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO quotes (insight_id, ordinal, text, context, position, "
+                "issue_in_draft, relation, text_hash, verified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        insight_id,
+                        i,
+                        x.text,
+                        x.context,
+                        x.position,
+                        x.issue_in_draft,
+                        x.relation,
+                        quote_hash(x.text),
+                        x.verified,
+                    )
+                    for i, x in enumerate(insights.quotes)
+                ],
+            )
+            self._conn.commit()
+
+    def put_verification(
+        self,
+        run_dir: str,
+        document: str,
+        case_name: str,
+        responses: List[Insights],
+    ) -> None:
+        """Stores the verification results and corrected positions of a case's quotes.
+
+        Responses are matched to the stored insights by their `batch`; those
+        without stored insights are logged and skipped.
+
+        Args:
+            run_dir: Run folder of the case
+            document: Path to the document file
+            case_name: Name of the case
+            responses: Verified insights of the case
+        """
+        run = self.run_key(run_dir)
+        with self._lock:
+            rows = dict(
+                self._conn.execute(
+                    "SELECT batch, id FROM insights "
+                    "WHERE run = ? AND document = ? AND case_name = ?",
+                    (run, document, case_name),
+                ).fetchall()
+            )
+            missing = [x.batch for x in responses if x.batch not in rows]
+            if missing:
+                logger.warning(
+                    "Verified quotes of batches without stored insights not saved",
+                    document=document,
+                    case_name=case_name,
+                    batches=missing,
+                )
+            self._conn.executemany(
+                "UPDATE quotes SET verified = ?, position = ? "
+                "WHERE insight_id = ? AND ordinal = ?",
+                [
+                    (quote.verified, quote.position, rows[insights.batch], i)
+                    for insights in responses
+                    if insights.batch in rows
+                    for i, quote in enumerate(insights.quotes)
+                ],
+            )
+            self._conn.commit()
+
+    def put_case(
+        self,
+        run_dir: str,
+        document: str,
+        case_name: str,
+        case_text: str,
+        complete: bool,
+    ) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cases VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.run_key(run_dir),
+                    document,
+                    case_name,
+                    case_text,
+                    int(complete),
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
+
+    def cases(self, run_dir: str) -> List[Tuple[str, str, str, bool]]:
+        """(document, case name, case text, complete) of every case of a run."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT document, case_name, case_text, complete FROM cases "
+                "WHERE run = ? ORDER BY document, case_name",
+                (self.run_key(run_dir),),
+            ).fetchall()
+        return [(a, b, c, bool(d)) for a, b, c, d in rows]
+
+    def insights(
+        self, run_dir: str, document: str, case_name: str
+    ) -> Tuple[Optional[str], List[Insights]]:
+        """The model and the insights of a case, in batch order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, model, general_context, general_relation, batch "
+                "FROM insights "
+                "WHERE run = ? AND document = ? AND case_name = ? ORDER BY batch",
+                (self.run_key(run_dir), document, case_name),
+            ).fetchall()
+            quotes: Dict[int, List[Quote]] = {}
+            for row in self._conn.execute(
+                "SELECT insight_id, text, context, position, issue_in_draft, "
+                "relation, verified FROM quotes WHERE insight_id IN "
+                f"({','.join('?' * len(rows))}) ORDER BY insight_id, ordinal",
+                [x[0] for x in rows],
+            ):
+                quotes.setdefault(row[0], []).append(self._quote(row[1:]))
+        model = rows[0][1] if rows else None
+        return model, [
+            Insights(
+                general_context=x[2],
+                general_relation=x[3],
+                quotes=quotes.get(x[0], []),
+                batch=x[4],
+            )
+            for x in rows
+        ]
+
+    @staticmethod
+    def _quote(row: tuple) -> Quote:
+        return Quote(
+            text=row[0],
+            context=row[1],
+            position=row[2],
+            issue_in_draft=row[3],
+            relation=row[4],
+            verified=None if row[5] is None else bool(row[5]),
+        )
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        case_name: Optional[str] = None,
+        document: Optional[str] = None,
+        run_dir: Optional[str] = None,
+        limit: int = 20,
+        dedupe: bool = True,
+    ) -> List[QuoteHit]:
+        """Finds stored quotes, best matches first.
+
+        Args:
+            query: FTS5 query on the quote text, context, draft issue and
+                relation (e.g. `identity AND control`); None lists all quotes
+            case_name: Only quotes of this case
+            document: Only quotes of documents whose path contains this text
+            run_dir: Only quotes of this run
+            limit: Maximum number of quotes
+            dedupe: Return each quote text once, counting its duplicates
+
+        Returns:
+            Matching quotes
+        """
+        joins = "FROM quotes q JOIN insights i ON i.id = q.insight_id"
+        conditions: List[str] = []
+        params: List[object] = []
+        score = "0.0"
+        if query:
+            joins += " JOIN quotes_fts f ON f.rowid = q.id"
+            conditions.append("quotes_fts MATCH ?")
+            params.append(query)
+            score = "-bm25(quotes_fts)"
+        if case_name:
+            conditions.append("i.case_name = ?")
+            params.append(case_name)
+        if document:
+            conditions.append("i.document LIKE ?")
+            params.append(f"%{document}%")
+        if run_dir:
+            conditions.append("i.run = ?")
+            params.append(self.run_key(run_dir))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = (
+            f"SELECT i.run, i.model, i.document, i.case_name, i.batch, q.text, "
+            f"q.context, q.position, q.issue_in_draft, q.relation, q.verified, "
+            f"q.text_hash, {score} AS score {joins} {where} "
+            f"ORDER BY score DESC, i.created DESC, q.ordinal"
+        )
+        hits: List[QuoteHit] = []
+        seen: Dict[str, QuoteHit] = {}
+        with self._lock:
+            for row in self._conn.execute(sql, params):
+                if dedupe and row[11] in seen:
+                    seen[row[11]].duplicates += 1
+                    continue
+                if len(hits) >= limit:
+                    if dedupe:
+                        continue
+                    break
+                hit = QuoteHit(
+                    run=row[0],
+                    model=row[1],
+                    document=row[2],
+                    case_name=row[3],
+                    batch=row[4],
+                    quote=self._quote(row[5:11]),
+                    score=row[12],
+                )
+                seen[row[11]] = hit
+                hits.append(hit)
+        return hits
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_insight_store: Optional[InsightStore] = None
+
+
+def open_insight_store(cache_folder: str) -> InsightStore:
+    """Opens the process-wide insight store in `cache_folder`."""
+    global _insight_store
+    if _insight_store is not None:
+        _insight_store.close()
+    _insight_store = InsightStore(os.path.join(cache_folder, "insights.sqlite"))
+    return _insight_store
+
+
+def get_insight_store() -> Optional[InsightStore]:
+    """Returns the process-wide insight store, or None if it is off."""
+    return _insight_store
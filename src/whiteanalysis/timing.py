@@ -0,0 +1,74 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from pydantic import BaseModel
+
+from whiteanalysis.profiling import pop_stage, push_stage
+
+
+class StageStats(BaseModel):
+    """Number of runs and summed wall time of a pipeline stage.
+
+    Stages run concurrently, so the summed time of a stage can exceed the
+    wall time of the run.
+    """
+
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+_stages: Dict[str, StageStats] = {}
+_lock = threading.Lock()
+
+
+def record_stage(name: str, seconds: float, count: int = 1) -> None:
+    with _lock:
+        stats = _stages.setdefault(name, StageStats())
+        stats.count += count
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+
+
+@contextmanager
+def stage(name: str, profile: bool = False) -> Iterator[None]:
+    """Adds the time spent in the block to the stage `name`.
+
+    Args:
+        name: Name of the stage
+        profile: Attribute profiler samples of this thread to the stage; only
+            for blocks that do not await, since other coroutines would run
+            in the same thread meanwhile
+    """
+    start = time.perf_counter()
+    if profile:
+        push_stage(name)
+    try:
+        yield
+    finally:
+        if profile:
+            pop_stage()
+        record_stage(name, time.perf_counter() - start)
+
+
+def get_stages() -> Dict[str, StageStats]:
+    """Returns a copy of the per-stage totals."""
+    with _lock:
+        return {k: v.model_copy() for k, v in _stages.items()}
+
+
+def merge_stages(stages: Dict[str, StageStats]) -> None:
+    """Adds stage totals, e.g. those drained in a worker process."""
+    with _lock:
+        for name, other in stages.items():
+            stats = _stages.setdefault(name, StageStats())
+            stats.count += other.count
+            stats.seconds += other.seconds
+            stats.max_seconds = max(stats.max_seconds, other.max_seconds)
+
+
+def reset_stages() -> None:
+    with _lock:
+        _stages.clear()
@@ -0,0 +1,131 @@
+import threading
+from typing import Dict, Optional
+
+import structlog
+from openai.types import CompletionUsage
+from pydantic import BaseModel
+
+logger = structlog.get_logger()
+
+# Dollars per million (input, cached input, output) tokens. Models are matched
+# by longest prefix, like the rate limits.
+MODEL_PRICES: Dict[str, tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-4": (30.00, 30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+    "o1-mini": (3.00, 1.50, 12.00),
+    "o1": (15.00, 7.50, 60.00),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.13, 0.0),
+    "text-embedding-ada-002": (0.10, 0.10, 0.0),
+}
+
+
+# Usage tier of Batch API responses, which cost half the listed prices
+BATCH_TIER = "batch"
+BATCH_DISCOUNT = 0.5
+
+
+def model_prices(model: str) -> Optional[tuple[float, float, float]]:
+    prefixes = [x for x in MODEL_PRICES if model.startswith(x)]
+    return MODEL_PRICES[max(prefixes, key=len)] if prefixes else None
+
+
+class UsageStats(BaseModel):
+    """Token usage and latency reported by the API for one model."""
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    latency_seconds: float = 0.0
+    max_latency_seconds: float = 0.0
+
+    @property
+    def cache_hit_rate(self) -> float:
+        """Share of prompt tokens served from the provider's prompt cache."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def cost(self, model: str) -> Optional[float]:
+        """Estimated cost in dollars, or None for models without known prices.
+
+        `model` is the usage label; Batch API usage gets `BATCH_DISCOUNT`.
+        """
+        prices = model_prices(model)
+        if prices is None:
+            return None
+        uncached = self.prompt_tokens - self.cached_tokens
+        batch = model.endswith(f"({BATCH_TIER})")
+        discount = BATCH_DISCOUNT if batch else 1.0
+        return (
+            discount
+            * (
+                uncached * prices[0]
+                + self.cached_tokens * prices[1]
+                + self.completion_tokens * prices[2]
+            )
+            / 1_000_000
+        )
+
+
+def usage_label(model: str, tier: Optional[str] = None) -> str:
+    """Key of a model's usage totals; calls of other tiers are counted apart.
+
+    The label starts with the model name, so prices are still found by prefix.
+    """
+    return f"{model} ({tier})" if tier else model
+
+
+_usage: Dict[str, UsageStats] = {}
+_lock = threading.Lock()
+
+
+def record_usage(
+    model: str, usage: Optional[CompletionUsage], latency: float = 0.0
+) -> None:
+    """Adds the usage and latency of one API response to the totals of its model."""
+    if usage is None:
+        return
+    details = usage.prompt_tokens_details
+    cached = (details.cached_tokens or 0) if details is not None else 0
+    with _lock:
+        stats = _usage.setdefault(model, UsageStats())
+        stats.calls += 1
+        stats.prompt_tokens += usage.prompt_tokens
+        stats.cached_tokens += cached
+        stats.completion_tokens += usage.completion_tokens
+        stats.latency_seconds += latency
+        stats.max_latency_seconds = max(stats.max_latency_seconds, latency)
+    logger.debug(
+        "API usage",
+        model=model,
+        prompt_tokens=usage.prompt_tokens,
+        cached_tokens=cached,
+        latency=round(latency, 3),
+    )
+
+
+def get_usage() -> Dict[str, UsageStats]:
+    """Returns a copy of the usage totals per model."""
+    with _lock:
+        return {k: v.model_copy() for k, v in _usage.items()}
+
+
+def reset_usage() -> None:
+    with _lock:
+        _usage.clear()
+
+
+def log_usage() -> None:
+    """Logs the usage totals and prompt cache hit rate of every model."""
+    for model, stats in get_usage().items():
+        cost = stats.cost(model)
+        logger.info(
+            "API usage",
+            model=model,
+            **stats.model_dump(),
+            cache_hit_rate=round(stats.cache_hit_rate, 3),
+            cost_usd=round(cost, 4) if cost is not None else None,
+        )
@@ -1,14 +1,127 @@
+import asyncio
 import os
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional
 
+import httpx
 import instructor
 from dotenv import load_dotenv
-from instructor import Instructor
-from openai import OpenAI
+from instructor import AsyncInstructor, Instructor
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from pydantic import BaseModel
+
+from whiteanalysis.rate_limit import observe_response, observe_response_sync
+
+# httpx event hooks of the blocking and the async client
+ResponseHook = Callable[[httpx.Response], None]
+AsyncResponseHook = Callable[[httpx.Response], Awaitable[None]]
+
+
+class ClientSettings(BaseModel):
+    """Connection pool and timeout settings of the shared API clients."""
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 100
+    keepalive_expiry: float = 30.0
+    timeout: float = 600.0
+    connect_timeout: float = 5.0
+
+
+_settings = ClientSettings()
+_lock = threading.Lock()
+_client: Optional[tuple[Instructor, OpenAI]] = None
+_async_client: Optional[tuple[AsyncInstructor, AsyncOpenAI]] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def configure_clients(**settings) -> ClientSettings:
+    """Changes the settings of the shared clients.
+
+    Clients created before are dropped, so the next call to `return_client`
+    or `return_async_client` builds a new pool with the given settings.
+
+    Args:
+        **settings: Fields of `ClientSettings` to change
+    """
+    global _settings, _client, _async_client
+    with _lock:
+        _settings = _settings.model_copy(update=settings)
+        _client = None
+        _async_client = None
+    return _settings
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_settings.max_connections,
+        max_keepalive_connections=_settings.max_keepalive_connections,
+        keepalive_expiry=_settings.keepalive_expiry,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(_settings.timeout, connect=_settings.connect_timeout)
 
 
 def return_client() -> tuple[Instructor, OpenAI]:
-    """Returns both Instructor and OpenAI client objects."""
-    load_dotenv()
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    iclient = instructor.from_openai(client=client)
-    return iclient, client
+    """Returns both Instructor and OpenAI client objects.
+
+    The clients are created once per process and share a keep-alive
+    connection pool. Unlike the async client, they keep the SDK's own
+    retries, since the Batch API calls made with them are not retried
+    otherwise.
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            load_dotenv()
+            hooks: Dict[str, List[ResponseHook]] = {"response": [observe_response_sync]}
+            http_client: httpx.Client = DefaultHttpxClient(
+                event_hooks=hooks, limits=_limits()
+            )
+            client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=_timeout(),
+                http_client=http_client,
+            )
+            _client = instructor.from_openai(client=client), client
+        return _client
+
+
+def return_async_client() -> tuple[AsyncInstructor, AsyncOpenAI]:
+    """Returns both async Instructor and AsyncOpenAI client objects.
+
+    The clients are shared by all calls made from the running event loop, so
+    connections are reused across documents, cases and retries. Responses are
+    passed to the rate limiters so they can follow the limits reported by the
+    API. The client does not retry by itself: its callers retry with tenacity
+    and back off through the rate limiter, so retries do not multiply.
+    """
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if _async_client is None or _async_loop is not loop:
+            load_dotenv()
+            hooks: Dict[str, List[AsyncResponseHook]] = {"response": [observe_response]}
+            http_client: httpx.AsyncClient = DefaultAsyncHttpxClient(
+                event_hooks=hooks, limits=_limits()
+            )
+            client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=_timeout(),
+                max_retries=0,
+                http_client=http_client,
+            )
+            _async_client = instructor.from_openai(client=client), client
+            _async_loop = loop
+        return _async_client
+
+
+async def close_async_client() -> None:
+    """Closes the connections of the shared async client of the running loop."""
+    global _async_client
+    with _lock:
+        clients = _async_client if _async_loop is asyncio.get_running_loop() else None
+        _async_client = None
+    if clients is not None:
+        await clients[1].close()
@@ -0,0 +1,164 @@
+import bisect
+import re
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional
+
+import structlog
+from pydantic import BaseModel
+
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.metrics import increment
+from whiteanalysis.prompts import Insights, Quote
+from whiteanalysis.timing import stage
+
+logger = structlog.get_logger()
+
+# Words per indexed n-gram
+NGRAM = 3
+# N-grams of a quote looked up in the index; longer quotes are sampled evenly
+MAX_PROBES = 24
+# N-grams occurring more often than this in a document are too common to vote
+MAX_POSTINGS = 64
+# Candidate alignments of a quote compared word by word
+MAX_CANDIDATES = 3
+# Share of a quote's words that must be found in order in the source
+MIN_MATCH = 0.8
+
+
+def words(text: str) -> List[str]:
+    """Lowercased words of a text, ignoring punctuation and hyphenation."""
+    return re.findall(r"\w+", text.replace("\xad", "").lower())
+
+
+class QuoteMatch(BaseModel):
+    """Where a quote was found in a document and how closely it matches."""
+
+    page: int
+    score: float
+    start: int
+    end: int
+
+
+class QuoteIndex:
+    """Word n-gram index over the pages of a document, for checking quotes.
+
+    Each n-gram maps to the word positions it occurs at. A quote is located by
+    looking up a bounded sample of its n-grams and letting each hit vote for
+    the position the quote would start at; only the best few alignments are
+    compared word by word. The cost per quote thus depends on the quote's
+    length, not the document's, and quotes with a few words changed, dropped
+    or broken across a page are still found.
+    """
+
+    def __init__(self, pages: Optional[List[PDFDocument]] = None):
+        self.words: List[str] = []
+        self.grams: Dict[int, List[int]] = defaultdict(list)
+        # First word position and page number of each page, in page order
+        self.page_starts: List[int] = []
+        self.page_numbers: List[int] = []
+        if pages:
+            self.add(pages)
+
+    def add(self, pages: List[PDFDocument]) -> None:
+        """Indexes further pages of the document, e.g. the next streamed batch."""
+        with stage("verify"):
+            for page in pages:
+                first = len(self.words)
+                self.page_starts.append(first)
+                self.page_numbers.append(page.page)
+                self.words.extend(words(page.text))
+                # Also index the n-grams running over the previous page break
+                for i in range(max(first - NGRAM + 1, 0), len(self.words) - NGRAM + 1):
+                    self.grams[hash(tuple(self.words[i : i + NGRAM]))].append(i)
+
+    def page_at(self, position: int) -> int:
+        return self.page_numbers[
+            max(bisect.bisect_right(self.page_starts, position) - 1, 0)
+        ]
+
+    def locate(self, text: str) -> Optional[QuoteMatch]:
+        """Best match of a quote in the document, or None if nothing is close.
+
+        Args:
+            text: Quote text as returned by the model
+
+        Returns:
+            Page, share of the quote's words found in order, and word range
+            of the match
+        """
+        quote = words(text)
+        count = len(quote) - NGRAM + 1
+        if count < 1 or not self.words:
+            return None
+        step = max(count / MAX_PROBES, 1)
+        votes: Counter = Counter()
+        for i in sorted({int(k * step) for k in range(min(count, MAX_PROBES))}):
+            postings = self.grams.get(hash(tuple(quote[i : i + NGRAM])), [])
+            if len(postings) <= MAX_POSTINGS:
+                votes.update(x - i for x in postings)
+        best: Optional[QuoteMatch] = None
+        slack = len(quote) // 10 + NGRAM
+        for offset, _ in votes.most_common(MAX_CANDIDATES):
+            start = max(offset - slack, 0)
+            window = self.words[start : offset + len(quote) + slack]
+            blocks = [
+                x
+                for x in SequenceMatcher(
+                    None, quote, window, autojunk=False
+                ).get_matching_blocks()
+                if x.size
+            ]
+            if not blocks:
+                continue
+            score = sum(x.size for x in blocks) / len(quote)
+            if best is None or score > best.score:
+                first = start + blocks[0].b
+                best = QuoteMatch(
+                    page=self.page_at(first),
+                    score=score,
+                    start=first,
+                    end=start + blocks[-1].b + blocks[-1].size,
+                )
+        return best
+
+
+def stated_page(position: str) -> Optional[int]:
+    """Page number in a quote's position, e.g. 5 for "Page 5, Paragraph 2"."""
+    found = re.search(r"\b(?:page|pages|p|pp)\.?\s*(\d+)", position, re.IGNORECASE)
+    return int(found.group(1)) if found else None
+
+
+def verify_quote(quote: Quote, index: QuoteIndex) -> Quote:
+    """Checks a quote against the document and sets its page to where it was found.
+
+    Quotes that cannot be found with at least `MIN_MATCH` of their words are
+    marked as unverified and keep their stated position. Quotes shorter than
+    an n-gram are left unchecked.
+    """
+    if len(words(quote.text)) < NGRAM:
+        return quote
+    match = index.locate(quote.text)
+    if match is None or match.score < MIN_MATCH:
+        increment("unverified_quotes")
+        logger.debug(
+            "Quote not found in document",
+            text=quote.text[:80],
+            score=round(match.score, 2) if match else 0.0,
+        )
+        return quote.model_copy(update={"verified": False})
+    increment("verified_quotes")
+    update: Dict[str, object] = {"verified": True}
+    if stated_page(quote.position) != match.page + 1:
+        increment("relocated_quotes")
+        update["position"] = f"Page {match.page + 1}"
+    return quote.model_copy(update=update)
+
+
+def verify_insights(responses: List[Insights], index: QuoteIndex) -> List[Insights]:
+    """Verifies and relocates the quotes of a case's insights."""
+    with stage("verify"):
+        return [
+            x.model_copy(update={"quotes": [verify_quote(q, index) for q in x.quotes]})
+            for x in responses
+        ]
@@ -0,0 +1,92 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import structlog
+from pydantic import BaseModel
+
+logger = structlog.get_logger()
+
+# Modification time (ns) and size of a file
+FileStat = Tuple[int, int]
+
+
+def file_stat(path: str) -> Optional[FileStat]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class WatchChanges(BaseModel):
+    """Files that appeared, changed or disappeared since the previous poll."""
+
+    added: List[str] = []
+    changed: List[str] = []
+    removed: List[str] = []
+    cases_changed: bool = False
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed or self.cases_changed)
+
+
+class FolderWatcher:
+    """Polls a document folder and a cases file for changes.
+
+    Files are compared by modification time and size, so polling does not
+    read them. A new or changed file is only reported once its stat is the
+    same on two consecutive polls, so files that are still being copied or
+    saved are picked up when they are complete. Files present at the first
+    poll are reported right away.
+    """
+
+    def __init__(self, inputs: str):
+        self.inputs = inputs
+        self.files: Dict[str, FileStat] = {}
+        self._inputs: Optional[FileStat] = None
+        self._pending: Dict[str, FileStat] = {}
+        self._polled = False
+
+    def _settled(self, path: str, stat: Optional[FileStat]) -> bool:
+        """Whether a file has the same stat as on the previous poll."""
+        previous = self._pending.get(path)
+        if stat is None:
+            self._pending.pop(path, None)
+            return False
+        self._pending[path] = stat
+        return previous == stat or not self._polled
+
+    def poll(self, filenames: List[str]) -> WatchChanges:
+        """Compares the current files with those of the previous poll.
+
+        Args:
+            filenames: Documents currently in the folder
+
+        Returns:
+            The settled changes since the last reported state
+        """
+        changes = WatchChanges()
+        for filename in filenames:
+            stat = file_stat(filename)
+            if stat is None:
+                self._pending.pop(filename, None)
+                continue
+            if stat == self.files.get(filename) or not self._settled(filename, stat):
+                continue
+            if filename in self.files:
+                changes.changed.append(filename)
+            else:
+                changes.added.append(filename)
+            self.files[filename] = stat
+        current = set(filenames)
+        for filename in [x for x in self.files if x not in current]:
+            del self.files[filename]
+            self._pending.pop(filename, None)
+            changes.removed.append(filename)
+
+        stat = file_stat(self.inputs)
+        if stat != self._inputs and self._settled(self.inputs, stat):
+            self._inputs = stat
+            changes.cases_changed = True
+        self._polled = True
+        return changes
@@ -55,12 +55,16 @@ def generate_word_report(
         for j, quote in enumerate(insight.quotes, 1):
             # Add quote with clear separation
             doc.add_paragraph(f"\nQUOTE {j}:")
+            if quote.verified is False:
+                doc.add_paragraph(
+                    "WARNING: Not found in the source document; check before citing."
+                )
             doc.add_paragraph(f"Text: {quote.text}")
             doc.add_paragraph(f"Context: {quote.context}")
             doc.add_paragraph(f"Position: {quote.position}")
-            doc.add_paragraph(
-                f"Argument in draft: {quote.issue_in_draft if hasattr(quote, 'issue_in_draft') else ''}"
-            )
+            if quote.also_quoted:
+                doc.add_paragraph(f"Also quoted in: {'; '.join(quote.also_quoted)}")
+            doc.add_paragraph(f"Argument in draft: {quote.issue_in_draft}")
             doc.add_paragraph(f"Relevance: {quote.relation}")
 
         doc.add_paragraph("\n" + "-" * 40)  # Section separator
@@ -151,6 +155,14 @@ def generate_word_report_pretty(
             position_para = quote_cell.add_paragraph()
             position_para.add_run("Position: ").bold = True
             position_para.add_run(quote.position)
+            if quote.verified is False:
+                position_para.add_run(
+                    " (not found in the source document; check before citing)"
+                ).italic = True
+            if quote.also_quoted:
+                also_para = quote_cell.add_paragraph()
+                also_para.add_run("Also quoted in: ").bold = True
+                also_para.add_run("; ".join(quote.also_quoted))
 
             # Relevance with light blue background
             relevance_table = quote_cell.add_table(rows=1, cols=1)
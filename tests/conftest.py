@@ -0,0 +1,13 @@
+import pytest
+import tiktoken
+
+
+@pytest.fixture
+def encodings() -> tiktoken.Encoding:
+    """Offline byte-level encoding: one token per byte of UTF-8 text."""
+    return tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([i]): i for i in range(256)},
+        special_tokens={},
+    )
@@ -0,0 +1,127 @@
+import json
+from typing import Dict
+
+import pytest
+from docx import Document
+from typer.testing import CliRunner
+
+from whiteanalysis.batch import (
+    INSIGHTS_TOOL,
+    BatchJob,
+    LocalBatchBackend,
+    empty_response,
+    parse_result,
+    request_body,
+)
+from whiteanalysis.main import app
+from whiteanalysis.manifest import RunManifest, document_counts
+from whiteanalysis.prompts import Insights, Quote
+
+QUOTE = "Identities arise from the control efforts of actors in networks."
+
+
+def quote_response(body: Dict) -> Dict:
+    """Answers every request with one quote found in the documents."""
+    response = empty_response(body)
+    insights = Insights(
+        general_context="networks",
+        general_relation="supports the draft",
+        quotes=[
+            Quote(
+                context="",
+                position="Page 1",
+                text=QUOTE,
+                issue_in_draft="identity",
+                relation="relation",
+            )
+        ],
+    )
+    function = response["choices"][0]["message"]["tool_calls"][0]["function"]
+    function["arguments"] = insights.model_dump_json()
+    return response
+
+
+def run_requests(backend: LocalBatchBackend, path: str, bodies: list) -> list:
+    with open(path, "w", encoding="utf-8") as f:
+        for i, body in enumerate(bodies):
+            f.write(json.dumps({"custom_id": f"request-{i}", "body": body}) + "\n")
+    batch_id = backend.submit(path)
+    assert backend.status(batch_id) == "completed"
+    backend.download(batch_id, path)
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_local_backend_answers_every_request(tmp_path):
+    backend = LocalBatchBackend(str(tmp_path / "batches"), quote_response)
+    prompt = [{"role": "user", "content": "<SOURCE> text</SOURCE>"}]
+    body = request_body(prompt, "gpt-4o-mini")
+
+    rows = run_requests(backend, str(tmp_path / "batch.jsonl"), [body, body])
+
+    assert body["tool_choice"]["function"]["name"] == INSIGHTS_TOOL["name"]
+    assert [x["custom_id"] for x in rows] == ["request-0", "request-1"]
+    insights, usage = parse_result(rows[0])
+    assert insights.quotes[0].text == QUOTE
+    assert usage is None
+
+
+def test_failed_request_is_rejected():
+    row = {"response": {"status_code": 500, "body": {"error": "server"}}}
+
+    with pytest.raises(ValueError):
+        parse_result(row)
+    with pytest.raises(ValueError):
+        parse_result({"response": {"status_code": 200, "body": {"choices": []}}})
+
+
+def test_submitted_batch_is_collected_into_reports(tmp_path, monkeypatch, encodings):
+    documents = tmp_path / "documents"
+    documents.mkdir()
+    doc = Document()
+    doc.add_paragraph("On social structure. " * 4)
+    doc.add_paragraph(QUOTE)
+    doc.save(str(documents / "paper.docx"))
+    cases = tmp_path / "cases.json"
+    cases.write_text(json.dumps({"identity": "Identity draft", "control": "Control"}))
+    run_dir = tmp_path / "run"
+    monkeypatch.setattr("whiteanalysis.main.load_encodings", lambda model: encodings)
+    monkeypatch.setattr(
+        "whiteanalysis.main.get_backend",
+        lambda name, folder=None: LocalBatchBackend(str(folder), quote_response),
+    )
+    runner = CliRunner()
+
+    submitted = runner.invoke(
+        app,
+        [
+            "submit-batch",
+            "--document-folder",
+            str(documents),
+            "--output-folder",
+            str(run_dir),
+            "--inputs",
+            str(cases),
+            "--no-add-timestamp",
+            "--no-cache",
+            "--backend",
+            "local",
+            "--batch-folder",
+            str(tmp_path / "batches"),
+        ],
+    )
+    assert submitted.exit_code == 0, submitted.output
+    assert len(BatchJob.load(str(run_dir)).requests) == 2
+
+    collected = runner.invoke(
+        app, ["collect-batch", str(run_dir), "--no-cache", "--no-store"]
+    )
+    assert collected.exit_code == 0, collected.output
+
+    manifest = RunManifest.load(str(run_dir))
+    assert document_counts(manifest) == {"done": 1, "failed": 0}
+    reports = sorted(x.name for x in run_dir.iterdir() if x.suffix == ".html")
+    assert len(reports) == 2
+    report = (run_dir / reports[0]).read_text(encoding="utf-8")
+    assert QUOTE in report
+    assert "Not found in the source document" not in report
@@ -0,0 +1,97 @@
+import json
+
+import httpx
+from docx import Document
+from typer.testing import CliRunner
+
+from whiteanalysis.batch import INSIGHTS_TOOL, request_body
+from whiteanalysis.benchmark import MockServer, MockSettings
+from whiteanalysis.main import app
+from whiteanalysis.prompts import Insights
+
+
+def chat_request(server: MockServer) -> httpx.Response:
+    prompt = [{"role": "user", "content": "<SOURCE> social networks </SOURCE>"}]
+    return httpx.post(
+        f"{server.base_url}/chat/completions",
+        json=request_body(prompt, "gpt-4o-mini"),
+    )
+
+
+def test_mock_server_answers_the_forced_tool_call():
+    with MockServer(MockSettings(latency=0, jitter=0, quotes=2)) as server:
+        response = chat_request(server)
+
+    assert response.status_code == 200
+    body = response.json()
+    function = body["choices"][0]["message"]["tool_calls"][0]["function"]
+    assert function["name"] == INSIGHTS_TOOL["name"]
+    assert len(Insights.model_validate_json(function["arguments"]).quotes) == 2
+    assert body["usage"]["total_tokens"] > 0
+    assert server.stats.completed == 1
+
+
+def test_mock_server_enforces_its_request_limit():
+    settings = MockSettings(latency=0, jitter=0, requests_per_minute=2)
+    with MockServer(settings) as server:
+        responses = [chat_request(server) for _ in range(3)]
+
+    assert [x.status_code for x in responses] == [200, 200, 429]
+    assert responses[0].headers["x-ratelimit-remaining-requests"] == "1"
+    assert float(responses[2].headers["retry-after"]) > 0
+    assert server.stats.rate_limited == 1
+
+
+def benchmark_args(tmp_path) -> list:
+    cases = tmp_path / "cases.json"
+    cases.write_text(json.dumps({"case": "A draft on identity and control."}))
+    return [
+        "benchmark",
+        "--document-folder",
+        str(tmp_path / "documents"),
+        "--inputs",
+        str(cases),
+        "--report",
+        str(tmp_path / "report.json"),
+        "--latency",
+        "0",
+        "--jitter",
+        "0",
+        "--ingest-workers",
+        "0",
+    ]
+
+
+def test_benchmark_reports_finished_documents(tmp_path, monkeypatch, encodings):
+    monkeypatch.setenv("OPENAI_BASE_URL", "")
+    monkeypatch.setenv("OPENAI_API_KEY", "")
+    monkeypatch.setattr("whiteanalysis.main.load_encodings", lambda model: encodings)
+    (tmp_path / "documents").mkdir()
+    doc = Document()
+    doc.add_paragraph("Identities arise from control efforts in social networks. " * 3)
+    doc.save(str(tmp_path / "documents" / "paper.docx"))
+    (tmp_path / "documents" / "broken.docx").write_text("not a document")
+
+    result = CliRunner().invoke(app, benchmark_args(tmp_path))
+
+    assert result.exit_code == 0, result.output
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["documents"] == 1
+    assert report["failed"] == 1
+    assert report["server"]["completed"] == report["server"]["requests"] > 0
+    assert report["documents_per_minute"] > 0
+
+
+def test_benchmark_fails_if_no_document_finished(tmp_path, monkeypatch, encodings):
+    monkeypatch.setenv("OPENAI_BASE_URL", "")
+    monkeypatch.setenv("OPENAI_API_KEY", "")
+    monkeypatch.setattr("whiteanalysis.main.load_encodings", lambda model: encodings)
+    (tmp_path / "documents").mkdir()
+    (tmp_path / "documents" / "broken.docx").write_text("not a document")
+
+    result = CliRunner().invoke(app, benchmark_args(tmp_path))
+
+    assert result.exit_code == 1
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["documents"] == 0
+    assert report["failed"] == 1
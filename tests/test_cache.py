@@ -0,0 +1,130 @@
+import os
+
+from whiteanalysis.cache import DocumentCache, ResponseCache, response_cache_key
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.prompts import Insights, Quote, multi_case_model, split_multi_case
+
+
+def make_insights(text: str) -> Insights:
+    quote = Quote(
+        context="context",
+        position="Page 1",
+        text=text,
+        issue_in_draft="issue",
+        relation="relation",
+    )
+    return Insights(general_context="general", general_relation="", quotes=[quote])
+
+
+def test_response_round_trip(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    messages = [{"content": "prompt", "role": "user"}]
+    key = response_cache_key("gpt-4o", Insights, messages)
+    response = make_insights("a quote")
+
+    assert cache.get(key, Insights) is None
+    cache.put(key, "gpt-4o", response)
+    assert cache.get(key, Insights) == response
+
+
+def test_multi_case_response_round_trip(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    model = multi_case_model(("case one", "case two"))
+    response = model.model_validate(
+        {"case one": make_insights("first"), "case two": make_insights("second")}
+    )
+    key = response_cache_key("gpt-4o", model, [{"content": "x", "role": "user"}])
+
+    cache.put(key, "gpt-4o", response)
+    cached = cache.get(key, model)
+
+    assert cached is not None
+    assert split_multi_case(cached, ["case one", "case two"]) == {
+        "case one": make_insights("first"),
+        "case two": make_insights("second"),
+    }
+
+
+def test_key_depends_on_model_and_messages():
+    messages = [{"content": "prompt", "role": "user"}]
+    key = response_cache_key("gpt-4o", Insights, messages)
+
+    assert key == response_cache_key("gpt-4o", Insights, list(messages))
+    assert key != response_cache_key("gpt-4o-mini", Insights, messages)
+    assert key != response_cache_key(
+        "gpt-4o", Insights, [{"content": "other", "role": "user"}]
+    )
+
+
+def test_expired_response_is_dropped(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("whiteanalysis.cache.time.time", lambda: now[0])
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"), max_age_days=1)
+    cache.put("key", "gpt-4o", make_insights("a quote"))
+
+    now[0] += 86400 / 2
+    assert cache.get("key", Insights) is not None
+    now[0] += 86400
+    assert cache.get("key", Insights) is None
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+
+    def clock() -> float:
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr("whiteanalysis.cache.time.time", clock)
+    size = len(make_insights("quote 0").model_dump_json(by_alias=True))
+    cache = ResponseCache(
+        str(tmp_path / "responses.sqlite"), max_size_mb=3.5 * size / 1024 / 1024
+    )
+    for i in range(3):
+        cache.put(f"key-{i}", "gpt-4o", make_insights(f"quote {i}"))
+    assert cache.get("key-0", Insights) is not None
+
+    cache.put("key-3", "gpt-4o", make_insights("quote 3"))
+
+    assert cache.get("key-1", Insights) is None
+    assert cache.get("key-0", Insights) is not None
+    assert cache.get("key-3", Insights) is not None
+
+
+def test_access_times_are_written_on_close(tmp_path, monkeypatch):
+    now = [1000.0]
+
+    def clock() -> float:
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr("whiteanalysis.cache.time.time", clock)
+    path = str(tmp_path / "responses.sqlite")
+    size = len(make_insights("quote 0").model_dump_json(by_alias=True))
+    cache = ResponseCache(path)
+    for i in range(3):
+        cache.put(f"key-{i}", "gpt-4o", make_insights(f"quote {i}"))
+    assert cache.get("key-0", Insights) is not None
+    cache.close()
+
+    cache = ResponseCache(path, max_size_mb=2.5 * size / 1024 / 1024)
+
+    assert cache.get("key-1", Insights) is None
+    assert cache.get("key-0", Insights) is not None
+    assert cache.get("key-2", Insights) is not None
+
+
+def test_truncated_document_is_discarded(tmp_path):
+    cache = DocumentCache(str(tmp_path))
+    key = DocumentCache.key("digest", "bytes")
+    pages = [PDFDocument(filename="a.pdf", page=i, text=f"page {i}") for i in (1, 2)]
+    cache.put(key, pages)
+    assert cache.get(key, "a.pdf") == pages
+    path = cache._path(key)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[: len(data) // 2])
+
+    assert cache.get(key, "a.pdf") is None
+    assert not os.path.exists(path)
@@ -0,0 +1,71 @@
+from whiteanalysis.dedup import QuoteClusters, open_quote_clusters
+from whiteanalysis.prompts import Insights, Quote
+
+QUOTE = "Firms adopt new routines when their managers observe peers in dense networks"
+NEAR_COPY = (
+    "Firms adopt new routines when their managers observe peers in dense network"
+)
+OTHER = "Adoption slows once the novelty of a practice wears off for the organization"
+
+
+def make_insights(*texts: str) -> Insights:
+    quotes = [
+        Quote(
+            context="context",
+            position="Page 1",
+            text=text,
+            issue_in_draft="issue",
+            relation="relation",
+        )
+        for text in texts
+    ]
+    return Insights(general_context="general", general_relation="", quotes=quotes)
+
+
+def texts(responses: list[Insights]) -> list[list[str]]:
+    return [[x.text for x in insight.quotes] for insight in responses]
+
+
+def test_near_duplicates_within_a_report_are_merged():
+    clusters = QuoteClusters()
+
+    results = clusters.add_report(
+        "paper.pdf", "case", [make_insights(QUOTE, OTHER), make_insights(NEAR_COPY)]
+    )
+
+    assert texts(results) == [[QUOTE, OTHER], []]
+    assert results[0].quotes[0].also_quoted == ["Insight Set 2"]
+    assert results[0].quotes[1].also_quoted == []
+    assert len(clusters.data.clusters) == 2
+
+
+def test_quotes_of_other_reports_are_listed():
+    clusters = QuoteClusters()
+    clusters.add_report("a/paper.pdf", "first", [make_insights(QUOTE)])
+
+    results = clusters.add_report("b/other.pdf", "second", [make_insights(NEAR_COPY)])
+
+    assert texts(results) == [[NEAR_COPY]]
+    assert results[0].quotes[0].also_quoted == ["first, paper.pdf (Insight Set 1)"]
+
+
+def test_writing_a_report_again_replaces_its_references():
+    clusters = QuoteClusters()
+    clusters.add_report("paper.pdf", "case", [make_insights(QUOTE)])
+
+    results = clusters.add_report("paper.pdf", "case", [make_insights(QUOTE)])
+
+    assert results[0].quotes[0].also_quoted == []
+    assert len(clusters.data.clusters[0].refs) == 1
+
+
+def test_stored_clusters_are_continued(tmp_path):
+    clusters = QuoteClusters()
+    clusters.add_report("paper.pdf", "first", [make_insights(QUOTE)])
+    clusters.save(str(tmp_path))
+
+    resumed = open_quote_clusters(str(tmp_path))
+    results = resumed.add_report("paper.pdf", "second", [make_insights(NEAR_COPY)])
+
+    assert len(resumed.data.clusters) == 1
+    assert results[0].quotes[0].also_quoted == ["first, paper.pdf (Insight Set 1)"]
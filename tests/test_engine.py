@@ -0,0 +1,134 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from whiteanalysis import retrieval
+from whiteanalysis.engine import batch_screen, run_checkpointed_batch, run_page_windows
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.metrics import get_counters, reset_metrics
+from whiteanalysis.options import AnalysisOptions
+from whiteanalysis.prompts import Insights, Relevance, create_batch_prompt
+from whiteanalysis.retrieval import batch_similarity, relevant_pages
+
+DRAFT = "Identity and control emerge from social networks and ties."
+RELEVANT = [PDFDocument(filename="a.pdf", page=0, text=DRAFT)]
+IRRELEVANT = [
+    PDFDocument(filename="a.pdf", page=1, text="Bibliography and index entries.")
+]
+
+
+@pytest.fixture
+def calls(monkeypatch) -> List[str]:
+    """Replaces the API calls with a model that finds the draft in relevant sources."""
+    seen: List[str] = []
+
+    async def run_single_batch(
+        prompt, encodings, model, semaphore, response_model, *_, **__
+    ):
+        seen.append(model)
+        if response_model is Relevance:
+            source = next(x["content"] for x in prompt if x["role"] == "user")
+            relevant = DRAFT in source
+            return Relevance(reason="", score=0.9 if relevant else 0.1)
+        return Insights(general_context="found", general_relation="", quotes=[])
+
+    monkeypatch.setattr("whiteanalysis.engine.run_single_batch", run_single_batch)
+    reset_metrics()
+    return seen
+
+
+def analyze(pages: List[PDFDocument], options: AnalysisOptions, encodings) -> Insights:
+    async def run() -> Insights:
+        semaphore = asyncio.Semaphore(1)
+        return await run_checkpointed_batch(
+            create_batch_prompt(pages, DRAFT),
+            0,
+            encodings,
+            "gpt-4o",
+            semaphore,
+            token_count=100,
+            screen=batch_screen(pages, [DRAFT], encodings, semaphore, options),
+        )
+
+    return asyncio.run(run())
+
+
+def test_screening_model_skips_irrelevant_batches(calls, encodings):
+    options = AnalysisOptions(screen_model="gpt-4o-mini", screen_threshold=0.5)
+
+    assert analyze(RELEVANT, options, encodings).general_context == "found"
+    assert analyze(IRRELEVANT, options, encodings).general_context == ""
+
+    assert calls == ["gpt-4o-mini", "gpt-4o", "gpt-4o-mini"]
+    assert get_counters()["skipped_batches"] == 1
+    assert get_counters()["screen_skipped_tokens"] == 100
+
+
+def test_embedding_screen_needs_no_model_call(calls, encodings):
+    options = AnalysisOptions(
+        screen_model="embedding", embedding_model="local", screen_threshold=0.5
+    )
+
+    assert analyze(RELEVANT, options, encodings).general_context == "found"
+    assert analyze(IRRELEVANT, options, encodings).general_context == ""
+
+    assert calls == ["gpt-4o"]
+
+
+def test_batch_is_kept_if_screening_fails(calls, monkeypatch, encodings):
+    async def fail(*args, **kwargs):
+        raise RuntimeError("embedding service down")
+
+    monkeypatch.setattr("whiteanalysis.engine.batch_similarity", fail)
+    options = AnalysisOptions(screen_model="embedding", screen_threshold=0.5)
+
+    assert analyze(IRRELEVANT, options, encodings).general_context == "found"
+    assert batch_screen(IRRELEVANT, [DRAFT], encodings, None, AnalysisOptions()) is None
+
+
+def test_screening_reuses_the_page_vectors_of_retrieval(monkeypatch):
+    embedded: List[str] = []
+    embed_texts = retrieval.embed_texts
+
+    async def counting_embed(texts, *args):
+        embedded.extend(texts)
+        return await embed_texts(texts, *args)
+
+    monkeypatch.setattr("whiteanalysis.retrieval.embed_texts", counting_embed)
+    pages = [
+        PDFDocument(filename="b.pdf", page=i, text=f"{DRAFT} Page {i}.")
+        for i in range(4)
+    ]
+
+    async def run() -> float:
+        await relevant_pages(pages, {"case": DRAFT}, 2, 0, "local")
+        return await batch_similarity(pages[:2], [DRAFT], "local")
+
+    assert asyncio.run(run()) > 0.5
+    assert embedded == [x.text for x in pages] + [DRAFT, DRAFT]
+
+
+def test_every_page_is_analyzed_as_the_focal_page(monkeypatch, encodings):
+    async def run_single_batch(prompt, encodings, model, semaphore, *args):
+        source = next(x["content"] for x in prompt if x["role"] == "user")
+        focal = source.split("<FOCAL PAGE> \n")[1].split("\n")[1]
+        if focal == "page 2":
+            raise RuntimeError("server error")
+        return Insights(general_context=focal, general_relation="", quotes=[])
+
+    monkeypatch.setattr("whiteanalysis.engine.run_single_batch", run_single_batch)
+    pages = [PDFDocument(filename="a.pdf", page=i, text=f"page {i}") for i in range(4)]
+
+    responses = asyncio.run(
+        run_page_windows(
+            pages,
+            DRAFT,
+            encodings,
+            "gpt-4o",
+            asyncio.Semaphore(2),
+            options=AnalysisOptions(page_window=1),
+        )
+    )
+
+    assert [x.general_context for x in responses] == ["page 0", "page 1", "page 3"]
@@ -0,0 +1,76 @@
+import io
+import os
+
+from whiteanalysis.html_creation import (
+    STYLESHEET,
+    generate_insights_report,
+    write_insights,
+    write_stylesheet,
+)
+from whiteanalysis.prompts import Insights, Quote
+
+
+def make_insights(text: str, verified=None) -> Insights:
+    return Insights(
+        general_context="context",
+        general_relation="relation",
+        quotes=[
+            Quote(
+                context="around the quote",
+                position="Page 2",
+                text=text,
+                issue_in_draft="the draft's point",
+                relation="supports it",
+                verified=verified,
+            )
+        ],
+    )
+
+
+def test_report_links_the_shared_stylesheet(tmp_path):
+    stylesheet = write_stylesheet(str(tmp_path))
+    output = str(tmp_path / "reports" / "a.html")
+    os.makedirs(os.path.dirname(output))
+
+    generate_insights_report(
+        [make_insights("first"), make_insights("second")],
+        "paper.pdf",
+        "case",
+        "gpt-4o",
+        output,
+        stylesheet,
+    )
+
+    with open(output, encoding="utf-8") as f:
+        report = f.read()
+    assert '<link rel="stylesheet" href="../report.css">' in report
+    assert "<style>" not in report
+    assert report.index("Insight Set 1") < report.index("Insight Set 2")
+    assert report.rstrip().endswith("</html>")
+
+
+def test_stylesheet_is_written_next_to_a_report_by_default(tmp_path):
+    output = str(tmp_path / "a.html")
+
+    generate_insights_report([], "paper.pdf", "case", "gpt-4o", output)
+
+    with open(tmp_path / "report.css", encoding="utf-8") as f:
+        assert f.read() == STYLESHEET
+
+
+def test_quotes_are_escaped_and_unverified_ones_flagged():
+    f = io.StringIO()
+
+    write_insights(
+        f,
+        [
+            make_insights("<b>ties</b> & markets", verified=False),
+            make_insights("plain"),
+        ],
+    )
+
+    report = f.getvalue()
+    assert "&lt;b&gt;ties&lt;/b&gt; &amp; markets" in report
+    assert "the draft&#x27;s point" in report
+    assert report.count("quote-box unverified") == 1
+    assert report.count("Not found in the source document") == 1
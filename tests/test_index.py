@@ -0,0 +1,95 @@
+import asyncio
+from typing import List, cast
+
+import numpy as np
+import pytest
+
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.index import CorpusIndex, update_index
+from whiteanalysis.ingest import DocumentLoader
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def make_index(folder: str) -> CorpusIndex:
+    index = CorpusIndex(folder, "local")
+    index.add("a.pdf", "digest-a", [0, 1], np.stack([unit(1, 0, 0), unit(0, 1, 0)]))
+    index.add("b.pdf", "digest-b", [4], np.stack([unit(0, 0, 1)]))
+    return index
+
+
+def test_search_ranks_pages_by_similarity(tmp_path):
+    index = make_index(str(tmp_path))
+
+    hits = index.search(unit(0.1, 1, 0.5), top_k=2)
+
+    assert [(x.filename, x.page) for x in hits] == [("a.pdf", 1), ("b.pdf", 4)]
+    assert hits[0].score > hits[1].score
+    assert index.search(unit(1, 0, 0), top_k=10)[0].filename == "a.pdf"
+    assert len(index.search(unit(1, 0, 0), top_k=10)) == 3
+    assert index.search(unit(1, 0, 0), top_k=0) == []
+
+
+def test_removed_document_is_not_found(tmp_path):
+    index = make_index(str(tmp_path))
+
+    index.remove(["a.pdf"])
+    hits = index.search(unit(1, 1, 1), top_k=5)
+
+    assert [(x.filename, x.page, x.row) for x in hits] == [("b.pdf", 4, 0)]
+    assert index.data.rows == 1
+
+
+def test_index_is_reopened_from_disk(tmp_path):
+    make_index(str(tmp_path)).remove(["b.pdf"])
+
+    index = CorpusIndex(str(tmp_path), "local")
+    index.add("c.pdf", "digest-c", [2], np.stack([unit(0, 0, 1)]))
+
+    assert set(index.data.documents) == {"a.pdf", "c.pdf"}
+    assert index.search(unit(0, 0, 1), top_k=1)[0].filename == "c.pdf"
+    assert index.search(unit(0, 1, 0), top_k=1)[0].page == 1
+
+
+def test_other_embedder_starts_a_new_index(tmp_path):
+    make_index(str(tmp_path))
+
+    index = CorpusIndex(str(tmp_path), "text-embedding-3-small")
+
+    assert index.data.documents == {}
+    assert index.search(unit(1, 0, 0), top_k=3) == []
+
+
+def test_vectors_of_another_dimension_are_rejected(tmp_path):
+    index = make_index(str(tmp_path))
+
+    with pytest.raises(ValueError, match="c.pdf"):
+        index.add("c.pdf", "digest-c", [0], np.ones((1, 4), dtype=np.float32))
+    assert index.data.rows == 3
+
+
+class FakeLoader:
+    """Stands in for DocumentLoader; documents named "broken" fail to load."""
+
+    async def load(self, filename: str) -> List[PDFDocument]:
+        if "broken" in filename:
+            raise ValueError("Corrupt document")
+        return [PDFDocument(filename=filename, page=0, text=f"Text of {filename}")]
+
+
+def test_unreadable_document_is_skipped(tmp_path):
+    index = CorpusIndex(str(tmp_path / "index"), "local")
+    filenames = []
+    for name in ["good.pdf", "broken.pdf"]:
+        (tmp_path / name).write_text(name)
+        filenames.append(str(tmp_path / name))
+
+    asyncio.run(update_index(index, filenames, cast(DocumentLoader, FakeLoader())))
+
+    assert list(index.data.documents) == [filenames[0]]
+    assert index.data.rows == 1
+    changed, _ = asyncio.run(index.stale(filenames))
+    assert list(changed) == [filenames[1]]
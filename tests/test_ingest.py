@@ -0,0 +1,162 @@
+import asyncio
+from typing import List
+
+import pytest
+from docx import Document
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from whiteanalysis.cache import DocumentCache
+from whiteanalysis.file_handling import PDFDocument, iter_content_from_pdf
+from whiteanalysis.ingest import DocumentLoader, iter_document, load_document
+from whiteanalysis.metrics import get_counters, get_extractions, reset_metrics
+
+# Registers the byte-level test encoding with tiktoken, so that worker
+# processes can load it by name without downloading an encoding
+PLUGIN = """
+ENCODING_CONSTRUCTORS = {
+    "bytes": lambda: {
+        "name": "bytes",
+        "pat_str": r"\\S+|\\s+",
+        "mergeable_ranks": {bytes([i]): i for i in range(256)},
+        "special_tokens": {},
+    }
+}
+"""
+
+
+@pytest.fixture
+def worker_encodings(tmp_path, monkeypatch, encodings):
+    plugins = tmp_path / "plugins" / "tiktoken_ext"
+    plugins.mkdir(parents=True)
+    (plugins / "whiteanalysis_test.py").write_text(PLUGIN)
+    monkeypatch.syspath_prepend(str(tmp_path / "plugins"))
+    return encodings
+
+
+def write_docx(path: str, paragraphs: List[str]) -> str:
+    doc = Document()
+    for text in paragraphs:
+        doc.add_paragraph(text)
+    doc.save(path)
+    return path
+
+
+def make_documents(folder) -> List[str]:
+    return [
+        write_docx(
+            str(folder / f"doc{i}.docx"),
+            [f"Paragraph {j} of document {i} about social networks." for j in range(5)],
+        )
+        for i in range(3)
+    ]
+
+
+async def load_all(loader: DocumentLoader, filenames: List[str]):
+    try:
+        return await asyncio.gather(*(loader.load(x) for x in filenames))
+    finally:
+        loader.close()
+
+
+def texts(pages: List[PDFDocument]) -> List[str]:
+    return [x.text for x in pages]
+
+
+def test_process_pool_extracts_like_the_main_process(tmp_path, worker_encodings):
+    filenames = make_documents(tmp_path)
+    reset_metrics()
+
+    loaded = asyncio.run(
+        load_all(DocumentLoader(worker_encodings, workers=2), filenames)
+    )
+
+    for filename, pages in zip(filenames, loaded):
+        assert texts(pages) == texts(load_document(filename, worker_encodings))
+        assert pages[0].filename == filename
+    extractions = get_extractions()
+    assert set(extractions) == set(filenames)
+    assert all(x.extractor == "docx" for x in extractions.values())
+
+
+def test_loader_without_workers_uses_a_thread(tmp_path, encodings):
+    filenames = make_documents(tmp_path)
+    loader = DocumentLoader(encodings, workers=0)
+    assert loader.pool is None
+
+    loaded = asyncio.run(load_all(loader, filenames))
+
+    assert [len(x) for x in loaded] == [1, 1, 1]
+    assert "document 2" in loaded[2][0].text
+
+
+def write_pdf(path: str, pages: List[str]) -> str:
+    writer = PdfWriter()
+    font = DictionaryObject(
+        {
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        }
+    )
+    for text in pages:
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+        )
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+        page.replace_contents(content)
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+PDF_PAGES = [
+    f"Page {i} on the structure of markets and their networks" * 3 for i in range(3)
+]
+
+
+def test_pdf_pages_are_extracted_lazily(tmp_path, monkeypatch, encodings):
+    filename = write_pdf(str(tmp_path / "paper.pdf"), PDF_PAGES)
+    extracted: List[int] = []
+
+    def counting_pages(file, filename):
+        for page in iter_content_from_pdf(file, filename):
+            extracted.append(page.page)
+            yield page
+
+    monkeypatch.setattr("whiteanalysis.ingest.iter_content_from_pdf", counting_pages)
+    monkeypatch.setattr("whiteanalysis.cache._document_cache", None)
+    reset_metrics()
+    pages = iter_document(filename, encodings)
+
+    first = next(pages)
+    assert first.page == 0 and first.text.startswith("Page 0")
+    assert extracted == [0]
+
+    assert [x.page for x in pages] == [1, 2]
+    assert get_extractions()[filename].extractor == "pdf"
+    assert get_extractions()[filename].pages == 3
+
+
+def test_document_is_cached_once_all_pages_are_read(tmp_path, monkeypatch, encodings):
+    filename = write_pdf(str(tmp_path / "paper.pdf"), PDF_PAGES)
+    monkeypatch.setattr(
+        "whiteanalysis.cache._document_cache", DocumentCache(str(tmp_path / "cache"))
+    )
+    reset_metrics()
+
+    partial = iter_document(filename, encodings)
+    next(partial)
+    partial.close()
+    assert get_counters()["document_cache_misses"] == 1
+
+    extracted = list(iter_document(filename, encodings))
+    cached = list(iter_document(filename, encodings))
+
+    assert get_counters() == {"document_cache_misses": 2, "document_cache_hits": 1}
+    assert texts(cached) == texts(extracted)
+    assert [x.token_count(encodings) for x in cached] == [
+        len(x.text.encode()) for x in extracted
+    ]
@@ -0,0 +1,45 @@
+from typing import Literal, Optional
+
+import typer
+from pydantic import BaseModel, Field
+from typer.testing import CliRunner
+
+from whiteanalysis.main import option_groups
+
+
+class Settings(BaseModel):
+    size: int = Field(default=3, description="Size of the thing")
+    label: Optional[str] = None
+    mode: Literal["fast", "slow"] = "fast"
+
+
+def make_app(seen: list) -> typer.Typer:
+    app = typer.Typer()
+
+    @app.command()
+    @option_groups(settings=Settings)
+    def command(name: str = "x", *, settings: Settings) -> None:
+        seen.append((name, settings))
+
+    return app
+
+
+def test_fields_become_options():
+    seen: list = []
+
+    result = CliRunner().invoke(
+        make_app(seen), ["--name", "y", "--size", "5", "--mode", "slow"]
+    )
+
+    assert result.exit_code == 0, result.output
+    assert seen == [("y", Settings(size=5, mode="slow"))]
+
+
+def test_defaults_and_choices_come_from_the_model():
+    seen: list = []
+    app = make_app(seen)
+
+    assert CliRunner().invoke(app, []).exit_code == 0
+    assert seen == [("x", Settings())]
+    assert CliRunner().invoke(app, ["--mode", "medium"]).exit_code != 0
+    assert "Size of the thing" in CliRunner().invoke(app, ["--help"]).output
@@ -0,0 +1,78 @@
+from whiteanalysis.manifest import RunManifest, summarize
+from whiteanalysis.prompts import Insights, Quote
+
+
+def make_insights(text: str) -> Insights:
+    quote = Quote(
+        context="context",
+        position="Page 1",
+        text=text,
+        issue_in_draft="issue",
+        relation="relation",
+    )
+    return Insights(general_context="general", general_relation="", quotes=[quote])
+
+
+def test_checkpointed_batches_survive_a_resume(tmp_path):
+    run = str(tmp_path)
+    manifest = RunManifest.create(run, {"model": "gpt-4o"})
+    checkpoint = manifest.checkpoint("docs/paper.pdf", "case")
+    checkpoint.save(0, "key-0", make_insights("first"))
+    checkpoint.fail(1, "key-1", RuntimeError("rate limited"))
+    manifest.flush()
+
+    resumed = RunManifest.load(run).checkpoint("docs/paper.pdf", "case")
+    stored = resumed.load(0, "key-0")
+
+    assert stored is not None
+    assert stored.batch == 0
+    assert stored.quotes[0].text == "first"
+    # A changed prompt or a failed batch is sent again
+    assert resumed.load(0, "key-changed") is None
+    assert resumed.load(1, "key-1") is None
+    assert resumed.load(2, "key-2") is None
+
+
+def test_documents_with_the_same_stem_keep_separate_responses(tmp_path):
+    manifest = RunManifest.create(str(tmp_path), {})
+    manifest.checkpoint("a/paper.pdf", "case").save(0, "key", make_insights("pdf"))
+    manifest.checkpoint("b/paper.pdf", "case").save(0, "key", make_insights("other"))
+
+    stored = manifest.checkpoint("a/paper.pdf", "case").load(0, "key")
+
+    assert stored is not None
+    assert stored.quotes[0].text == "pdf"
+
+
+def test_case_is_done_until_its_text_or_outputs_change(tmp_path):
+    run = str(tmp_path)
+    report = tmp_path / "report.html"
+    report.write_text("report")
+    manifest = RunManifest.create(run, {})
+    manifest.record_case("paper.pdf", "case", "draft", [str(report)], complete=True)
+
+    resumed = RunManifest.load(run)
+
+    assert resumed.document_done("paper.pdf", {"case": "draft"})
+    assert not resumed.case_done("paper.pdf", "case", "edited draft")
+    report.unlink()
+    assert not resumed.case_done("paper.pdf", "case", "draft")
+
+
+def test_incomplete_case_is_retried(tmp_path):
+    manifest = RunManifest.create(str(tmp_path), {})
+    manifest.record_case("paper.pdf", "case", "draft", [], complete=False)
+
+    assert not manifest.case_done("paper.pdf", "case", "draft")
+    assert summarize(manifest) == {"done": 0, "failed": 1}
+
+
+def test_changed_document_resets_its_cases(tmp_path):
+    manifest = RunManifest.create(str(tmp_path), {})
+    manifest.update_digest("paper.pdf", "digest-1")
+    manifest.record_case("paper.pdf", "case", "draft", [], complete=True)
+
+    assert not manifest.update_digest("paper.pdf", "digest-1")
+    assert manifest.case_done("paper.pdf", "case", "draft")
+    assert manifest.update_digest("paper.pdf", "digest-2")
+    assert not manifest.case_done("paper.pdf", "case", "draft")
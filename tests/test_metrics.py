@@ -0,0 +1,70 @@
+import pytest
+from openai.types import CompletionUsage
+
+from whiteanalysis.metrics import (
+    MetricsSnapshot,
+    drain,
+    get_counters,
+    increment,
+    merge,
+    prometheus_text,
+    record_extraction,
+    reset_metrics,
+    run_summary,
+    write_prometheus,
+)
+from whiteanalysis.timing import get_stages, record_stage, stage
+from whiteanalysis.usage import UsageStats, record_usage, reset_usage, usage_label
+
+
+def test_worker_metrics_are_merged_into_the_parent():
+    reset_metrics()
+    increment("document_cache_misses")
+    record_stage("extract", 2.0)
+    record_extraction("a.pdf", "pdf", 2.0, 10)
+    snapshot = MetricsSnapshot.model_validate_json(drain().model_dump_json())
+    assert get_counters() == {} and get_stages() == {}
+
+    increment("document_cache_misses", 2)
+    with stage("extract"):
+        pass
+    merge(snapshot)
+
+    assert get_counters() == {"document_cache_misses": 3}
+    assert get_stages()["extract"].count == 2
+    assert get_stages()["extract"].max_seconds == 2.0
+
+
+def test_batch_usage_costs_half():
+    usage = UsageStats(prompt_tokens=1_000_000, completion_tokens=100_000)
+
+    assert usage.cost("gpt-4o-mini") == pytest.approx(0.21)
+    assert usage.cost(usage_label("gpt-4o-mini", "batch")) == pytest.approx(0.105)
+    assert usage.cost("unknown-model") is None
+
+
+def test_summary_is_written_in_the_prometheus_format(tmp_path):
+    reset_metrics()
+    reset_usage()
+    increment("response_cache_hits", 4)
+    record_stage("llm", 1.5)
+    record_extraction("docs/a paper.pdf", "pdf", 0.25, 3)
+    record_usage(
+        "gpt-4o",
+        CompletionUsage(prompt_tokens=100, completion_tokens=20, total_tokens=120),
+        latency=0.5,
+    )
+    path = str(tmp_path / "metrics.prom")
+
+    write_prometheus(run_summary(3.0), path)
+
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    assert text == prometheus_text(run_summary(3.0))
+    assert "# TYPE whiteanalysis_stage_seconds_total counter" in text
+    assert 'whiteanalysis_stage_seconds_total{stage="llm"} 1.5' in text
+    assert "whiteanalysis_response_cache_hits_total 4" in text
+    assert (
+        'whiteanalysis_extraction_seconds{file="a paper.pdf",extractor="pdf"}' in text
+    )
+    assert 'whiteanalysis_api_prompt_tokens_total{model="gpt-4o"} 100' in text
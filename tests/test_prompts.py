@@ -0,0 +1,165 @@
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.prompts import (
+    PageIndex,
+    create_batch_prompt,
+    create_full_paper_prompts,
+    create_multi_case_prompt,
+    create_prompts,
+    group_cases,
+    iter_batches,
+    multi_case_model,
+    return_pages,
+    split_multi_case,
+)
+
+
+def make_pages(*sizes: int) -> list[PDFDocument]:
+    return [
+        PDFDocument(filename="doc.pdf", page=i, text="x" * size)
+        for i, size in enumerate(sizes)
+    ]
+
+
+def page_numbers(batches: list[list[PDFDocument]]) -> list[list[int]]:
+    return [[x.page for x in batch] for batch in batches]
+
+
+def test_batches_are_packed_up_to_the_budget(encodings):
+    batches = list(iter_batches(make_pages(40, 40, 20, 30, 100), 100, encodings))
+
+    assert page_numbers(batches) == [[0, 1, 2], [3], [4]]
+    assert all(sum(x.token_count(encodings) for x in b) <= 100 for b in batches)
+
+
+def test_long_page_overflows_into_its_own_batch(encodings):
+    batches = list(iter_batches(make_pages(10, 250, 10), 100, encodings))
+
+    assert page_numbers(batches) == [[0], [1], [2]]
+
+
+def test_long_page_is_split_within_the_budget(encodings):
+    text = "\n\n".join("y" * 60 for _ in range(4))
+    pages = [PDFDocument(filename="doc.pdf", page=0, text=text)]
+
+    batches = list(iter_batches(pages, 100, encodings, split_pages=True))
+
+    parts = [x for batch in batches for x in batch]
+    assert len(parts) > 1
+    assert all(x.page == 0 and x.token_count(encodings) <= 100 for x in parts)
+    assert "".join(x.text for x in parts) == text
+
+
+def test_pages_are_consumed_lazily(encodings):
+    consumed = []
+
+    def pages():
+        for page in make_pages(60, 60, 60):
+            consumed.append(page.page)
+            yield page
+
+    batches = iter_batches(pages(), 100, encodings)
+
+    assert page_numbers([next(batches)]) == [[0]]
+    assert consumed == [0, 1]
+
+
+def test_source_first_layout_shares_the_prefix_between_cases(encodings):
+    pages = make_pages(10, 20)
+
+    first = create_batch_prompt(pages, "draft one", "source_first")
+    second = create_batch_prompt(pages, "draft two", "source_first")
+
+    assert first[:-1] == second[:-1]
+    assert first[-1]["content"] == "<DRAFT> \ndraft one</DRAFT>\n"
+
+
+def test_draft_first_layout_puts_the_draft_before_the_source(encodings):
+    prompt = create_full_paper_prompts(make_pages(10, 20), "draft", encodings)
+
+    assert prompt[1]["content"].startswith("<DRAFT>")
+    assert [x["content"].split(">")[0] for x in prompt[2:]] == [
+        "<PAGE page=0",
+        "<PAGE page=1",
+    ]
+
+
+def test_multi_case_model_asks_for_every_case_by_name():
+    names = ("Case A: networks", "Case B")
+    model = multi_case_model(names)
+    empty = {"general_context": "", "general_relation": "", "quotes": []}
+
+    response = model.model_validate(
+        {names[0]: {**empty, "general_context": "a"}, names[1]: empty}
+    )
+    insights = split_multi_case(response, list(names))
+
+    assert list(model.model_json_schema()["properties"]) == list(names)
+    assert multi_case_model(names) is model
+    assert insights[names[0]].general_context == "a"
+    assert insights[names[1]].quotes == []
+
+
+def test_compact_multi_case_model_holds_quote_spans():
+    model = multi_case_model(("a",), "compact")
+
+    definitions = model.model_json_schema()["$defs"]
+
+    assert "QuoteSpan" in definitions and "Quote" not in definitions
+
+
+def test_cases_are_grouped_by_count_and_draft_tokens(encodings):
+    cases = {"a": "x" * 10, "b": "x" * 10, "c": "x" * 10, "d": "x" * 50, "e": "x"}
+
+    groups = group_cases(cases, max_cases=2, max_tokens=40, encodings=encodings)
+
+    assert [list(x) for x in groups] == [["a", "b"], ["c"], ["d"], ["e"]]
+
+
+def test_multi_case_prompt_holds_every_draft_under_its_name():
+    prompt = create_multi_case_prompt(
+        make_pages(10), {"a": "first", "b": "second"}, "source_first"
+    )
+
+    drafts = [x["content"] for x in prompt if x["content"].startswith("<DRAFT")]
+    assert drafts == [
+        '<DRAFT case="a"> \nfirst</DRAFT>\n',
+        '<DRAFT case="b"> \nsecond</DRAFT>\n',
+    ]
+    assert prompt[-1]["content"] == drafts[-1]
+
+
+def test_window_is_cut_at_the_document_edges(encodings):
+    pages = make_pages(10, 20, 30, 40)
+    index = PageIndex(pages, encodings)
+
+    focal, before, after = index.window(0, 2)
+
+    assert (focal.page, [x.page for x in before], [x.page for x in after]) == (
+        0,
+        [],
+        [1, 2],
+    )
+    assert index.window_tokens(0, 2) == 60
+    assert index.window_tokens(3, 1) == 70
+
+
+def test_focal_page_is_found_by_its_page_number():
+    pages = [
+        PDFDocument(filename="doc.pdf", page=i, text=f"page {i}") for i in (7, 8, 9)
+    ]
+
+    focal, before, after = return_pages(pages, 8, 1)
+
+    assert (focal.page, before[0].page, after[0].page) == (8, 7, 9)
+
+
+def test_focal_prompt_labels_pages_from_the_start_of_the_window():
+    pages = make_pages(5, 5, 5, 5)
+
+    prompt = create_prompts(pages, 2, 1, "draft", "source_first", label_pages=True)
+
+    source = prompt[-2]["content"]
+    assert prompt[-1]["content"] == "<DRAFT> \ndraft</DRAFT>\n"
+    assert "<FOCAL PAGE> \n<PAGE page=1> \nxxxxx</PAGE>" in source
+    assert "<PAGE page=0>" in source and "<PAGE page=2>" in source
+    assert "<PAGE page=3>" not in source
@@ -0,0 +1,88 @@
+import asyncio
+
+import httpx
+
+from whiteanalysis.rate_limit import (
+    RateLimiter,
+    TokenBucket,
+    get_rate_limiter,
+    observe_response_sync,
+    parse_reset,
+)
+
+
+def test_bucket_refills_with_time():
+    bucket = TokenBucket(600)
+    now = bucket.updated
+    bucket.consume(600)
+
+    assert bucket.wait_time(100, now) == 10.0
+    assert bucket.wait_time(100, now + 5) == 5.0
+    assert bucket.wait_time(100, now + 10) == 0.0
+    assert bucket.wait_time(100, now + 1000) == 0.0
+    assert bucket.level == 600
+
+
+def test_requests_above_capacity_wait_for_a_full_bucket():
+    bucket = TokenBucket(60)
+    now = bucket.updated
+    bucket.consume(30)
+
+    assert bucket.wait_time(1000, now) == 30.0
+
+
+def test_parse_reset():
+    assert parse_reset("1s") == 1.0
+    assert parse_reset("6m0s") == 360.0
+    assert parse_reset("20ms") == 0.02
+    assert parse_reset("0.5") == 0.5
+    assert parse_reset(None) == 0.0
+
+
+def test_unused_completion_tokens_are_refunded():
+    limiter = RateLimiter(100, 10_000)
+
+    reserved = asyncio.run(limiter.acquire(1_000, 2_000))
+    assert reserved == 3_000
+    assert limiter.tokens.level == 7_000
+
+    limiter.settle(reserved, 1_200)
+    assert limiter.tokens.level == 8_800
+
+
+def test_usage_beyond_the_reservation_is_charged():
+    limiter = RateLimiter(100, 10_000)
+    reserved = asyncio.run(limiter.acquire(1_000))
+
+    limiter.settle(reserved, 1_500)
+
+    assert limiter.tokens.level == 8_500
+
+
+def test_rate_limited_response_pauses_calls():
+    limiter = get_rate_limiter("test-model-429", 100, 10_000)
+    request = httpx.Request(
+        "POST", "https://api.test/v1/chat/completions", json={"model": "test-model-429"}
+    )
+    response = httpx.Response(429, headers={"retry-after": "20"}, request=request)
+
+    observe_response_sync(response)
+
+    assert limiter.paused_until - limiter.tokens.updated >= 19.0
+    assert limiter.tokens.level == 0
+
+
+def test_headers_resize_default_budgets_only():
+    limiter = get_rate_limiter("gpt-4o-mini-2024-07-18")
+    assert limiter.tokens.capacity == 200_000
+    headers = httpx.Headers(
+        {"x-ratelimit-limit-tokens": "2000000", "x-ratelimit-remaining-tokens": "5"}
+    )
+
+    limiter.observe_headers(headers)
+    assert limiter.tokens.capacity == 2_000_000
+    assert limiter.tokens.level <= 5
+
+    explicit = get_rate_limiter("test-model-explicit", tokens_per_minute=1_000)
+    explicit.observe_headers(headers)
+    assert explicit.tokens.capacity == 1_000
@@ -0,0 +1,44 @@
+import asyncio
+
+import numpy as np
+
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.retrieval import pages_for, relevant_pages, select_pages
+
+TEXTS = [
+    "Prices and markets in the production economy.",
+    "Vacancy chains move jobs through organizations.",
+    "Identity and control emerge from social networks and ties.",
+    "Disciplines such as councils, arenas and interfaces.",
+    "Rhetoric of stories told about networks and ties.",
+]
+
+
+def make_pages() -> list[PDFDocument]:
+    return [PDFDocument(filename="a.pdf", page=i, text=x) for i, x in enumerate(TEXTS)]
+
+
+def test_best_pages_are_kept_with_their_neighbors():
+    scores = np.array([0.1, 0.9, 0.2, 0.3, 0.8, 0.0])
+
+    assert select_pages(scores, 1, 0).tolist() == [1]
+    assert select_pages(scores, 2, 1).tolist() == [0, 1, 2, 3, 4, 5]
+    assert select_pages(scores, 1, 2).tolist() == [0, 1, 2, 3]
+    assert select_pages(scores, 10, 0).tolist() == [0, 1, 2, 3, 4, 5]
+
+
+def test_pages_are_selected_per_case():
+    cases = {"identity": "identity control social networks", "jobs": "vacancy jobs"}
+
+    selected = asyncio.run(relevant_pages(make_pages(), cases, 1, 0, "local"))
+
+    assert selected["identity"].tolist() == [2]
+    assert selected["jobs"].tolist() == [1]
+    assert [x.page for x in pages_for(make_pages(), selected, list(cases))] == [1, 2]
+    assert pages_for(make_pages(), None, ["identity"]) == make_pages()
+
+
+def test_documents_without_pages_select_nothing():
+    selected = asyncio.run(relevant_pages([], {"case": "draft"}, 2, 1, "local"))
+
+    assert selected["case"].tolist() == []
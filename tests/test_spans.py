@@ -0,0 +1,83 @@
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.prompts import CompactInsights, QuoteSpan
+from whiteanalysis.spans import BatchText, normalize, resolve_insights, resolve_quote
+
+PAGES = [
+    PDFDocument(
+        filename="a.pdf",
+        page=4,
+        text="Markets are tangible cliques of producers watching each other. "
+        "Identities arise",
+    ),
+    PDFDocument(
+        filename="a.pdf",
+        page=5,
+        text="from the control efforts of actors. Markets are tangible cliques "
+        "again, on a later page.",
+    ),
+]
+
+
+def make_span(start: str, end: str, page: int = 0) -> QuoteSpan:
+    return QuoteSpan(
+        page=page, start=start, end=end, issue_in_draft="issue", relation="relation"
+    )
+
+
+def test_normalize_keeps_one_position_per_character():
+    text = "İstanbul  Ties—Weak"
+
+    normalized, positions = normalize(text)
+
+    assert len(positions) == len(normalized)
+    assert normalized[positions.index(text.index("T"))] == "t"
+    assert [text[x] for x in positions[-4:]] == list("Weak")
+
+
+def test_quote_after_expanding_character_is_cut_exactly():
+    pages = [PDFDocument(filename="a.pdf", page=0, text="İİİ ties bind actors.")]
+
+    quote = resolve_quote(make_span("ties bind", "actors."), BatchText(pages))
+
+    assert quote.text == "ties bind actors."
+
+
+def test_quote_across_a_page_break_is_taken_from_the_page_text():
+    span = make_span("identities ARISE", "Control\n efforts of actors.")
+
+    quote = resolve_quote(span, BatchText(PAGES))
+
+    assert quote.text == "Identities arise from the control efforts of actors."
+    assert quote.position == "Page 5"
+    assert quote.context.startswith("Markets are tangible")
+
+
+def test_start_anchor_is_searched_from_the_stated_page():
+    span = make_span("Markets are tangible cliques", "later page.", page=1)
+
+    quote = resolve_quote(span, BatchText(PAGES))
+
+    assert quote.text == "Markets are tangible cliques again, on a later page."
+    assert quote.position == "Page 6"
+
+
+def test_unresolved_span_keeps_its_anchors():
+    quote = resolve_quote(make_span("not in the text", "at all"), BatchText(PAGES))
+
+    assert quote.text == "not in the text [...] at all"
+    assert quote.position == "Page 5"
+    assert quote.context == ""
+
+
+def test_compact_response_becomes_insights():
+    response = CompactInsights(
+        general_context="markets",
+        general_relation="",
+        quotes=[make_span("producers watching", "each other.")],
+    )
+
+    insights = resolve_insights(response, PAGES)
+
+    assert insights.general_context == "markets"
+    assert insights.quotes[0].text == "producers watching each other."
+    assert insights.quotes[0].issue_in_draft == "issue"
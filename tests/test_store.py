@@ -0,0 +1,45 @@
+from whiteanalysis.prompts import Insights, Quote, empty_insights
+from whiteanalysis.store import InsightStore
+
+
+def make_insights(*texts: str) -> Insights:
+    quotes = [
+        Quote(
+            context="context",
+            position="Page 1",
+            text=text,
+            issue_in_draft="issue",
+            relation="relation",
+        )
+        for text in texts
+    ]
+    return Insights(general_context="general", general_relation="", quotes=quotes)
+
+
+def test_verification_is_matched_by_batch(tmp_path):
+    store = InsightStore(str(tmp_path / "insights.sqlite"))
+    run = str(tmp_path / "run")
+    store.put_insights(run, "gpt-4o", "doc.pdf", "case", 0, make_insights("first"))
+    store.put_insights(run, "gpt-4o", "doc.pdf", "case", 2, make_insights("third"))
+
+    # Batch 1 failed, so it is neither stored nor in the report
+    verified = make_insights("third").model_copy(deep=True)
+    verified.batch = 2
+    verified.quotes[0].verified = False
+    verified.quotes[0].position = "Page 7"
+    store.put_verification(run, "doc.pdf", "case", [verified])
+
+    _, stored = store.insights(run, "doc.pdf", "case")
+    assert [x.batch for x in stored] == [0, 2]
+    assert stored[0].quotes[0].verified is None
+    assert stored[1].quotes[0].verified is False
+    assert stored[1].quotes[0].position == "Page 7"
+
+
+def test_empty_insights_replace_stored_batch(tmp_path):
+    store = InsightStore(str(tmp_path / "insights.sqlite"))
+    run = str(tmp_path / "run")
+    store.put_insights(run, "gpt-4o", "doc.pdf", "case", 0, make_insights("first"))
+    store.put_insights(run, "gpt-4o", "doc.pdf", "case", 0, empty_insights())
+
+    assert store.insights(run, "doc.pdf", "case") == (None, [])
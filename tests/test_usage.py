@@ -0,0 +1,27 @@
+from openai.types import CompletionUsage
+from openai.types.completion_usage import PromptTokensDetails
+
+from whiteanalysis.usage import get_usage, record_usage, reset_usage
+
+
+def make_usage(prompt: int, cached: int, completion: int) -> CompletionUsage:
+    return CompletionUsage(
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        total_tokens=prompt + completion,
+        prompt_tokens_details=PromptTokensDetails(cached_tokens=cached),
+    )
+
+
+def test_cached_prompt_tokens_are_counted():
+    reset_usage()
+
+    record_usage("gpt-4o", make_usage(1000, 0, 100), latency=2.0)
+    record_usage("gpt-4o", make_usage(1000, 768, 100), latency=1.0)
+    record_usage("gpt-4o", None)
+
+    stats = get_usage()["gpt-4o"]
+    assert stats.calls == 2
+    assert stats.cached_tokens == 768
+    assert stats.cache_hit_rate == 0.384
+    assert stats.max_latency_seconds == 2.0
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from whiteanalysis.rate_limit import observe_response, observe_response_sync
+from whiteanalysis.utils import (
+    close_async_client,
+    configure_clients,
+    return_async_client,
+    return_client,
+)
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    yield
+    configure_clients()
+
+
+def test_client_is_shared_until_reconfigured():
+    first = return_client()
+    assert return_client() is first
+    assert first[1]._client.event_hooks["response"] == [observe_response_sync]
+
+    configure_clients(timeout=30.0)
+    second = return_client()
+
+    assert second is not first
+    assert second[1].timeout.read == 30.0
+
+
+def test_async_client_is_shared_within_a_loop():
+    async def clients():
+        first = return_async_client()
+        second = return_async_client()
+        await close_async_client()
+        return first, second
+
+    first, second = asyncio.run(clients())
+    assert first is second
+    assert first[1].max_retries == 0
+    assert first[1]._client.event_hooks["response"] == [observe_response]
+    assert first[1].is_closed()
+
+    other, _ = asyncio.run(clients())
+    assert other is not first
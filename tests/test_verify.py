@@ -0,0 +1,79 @@
+from whiteanalysis.file_handling import PDFDocument
+from whiteanalysis.prompts import Quote
+from whiteanalysis.verify import QuoteIndex, verify_quote
+
+PAGES = [
+    PDFDocument(
+        filename="paper.pdf",
+        page=0,
+        text="Firms adopt new routines when their managers observe peers. "
+        "The effect is strongest in dense regional networks.",
+    ),
+    PDFDocument(
+        filename="paper.pdf",
+        page=1,
+        text="Adoption slows once the novelty of a practice wears off and "
+        "its costs become visible to the organization.",
+    ),
+]
+
+
+def make_quote(text: str, position: str = "Page 1") -> Quote:
+    return Quote(
+        context="context",
+        position=position,
+        text=text,
+        issue_in_draft="issue",
+        relation="relation",
+    )
+
+
+def test_exact_quote_is_verified_on_its_page():
+    index = QuoteIndex(PAGES)
+    quote = make_quote("the effect is strongest in dense regional networks")
+
+    verified = verify_quote(quote, index)
+
+    assert verified.verified is True
+    assert verified.position == "Page 1"
+
+
+def test_quote_with_changed_words_is_found_and_relocated():
+    index = QuoteIndex(PAGES)
+    quote = make_quote(
+        "Adoption slows once the novelty of the practice wears off, and its "
+        "costs become visible to the organization",
+        position="Page 1, Paragraph 2",
+    )
+
+    verified = verify_quote(quote, index)
+
+    assert verified.verified is True
+    assert verified.position == "Page 2"
+
+
+def test_quote_across_a_page_break_is_found():
+    index = QuoteIndex(PAGES[:1])
+    index.add(PAGES[1:])
+
+    match = index.locate("strongest in dense regional networks. Adoption slows once")
+
+    assert match is not None
+    assert match.page == 0
+    assert match.score == 1.0
+
+
+def test_invented_quote_is_marked_unverified():
+    index = QuoteIndex(PAGES)
+    quote = make_quote("Managers rarely imitate competitors in sparse markets")
+
+    verified = verify_quote(quote, index)
+
+    assert verified.verified is False
+    assert verified.position == "Page 1"
+
+
+def test_short_quote_is_left_unchecked():
+    quote = make_quote("dense networks")
+
+    assert verify_quote(quote, QuoteIndex(PAGES)).verified is None
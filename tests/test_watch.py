@@ -0,0 +1,50 @@
+import os
+
+from whiteanalysis.watch import FolderWatcher
+
+
+def write(path, text: str, mtime: int) -> str:
+    path.write_text(text)
+    os.utime(path, ns=(mtime, mtime))
+    return str(path)
+
+
+def test_files_present_at_the_first_poll_are_reported(tmp_path):
+    a = write(tmp_path / "a.pdf", "a", 1)
+    inputs = write(tmp_path / "cases.json", "{}", 1)
+    watcher = FolderWatcher(inputs)
+
+    changes = watcher.poll([a])
+
+    assert changes.added == [a]
+    assert changes.cases_changed
+    assert not watcher.poll([a])
+
+
+def test_new_file_is_reported_once_it_is_complete(tmp_path):
+    watcher = FolderWatcher(write(tmp_path / "cases.json", "{}", 1))
+    watcher.poll([])
+    b = write(tmp_path / "b.pdf", "partial", 2)
+
+    assert watcher.poll([b]).added == []
+    write(tmp_path / "b.pdf", "partial and complete", 3)
+    assert watcher.poll([b]).added == []
+    assert watcher.poll([b]).added == [b]
+    assert not watcher.poll([b])
+
+
+def test_changed_and_removed_files_are_reported(tmp_path):
+    a = write(tmp_path / "a.pdf", "a", 1)
+    b = write(tmp_path / "b.pdf", "b", 1)
+    inputs = write(tmp_path / "cases.json", "{}", 1)
+    watcher = FolderWatcher(inputs)
+    watcher.poll([a, b])
+
+    write(tmp_path / "a.pdf", "edited", 5)
+    write(tmp_path / "cases.json", '{"case": "draft"}', 5)
+    os.remove(b)
+    first = watcher.poll([a])
+    second = watcher.poll([a])
+
+    assert first.removed == [b] and first.changed == [] and not first.cases_changed
+    assert second.changed == [a] and second.cases_changed